@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from . import transnetv2
+    from .segmentation import segmentation_stages
+    from .segmentation_result import job_dir
+    from .frame_pipeline import width, height
+except ImportError:
+    import transnetv2
+    from segmentation import segmentation_stages
+    from segmentation_result import job_dir
+    from frame_pipeline import width, height
+
+# segments a directory (or a manifest) of clips with a fixed pool of worker processes.
+# every worker imports TensorFlow and loads TransNetV2 once when it starts and keeps it
+# for all the clips it gets. each clip runs the stages of the final player in its own
+# <output_dir>/<parent>_<name> directory (segments.seg, scene.txt, shot.txt, subshot.txt),
+# so re-running a batch only redoes what changed. a clip that fails is reported and the
+# batch goes on. a worker that dies breaks the pool: the clips that had not started yet go to
+# a new pool, the ones that were running are retried alone so only the clip that kills its
+# worker again is failed.
+REPORT_NAME = "batch_report.json"
+
+
+def find_clips(source):
+    # [{"name", "rgb", "wav", "mp4"}] of a directory of <name>.rgb/<name>.wav(/<name>.mp4) files,
+    # or of a manifest: a json list of {"rgb", "wav", "mp4"} or lines of "rgb wav [mp4]".
+    # relative paths in a manifest are relative to it
+    clips = []
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            name, ext = os.path.splitext(filename)
+            if ext != ".rgb":
+                continue
+            mp4 = os.path.join(source, name + ".mp4")
+            clips.append({"name": name, "rgb": os.path.join(source, filename),
+                          "wav": os.path.join(source, name + ".wav"),
+                          "mp4": mp4 if os.path.exists(mp4) else None})
+        return clips
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r") as f:
+        text = f.read()
+    if source.endswith(".json"):
+        entries = json.loads(text)
+    else:
+        entries = []
+        for line in text.splitlines():
+            fields = line.split()
+            if fields and not fields[0].startswith("#"):
+                entries.append(dict(zip(("rgb", "wav", "mp4"), fields)))
+    for entry in entries:
+        clip = {key: os.path.join(base, entry[key]) if entry.get(key) else None for key in ("rgb", "wav", "mp4")}
+        clip["name"] = entry.get("name") or os.path.splitext(os.path.basename(clip["rgb"]))[0]
+        clips.append(clip)
+    return clips
+
+
+_started = None
+
+
+def _init_worker(tf_threads, backend, started):
+    # runs once per worker process, the model stays loaded for every clip of the worker.
+    # started is shared with the parent, a flag per clip set as the clip begins
+    global _started
+    _started = started
+    try:
+        transnetv2.set_backend(backend)
+        transnetv2.set_threads(tf_threads)
+        transnetv2.get_model()
+    except Exception:
+        # reported with the clips, a worker without the model still fails them one by one
+        traceback.print_exc()
+
+
+def segment_clip(clip, output_dir, encode=False, shot_size=None, force=(), threads=0, shot_workers=None):
+    # the stages of one clip, never raises. shot_workers: threads / processes of the shot stage
+    t1 = time.time()
+    result = {"name": clip["name"], "rgb": clip["rgb"], "pid": os.getpid()}
+    try:
+        for key in ("rgb", "wav"):
+            if not clip.get(key) or not os.path.exists(clip[key]):
+                raise FileNotFoundError("no .{} file for {}".format(key, clip["name"]))
+        result["output_dir"] = job_dir(clip["rgb"], output_dir)
+        graph = segmentation_stages(clip["rgb"], clip["wav"], result["output_dir"], clip.get("mp4"),
+                                    export_txt=True, threads=threads, shot_size=shot_size, encode=encode,
+                                    shot_workers=shot_workers)
+        outputs = graph.run(force)
+        result.update({
+            "status": "ok",
+            "frames": os.path.getsize(clip["rgb"]) // (width * height * 3),
+            "scenes": len(outputs["timestamps"]),
+            "executed": graph.executed,
+            "timings": graph.timings,
+        })
+    except Exception as exc:
+        result.update({"status": "failed", "error": "{}: {}".format(type(exc).__name__, exc),
+                       "traceback": traceback.format_exc()})
+    result["seconds"] = time.time() - t1
+    return result
+
+
+def _segment_in_worker(i, clip, output_dir, options):
+    _started[i] = 1
+    return segment_clip(clip, output_dir, **options)
+
+
+def _run_pool(clips, indices, results, output_dir, workers, tf_threads, backend, options, on_result):
+    # fills in the results of the clips at indices, returns the indices lost to a pool that broke
+    # and the flags of the clips that had started
+    context = multiprocessing.get_context("spawn")
+    started = context.Array("b", len(clips), lock=False)
+    lost = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(tf_threads, backend, started)) as executor:
+        futures = {executor.submit(_segment_in_worker, i, clips[i], output_dir, options): i for i in indices}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except BrokenProcessPool:
+                lost.append(i)
+                continue
+            on_result(results[i])
+    return sorted(lost), started
+
+
+def _worker_died(clip):
+    return {"name": clip["name"], "rgb": clip["rgb"], "status": "failed", "error": "worker process died",
+            "seconds": 0.}
+
+
+def run_batch(clips, output_dir="results", workers=None, tf_threads=None, encode=False, shot_size=None, force=(),
+              backend=None):
+    # segments every clip, returns the report that is also written to <output_dir>/batch_report.json
+    backend = backend or transnetv2.backend_name()
+    workers = max(1, min(workers or max(1, (os.cpu_count() or 1) // 4), len(clips) or 1))
+    tf_threads = tf_threads or max(1, (os.cpu_count() or 1) // workers)
+    # the workers share the cores, parallel shot scoring in each of them only gets its part
+    options = {"encode": encode, "shot_size": shot_size, "force": tuple(force),
+               "shot_workers": max(1, (os.cpu_count() or 1) // workers)}
+    done = []
+    t1 = time.time()
+
+    def on_result(result):
+        done.append(result)
+        line = "[Batch] {}/{} {}: {} in {:.1f}s".format(len(done), len(clips), result["name"], result["status"],
+                                                        result["seconds"])
+        if result["status"] != "ok":
+            line += " ({})".format(result["error"])
+        print(line)
+        sys.stdout.flush()
+
+    print("[Batch] {} clips on {} workers with {} {} threads each".format(len(clips), workers, tf_threads, backend))
+    results = [None] * len(clips)
+    pending = list(range(len(clips)))
+    while pending:
+        lost, started = _run_pool(clips, pending, results, output_dir, workers, tf_threads, backend, options,
+                                  on_result)
+        running = [i for i in lost if started[i]]
+        if lost and not running and len(lost) == len(pending):
+            # the workers died before any clip began, another pool would too
+            print("[Batch] Workers died before starting a clip")
+            for i in lost:
+                results[i] = _worker_died(clips[i])
+                on_result(results[i])
+            break
+        if running:
+            # one of these killed its worker, the others were taken down with it
+            print("[Batch] A worker died, retrying {} clips one at a time".format(len(running)))
+        for i in running:
+            retried, _ = _run_pool(clips, [i], results, output_dir, 1, tf_threads, backend, options, on_result)
+            if retried:
+                results[i] = _worker_died(clips[i])
+                on_result(results[i])
+        pending = [i for i in lost if not started[i]]
+    seconds = time.time() - t1
+    ok = [result for result in results if result["status"] == "ok"]
+    frames = sum(result["frames"] for result in ok)
+    report = {
+        "clips": len(clips),
+        "ok": len(ok),
+        "failed": len(clips) - len(ok),
+        "workers": workers,
+        "tf_threads": tf_threads,
+        "backend": backend,
+        "seconds": seconds,
+        "frames": frames,
+        "fps": frames / seconds if seconds > 0 else None,
+        "clips_per_hour": len(ok) * 3600 / seconds if seconds > 0 else None,
+        "failures": [{"name": result["name"], "error": result["error"]} for result in results if result["status"] != "ok"],
+        "results": results,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, REPORT_NAME), "w") as f:
+        json.dump(report, f, indent=1)
+    print("[Batch] {} of {} clips done in {:.1f}s, {:.1f} frames/s, {:.0f} clips/hour".format(
+        len(ok), len(clips), seconds, report["fps"] or 0, report["clips_per_hour"] or 0))
+    for failure in report["failures"]:
+        print("[Batch] Failed {}: {}".format(failure["name"], failure["error"]))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segment every clip of a directory or manifest")
+    parser.add_argument('source', help='Directory of <name>.rgb/.wav(/.mp4) files, or a manifest (.json list or "rgb wav [mp4]" lines)')
+    parser.add_argument('--output-dir', default='results', help='Every clip gets its own directory in here')
+    parser.add_argument('--workers', type=int, help='Worker processes, a quarter of the cores by default')
+    parser.add_argument('--tf-threads', type=int, help='TransNetV2 inference threads per worker, cores / workers by default')
+    parser.add_argument('--backend', choices=transnetv2.inference.BACKENDS,
+                        help='TransNetV2 backend, TRANSNET_BACKEND or tf by default')
+    parser.add_argument('--encode', action='store_true', help='Also encode an .mp4 of clips that have none')
+    parser.add_argument('--shot-size', choices=['240x135', '120x68', '48x27'],
+                        help='Score shots on this level of the analysis proxy instead of full resolution')
+    parser.add_argument('--force', nargs='*', default=[], metavar='STAGE', help='Run these stages even if they are up to date')
+    args = parser.parse_args()
+    clips = find_clips(args.source)
+    if not clips:
+        print("[Batch] No clips in {}".format(args.source))
+        return 1
+    report = run_batch(clips, args.output_dir, args.workers, args.tf_threads, args.encode,
+                       tuple(int(n) for n in args.shot_size.split('x')) if args.shot_size else None, args.force,
+                       args.backend)
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,377 @@
+import os
+import sys
+import json
+import time
+import queue
+import wave
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+
+# throughput of the backend stages on synthetic inputs with known transitions.
+# synthetic_inputs writes a deterministic .rgb/.wav pair (and its ground truth as .json):
+# shots of a panning gradient with noise texture and a moving square, joined by hard cuts
+# or 15 frame dissolves, every shot with its own tone in the audio.
+# every stage runs in a fresh process with empty feature cache and proxy directories,
+# so nothing is reused between stages.
+# only the measured call is timed, the setup it needs (scores for split_frames,
+# the 48x27 frames and the model for TransNetV2) is done before in the same process.
+# the peak RSS therefore includes that setup, rss_before_mb is what it left resident.
+# results are written as json, one entry per stage and input length.
+width = 480
+height = 270
+fps = 30
+sample_rate = 44100
+DISSOLVE_FRAMES = 15
+STAGES = ("write_video", "detectScene", "detect_shot.prepare_scores", "detect_shot.split_frames",
+          "detect_shot_v2_1.prepare_scores", "detect_shot_v2_1.split_frames", "detect_scene_v2_1",
+          "TransNetV2.predict_frames", "detect_audio")
+
+
+# ---- synthetic inputs
+
+def _shot_plan(frame_count, rng):
+    # [start, end) shots of 2 to 8 seconds, and how each one starts
+    shots = []
+    start = 0
+    while start < frame_count:
+        length = int(rng.integers(2 * fps, 8 * fps))
+        end = min(frame_count, start + length)
+        if frame_count - end < 2 * fps:
+            end = frame_count
+        shots.append({
+            "start": start, "end": end,
+            "transition": "cut" if not shots or rng.random() < 0.7 else "dissolve",
+            "colors": rng.integers(0, 256, size=(2, 3)).tolist(),
+            "square_color": rng.integers(0, 256, size=3).tolist(),
+            "square_pos": [int(rng.integers(0, height - 60)), int(rng.integers(0, width - 60))],
+            "square_speed": rng.integers(-6, 7, size=2).tolist(),
+            "pan": int(rng.integers(-3, 4)),
+            "tone": float(rng.uniform(200, 2000)),
+            "seed": int(rng.integers(0, 2 ** 31)),
+        })
+        start = end
+    return shots
+
+
+class _ShotRenderer:
+    def __init__(self, shot):
+        self.shot = shot
+        colors = np.array(shot["colors"], dtype=np.float32)
+        # gradient twice the width so panning never runs out of it
+        ramp = np.abs(np.linspace(-1, 1, 2 * width, dtype=np.float32))[:, None]
+        row = colors[0] * (1 - ramp) + colors[1] * ramp
+        noise = np.random.default_rng(shot["seed"]).normal(0, 6, size=(height, 2 * width, 3)).astype(np.float32)
+        self.background = np.clip(row[None] + noise, 0, 255).astype(np.uint8)
+
+    def frame(self, frame_num):
+        t = frame_num - self.shot["start"]
+        offset = (t * self.shot["pan"]) % width
+        img = self.background[:, offset:offset + width].copy()
+        # square bouncing around the frame
+        y, x = [int(abs((p + v * t) % (2 * (size - 60)) - (size - 60)))
+                for p, v, size in zip(self.shot["square_pos"], self.shot["square_speed"], (height, width))]
+        img[y:y + 60, x:x + 60] = self.shot["square_color"]
+        return img
+
+
+def synthetic_inputs(directory, seconds, seed=0, name=None):
+    # writes <name>.rgb, <name>.wav and <name>.json to directory, returns their paths and the ground truth
+    frame_count = int(seconds * fps)
+    rng = np.random.default_rng(seed)
+    shots = _shot_plan(frame_count, rng)
+    name = name or "synthetic_{:g}s_{}".format(seconds, seed)
+    rgb_path = os.path.join(directory, name + ".rgb")
+    wav_path = os.path.join(directory, name + ".wav")
+    json_path = os.path.join(directory, name + ".json")
+    renderers = [_ShotRenderer(shot) for shot in shots]
+    with open(rgb_path, "wb") as f:
+        for i, (shot, renderer) in enumerate(zip(shots, renderers)):
+            for frame_num in range(shot["start"], shot["end"]):
+                img = renderer.frame(frame_num)
+                nxt = i + 1 < len(shots) and shots[i + 1]["transition"] == "dissolve"
+                if nxt and frame_num >= shot["end"] - DISSOLVE_FRAMES // 2:
+                    # dissolve into the next shot, centred on its start
+                    alpha = (frame_num - (shot["end"] - DISSOLVE_FRAMES // 2) + 1) / (DISSOLVE_FRAMES + 1)
+                    img = _blend(img, renderers[i + 1].frame(shots[i + 1]["start"]), alpha)
+                elif shot["transition"] == "dissolve" and frame_num < shot["start"] + DISSOLVE_FRAMES - DISSOLVE_FRAMES // 2:
+                    alpha = (frame_num - shot["start"] + DISSOLVE_FRAMES // 2 + 1) / (DISSOLVE_FRAMES + 1)
+                    img = _blend(renderers[i - 1].frame(shot["start"] - 1), img, alpha)
+                f.write(img.tobytes())
+    with wave.open(wav_path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        for shot in shots:
+            start, end = shot["start"] * sample_rate // fps, shot["end"] * sample_rate // fps
+            t = np.arange(start, end) / sample_rate
+            noise = np.random.default_rng(shot["seed"]).normal(0, 0.01, size=len(t))
+            signal = 0.3 * np.sin(2 * np.pi * shot["tone"] * t) + noise
+            if shot["transition"] == "cut" and shot["start"] > 0:
+                # a short pause before the shot
+                signal[:sample_rate // 4] = 0
+            samples = (np.clip(signal, -1, 1) * 32767).astype("<i2")
+            w.writeframes(np.repeat(samples[:, None], 2, axis=1).tobytes())
+    truth = {
+        "seed": seed, "fps": fps, "width": width, "height": height, "frame_count": frame_count,
+        "shots": [[shot["start"], shot["end"]] for shot in shots],
+        "hard_cuts": [shot["start"] for shot in shots[1:] if shot["transition"] == "cut"],
+        "gradual": [[shot["start"] - DISSOLVE_FRAMES // 2, shot["start"] + DISSOLVE_FRAMES - DISSOLVE_FRAMES // 2]
+                    for shot in shots[1:] if shot["transition"] == "dissolve"],
+    }
+    with open(json_path, "w") as f:
+        json.dump(truth, f, indent=1)
+    return {"rgb": rgb_path, "wav": wav_path, "truth": json_path}, truth
+
+
+def _blend(img1, img2, alpha):
+    return (img1.astype(np.float32) * (1 - alpha) + img2.astype(np.float32) * alpha).astype(np.uint8)
+
+
+def match_cuts(found, truth, tolerance=3):
+    # precision and recall of the found cut frames against the ground truth ones
+    found, truth = sorted(set(int(cut) for cut in found)), sorted(int(cut) for cut in truth)
+    used = set()
+    hits = 0
+    for cut in found:
+        for i, true_cut in enumerate(truth):
+            if i not in used and abs(cut - true_cut) <= tolerance:
+                used.add(i)
+                hits += 1
+                break
+    return {"found": len(found), "true": len(truth),
+            "precision": hits / len(found) if found else None, "recall": hits / len(truth) if truth else None}
+
+
+# ---- stages, run in a child process
+
+class RgbCapture:
+    # cv2.VideoCapture-like reader of the .rgb file for prepare_scores, frames come out BGR
+    def __init__(self, path):
+        import cv2
+        self.cv2 = cv2
+        self.imgs = np.memmap(path, dtype=np.uint8, mode='r').reshape(-1, height, width, 3)
+        self.pos = 0
+
+    def read(self):
+        if self.pos >= self.imgs.shape[0]:
+            return False, None
+        frame = self.cv2.cvtColor(np.asarray(self.imgs[self.pos]), self.cv2.COLOR_RGB2BGR)
+        self.pos += 1
+        return True, frame
+
+    def get(self, prop):
+        return self.pos * 1000 / fps
+
+    def set(self, prop, value):
+        # seeking, prop is always CAP_PROP_POS_FRAMES
+        self.pos = int(value)
+        return True
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _measure(fn, *args):
+    rss_before = _rss_mb()
+    cpu1, t1 = time.process_time(), time.perf_counter()
+    value = fn(*args)
+    t2, cpu2 = time.perf_counter(), time.process_time()
+    return value, {"seconds": t2 - t1, "cpu_seconds": cpu2 - cpu1, "rss_before_mb": rss_before,
+                   "peak_rss_mb": _peak_rss_mb()}
+
+
+def _cuts(shots):
+    return [int(start) for start, _ in shots][1:]
+
+
+def _run_stage(stage, inputs, truth, work_dir):
+    # returns (measurement, accuracy or None)
+    rgb, wav = inputs["rgb"], inputs["wav"]
+    frame_count = truth["frame_count"]
+    try:
+        from . import detect_shot, detect_shot_v2_1
+    except ImportError:
+        import detect_shot, detect_shot_v2_1
+    if stage == "write_video":
+        try:
+            from .encode import encode_video
+        except ImportError:
+            from encode import encode_video
+        _, measured = _measure(encode_video, rgb, wav, width, height, os.path.join(work_dir, "out.mp4"))
+        return measured, None
+    if stage == "detectScene":
+        try:
+            from .detect import detectScene
+        except ImportError:
+            from detect import detectScene
+        scenes, measured = _measure(detectScene, rgb, None, None)
+        return measured, match_cuts(_cuts(scenes), truth["hard_cuts"])
+    if stage.endswith("prepare_scores"):
+        module = detect_shot if stage.startswith("detect_shot.") else detect_shot_v2_1
+        _, measured = _measure(module.prepare_scores, RgbCapture(rgb))
+        return measured, None
+    if stage.endswith("split_frames"):
+        module = detect_shot if stage.startswith("detect_shot.") else detect_shot_v2_1
+        prepared = module.prepare_scores(RgbCapture(rgb))
+        sd, scores = prepared[0], prepared[1]
+        cuts, measured = _measure(module.split_frames, sd, scores, 0, frame_count - 1)
+        return measured, match_cuts(cuts, truth["hard_cuts"] + [start for start, _ in truth["gradual"]],
+                                    tolerance=DISSOLVE_FRAMES)
+    if stage == "detect_scene_v2_1":
+        try:
+            from . import detect_scene_v2_1
+        except ImportError:
+            import detect_scene_v2_1
+        shots = [[start, end - 1] for start, end in truth["shots"]]
+        _, measured = _measure(detect_scene_v2_1.main, rgb, shots, None)
+        return measured, None
+    if stage == "TransNetV2.predict_frames":
+        try:
+            from . import transnetv2
+            from .frame_pipeline import convert_frame
+        except ImportError:
+            import transnetv2
+            from frame_pipeline import convert_frame
+        imgs = np.memmap(rgb, dtype=np.uint8, mode='r').reshape(-1, height, width, 3)
+        frames = np.stack([convert_frame(img, (48, 27)) for img in imgs])
+        model = transnetv2.get_model()
+        (single_frame_pred, _), measured = _measure(model.predict_frames, frames)
+        shots = transnetv2.TransNetV2.predictions_to_scenes(single_frame_pred)
+        return measured, match_cuts(_cuts(shots), truth["hard_cuts"] + [start for start, _ in truth["gradual"]],
+                                    tolerance=DISSOLVE_FRAMES)
+    if stage == "detect_audio":
+        try:
+            from . import detect_audio
+        except ImportError:
+            import detect_audio
+        features, measured = _measure(detect_audio.audio_features, wav)
+        boundaries = detect_audio.boundaries_from_features(features["energy_db"], features["flux"])
+        return measured, match_cuts(boundaries, truth["hard_cuts"], tolerance=DISSOLVE_FRAMES)
+    raise ValueError("unknown stage {}, stages are {}".format(stage, ", ".join(STAGES)))
+
+
+def _child(stage, inputs, truth, work_dir, results):
+    # empty caches, set before the backend modules read them at import
+    os.environ["FEATURE_CACHE_DIR"] = os.path.join(work_dir, "feature_cache")
+    os.environ["PROXY_DIR"] = os.path.join(work_dir, "proxy")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        measured, accuracy = _run_stage(stage, inputs, truth, work_dir)
+        results.put({"ok": True, "measured": measured, "accuracy": accuracy})
+    except BaseException as exc:
+        results.put({"ok": False, "error": "{}: {}".format(type(exc).__name__, exc)})
+
+
+def run_stage(stage, inputs, truth, timeout=None):
+    # one stage in a fresh process, returns its json entry
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_child, args=(stage, inputs, truth, work_dir, results))
+    process.start()
+    t1 = time.time()
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                result = {"ok": False, "error": "process exited with code {}".format(process.exitcode)}
+            elif timeout is not None and time.time() - t1 > timeout:
+                result = {"ok": False, "error": "timed out after {}s".format(timeout)}
+                process.terminate()
+    process.join()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    entry = {"stage": stage, "frames": truth["frame_count"], "seconds_of_video": truth["frame_count"] / fps}
+    if result["ok"]:
+        measured = result["measured"]
+        entry.update(measured)
+        entry["fps"] = truth["frame_count"] / measured["seconds"] if measured["seconds"] > 0 else None
+        entry["realtime_factor"] = entry["seconds_of_video"] / measured["seconds"] if measured["seconds"] > 0 else None
+        if result["accuracy"] is not None:
+            entry["accuracy"] = result["accuracy"]
+    else:
+        entry["error"] = result["error"]
+    return entry
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(lengths, stages=STAGES, seed=0, input_dir=None, timeout=None):
+    # benchmark results of the stages for synthetic inputs of every length (seconds)
+    report = {
+        "revision": _git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "results": [],
+    }
+    keep_inputs = input_dir is not None
+    input_dir = input_dir or tempfile.mkdtemp(prefix="bench_inputs_")
+    os.makedirs(input_dir, exist_ok=True)
+    try:
+        for seconds in lengths:
+            t1 = time.time()
+            inputs, truth = synthetic_inputs(input_dir, seconds, seed)
+            print("[Benchmark] {}s input with {} shots generated in {:.1f}s".format(
+                seconds, len(truth["shots"]), time.time() - t1))
+            for stage in stages:
+                entry = run_stage(stage, inputs, truth, timeout)
+                if "error" in entry:
+                    print("[Benchmark] {} on {}s: {}".format(stage, seconds, entry["error"]))
+                else:
+                    print("[Benchmark] {} on {}s: {:.2f}s, {:.0f} fps, peak RSS {:.0f} MB".format(
+                        stage, seconds, entry["seconds"], entry["fps"], entry["peak_rss_mb"]))
+                report["results"].append(entry)
+            if not keep_inputs:
+                for path in inputs.values():
+                    os.remove(path)
+    finally:
+        if not keep_inputs:
+            shutil.rmtree(input_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage throughput of the segmentation backend on synthetic video")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[60], help="lengths of the synthetic inputs")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.json", help="json file the results are written to")
+    parser.add_argument("--inputs", default=None, help="keep the synthetic inputs in this directory")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds after which a stage is stopped")
+    args = parser.parse_args()
+    report = run(args.seconds, args.stages, args.seed, args.inputs, args.timeout)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print("[Benchmark] Results written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import numpy as np
+import os
 import sys
 from scenedetect.backends.opencv import VideoStream
 from scenedetect import SceneManager
@@ -7,30 +8,46 @@ from typing import Tuple, Optional, Union
 from scenedetect.frame_timecode import FrameTimecode
 from numpy import ndarray
 
+try:
+    from . import feature_cache, profiling
+except ImportError:
+    import feature_cache
+    import profiling
+
 
 frameRate = 30
 width = 480
 height = 270
 num_channel = 3
 num_pix_per_frame = width * height * num_channel
+# name of the AdaptiveDetector results in the feature cache, with its parameters
+SCENE_FEATURE = "adaptive_scenes_v1_8_300"
 
 
 def readVideo(fn):
-    imgs = np.fromfile(fn, dtype=np.ubyte).reshape(-1, height, width, num_channel)
+    # map the .rgb file instead of reading it, only the pages of frames that
+    # are actually touched get loaded and the OS can drop them again
+    imgs = np.memmap(fn, dtype=np.ubyte, mode='r').reshape(-1, height, width, num_channel)
     return imgs
 
-videoFn = sys.argv[1]
-videoMp4 = sys.argv[2]
-imgs = readVideo(videoFn)
-
 
 class MyVideo(VideoStream):
-    def __init__(self, start=0, end=imgs.shape[0]):
-        self._path = ""
-        self.imgs = imgs
+    def __init__(self, path, start=0, end=None):
+        self._path = path
+        self._imgs = None
         self.start = start
         self.end = end
         self.pos = start
+        if self.end is None:
+            # frame count from the file size, so the file does not have to be opened yet
+            self.end = os.path.getsize(path) // num_pix_per_frame
+
+    @property
+    def imgs(self):
+        # opened lazily on the first read
+        if self._imgs is None:
+            self._imgs = readVideo(self._path)
+        return self._imgs
 
     @property
     def BACKEND_NAME(self) -> str:
@@ -88,6 +105,7 @@ class MyVideo(VideoStream):
         if self.pos >= self.duration.frame_num:
             return False
 
+        # zero-copy view into the memmap
         img = self.imgs[self.pos]
         if advance:
             self.pos += 1
@@ -100,33 +118,81 @@ class MyVideo(VideoStream):
         self.pos = target
 
 
-def detectScene():
-    video = MyVideo()
-    manager = SceneManager()
-    manager.add_detector(AdaptiveDetector(adaptive_threshold=8, min_scene_len=300))
-    manager.detect_scenes(video, show_progress=True)
-    scene_list = manager.get_scene_list()
-    file = open('scene.txt', 'w')
+# feeds every frame that scene detection reads to the detectors of a FramePipeline,
+# so the scene pass is the only pass over the video
+class PipelineVideo(MyVideo):
+    def __init__(self, path, pipeline, start=0, end=None):
+        super().__init__(path, start, end)
+        self.pipeline = pipeline
+        self.pushed = start - 1
+
+    def read(self, decode: bool = True, advance: bool = True) -> Union[ndarray, bool]:
+        pos = self.pos
+        img = super().read(decode, advance)
+        if img is not False and pos > self.pushed:
+            self.pipeline.push(pos, img)
+            self.pushed = pos
+        return img
+
+
+@profiling.traced("detectScene")
+def detectScene(path, pipeline=None, txt_dir="."):
+    # returns the [start_frame, end_frame] scenes, scene.txt is written to txt_dir unless it is None
+    # scene boundaries of a video seen before come from the feature cache,
+    # the pipeline then makes its own pass if any of its detectors still needs one
+    arrays = feature_cache.load(path, SCENE_FEATURE)
+    if arrays is not None:
+        scene_list = [(FrameTimecode(timecode=int(start), fps=frameRate), FrameTimecode(timecode=int(end), fps=frameRate))
+                      for start, end in arrays["scenes"]]
+        if pipeline is not None:
+            pipeline.run()
+    else:
+        if pipeline is None:
+            video = MyVideo(path)
+        else:
+            video = PipelineVideo(path, pipeline)
+        manager = SceneManager()
+        manager.add_detector(AdaptiveDetector(adaptive_threshold=8, min_scene_len=300))
+        manager.detect_scenes(video, show_progress=True)
+        scene_list = manager.get_scene_list()
+        feature_cache.save(path, SCENE_FEATURE, {"scenes": np.array(
+            [[scene[0].get_frames(), scene[1].get_frames()] for scene in scene_list], dtype=np.int64).reshape(-1, 2)})
+        if pipeline is not None:
+            pipeline.finish()
     for i, scene in enumerate(scene_list):
         print('Scene %2d: Start %s / Frame %4d, End %s / Frame %4d' % (
             i + 1,
             scene[0].get_timecode(), scene[0].get_frames(),
             scene[1].get_timecode(), scene[1].get_frames()))
-        file.write(str(scene[0].get_frames())+" "+str(scene[1].get_frames())+"\n")
-    file.close()
+    if txt_dir is not None:
+        file = open(os.path.join(txt_dir, 'scene.txt'), 'w')
+        for scene in scene_list:
+            file.write(str(scene[0].get_frames())+" "+str(scene[1].get_frames())+"\n")
+        file.close()
+    return np.array([[scene[0].get_frames(), scene[1].get_frames()] for scene in scene_list],
+                    dtype=np.int64).reshape(-1, 2)
 
 if __name__ == '__main__':
     import time
+    videoFn = sys.argv[1]
+    videoMp4 = sys.argv[2]
+    import detect_shot
+    import transnetv2
+    from frame_pipeline import FramePipeline
+    from proxy import get_proxy, level_name
     t1 = time.time()
+    # one pass over the video feeds scene, shot and sub-shot detection
+    pipeline = FramePipeline(videoFn)
+    shot_detector = pipeline.add_detector(detect_shot.ShotDetector())
+
     # for scene detection
-    detectScene()
+    detectScene(videoFn, pipeline)
 
     # # for shot detection
-    import detect_shot
-    detect_shot.main(videoMp4)
+    detect_shot.main(videoMp4, shot_detector)
 
-    # for sub-shot detection
-    import transnetv2
+    # for sub-shot detection, the windows of all long shots go through TransNetV2 in batches
+    shots = []
     with open("shot.txt", "r") as input:
         file = open("subshot.txt","w")
         file.close()
@@ -136,6 +202,12 @@ if __name__ == '__main__':
             end_frame = int(param[1])
             if end_frame-start_frame<250:
                 continue
-            transnetv2.main(videoMp4, start_frame, end_frame)
+            shots.append((start_frame, end_frame))
+    # the 48x27 frames of the analysis proxy are mapped, and only when a shot is missing from the prediction cache
+    frames = None
+    if transnetv2.needs_frames(shots, videoFn):
+        frames = get_proxy(videoFn, [level_name((48, 27), 'rgb')]).level((48, 27), 'rgb')
+    transnetv2.main_batched(videoMp4, shots, frames, source=videoFn)
     t2 = time.time()
     print(t2-t1)
+    print(transnetv2.model_stats)
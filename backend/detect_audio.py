@@ -0,0 +1,206 @@
+import os
+import sys
+import wave
+import numpy as np
+
+try:
+    from . import feature_cache, profiling
+except ImportError:
+    import feature_cache
+    import profiling
+
+# audio boundaries on the 30 fps frame grid of the video.
+# the .wav is read a chunk at a time, for every video frame the short-time energy of its
+# 1/30 s of audio and the spectral flux of an FFT window starting there are computed,
+# all windows of a chunk in one batch. only the per frame values are kept, so memory
+# does not grow with the length of the audio beyond 8 bytes per video frame.
+# boundaries are the middles of silence runs and the peaks of the flux.
+AUDIO_FEATURE = "audio_features_v1"
+FPS = 30
+SILENCE_DB = -45.
+MIN_SILENCE_FRAMES = 9
+FLUX_K = 6.
+PEAK_RADIUS = 15
+
+
+def read_wav(path, chunk_samples):
+    # mono float32 chunks in [-1, 1]
+    with wave.open(path, "rb") as f:
+        channels, width = f.getnchannels(), f.getsampwidth()
+        while True:
+            data = f.readframes(chunk_samples)
+            if not data:
+                break
+            if width == 3:
+                # 24 bit, padded to 32
+                raw = np.frombuffer(data, np.uint8).reshape(-1, 3)
+                samples = (raw[:, 0].astype(np.int32) << 8 | raw[:, 1].astype(np.int32) << 16
+                           | raw[:, 2].astype(np.int32) << 24).astype(np.float32) / 2 ** 31
+            elif width == 1:
+                samples = (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+            else:
+                dtype = {2: "<i2", 4: "<i4"}[width]
+                samples = np.frombuffer(data, dtype).astype(np.float32) / 2 ** (8 * width - 1)
+            yield samples.reshape(-1, channels).mean(axis=1)
+
+
+class AudioFeatures:
+    def __init__(self, rate, frame_count, fps=FPS, n_fft=None):
+        self.rate = rate
+        self.fps = fps
+        self.hop = rate / fps
+        if n_fft is None:
+            n_fft = 1 << int(np.ceil(np.log2(self.hop)))
+        self.n_fft = n_fft
+        self.window = np.hanning(n_fft).astype(np.float32)
+        self.energy_db = np.zeros(frame_count, dtype=np.float32)
+        self.flux = np.zeros(frame_count, dtype=np.float32)
+        self.frame_count = frame_count
+        # samples not analyzed yet, buf[0] is sample buf_start of the audio
+        self.buf = np.zeros(0, dtype=np.float32)
+        self.buf_start = 0
+        self.frame = 0
+        self.prev_spectrum = None
+
+    def _start(self, frames):
+        return np.floor(frames * self.hop).astype(np.int64)
+
+    def push(self, samples):
+        self.buf = np.concatenate([self.buf, samples])
+        self._analyze()
+
+    def finish(self):
+        # the windows of the last frames run past the end of the audio, pad them with silence
+        self.buf = np.concatenate([self.buf, np.zeros(self.n_fft + int(np.ceil(self.hop)), np.float32)])
+        self._analyze()
+        self.buf = np.zeros(0, dtype=np.float32)
+
+    def _analyze(self):
+        buf_end = self.buf_start + len(self.buf)
+        # frames whose FFT window (and energy hop) fit in the buffer
+        last = min(self.frame_count, int((buf_end - self.n_fft) / self.hop) + 1)
+        while last > 0 and self._start(np.array([last - 1]))[0] + self.n_fft > buf_end:
+            last -= 1
+        if last <= self.frame:
+            return
+        frames = np.arange(self.frame, last + 1)
+        starts = self._start(frames) - self.buf_start
+        # energy of the samples of every frame, from a cumulative sum of squares
+        squares = np.concatenate([[0.], np.cumsum(self.buf[:starts[-1]].astype(np.float64) ** 2)])
+        lengths = np.maximum(starts[1:] - starts[:-1], 1)
+        energy = (squares[starts[1:]] - squares[starts[:-1]]) / lengths
+        self.energy_db[self.frame:last] = 10 * np.log10(energy + 1e-10)
+        # spectral flux: increase of log magnitude between the windows of consecutive frames
+        windows = self.buf[starts[:-1, None] + np.arange(self.n_fft)] * self.window
+        spectrum = np.log1p(100 * np.abs(np.fft.rfft(windows, axis=1)))
+        prev = spectrum[:1] if self.prev_spectrum is None else self.prev_spectrum[None]
+        diff = np.diff(np.concatenate([prev, spectrum]), axis=0)
+        self.flux[self.frame:last] = np.maximum(diff, 0).mean(axis=1)
+        self.prev_spectrum = spectrum[-1]
+        # drop the samples no frame after last needs
+        keep = starts[-1]
+        self.buf = self.buf[keep:]
+        self.buf_start += keep
+        self.frame = last
+
+
+@profiling.traced("detect_audio.audio_features")
+def audio_features(path, fps=FPS, chunk_seconds=60):
+    # {"energy_db", "flux"} per video frame of the .wav at path
+    with wave.open(path, "rb") as f:
+        rate, total = f.getframerate(), f.getnframes()
+    features = AudioFeatures(rate, int(np.ceil(total * fps / rate)), fps)
+    for samples in read_wav(path, int(rate * chunk_seconds)):
+        features.push(samples)
+    features.finish()
+    profiling.current().add_frames(features.frame_count)
+    return {"energy_db": features.energy_db, "flux": features.flux}
+
+
+def silence_runs(energy_db, silence_db=SILENCE_DB, min_frames=MIN_SILENCE_FRAMES):
+    # [start_frame, end_frame) runs of at least min_frames frames quieter than silence_db
+    silent = np.concatenate([[0], (energy_db < silence_db).astype(np.int8), [0]])
+    edges = np.diff(silent)
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    keep = ends - starts >= min_frames
+    return np.stack([starts[keep], ends[keep]], axis=1).reshape(-1, 2)
+
+
+def flux_peaks(flux, k=FLUX_K, radius=PEAK_RADIUS):
+    # frames where the flux is the largest within radius frames and k MADs above the median
+    if len(flux) == 0:
+        return np.zeros(0, dtype=np.int64)
+    median = np.median(flux)
+    mad = np.median(np.abs(flux - median)) * 1.4826 + 1e-9
+    padded = np.pad(flux, radius, mode="constant", constant_values=-np.inf)
+    local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1).max(axis=1)
+    return np.flatnonzero((flux >= local_max) & (flux > median + k * mad))
+
+
+def boundaries_from_features(energy_db, flux, min_gap=PEAK_RADIUS):
+    # sorted boundary frames, a silence wins over a flux peak close to it
+    silences = silence_runs(energy_db)
+    silence_middles = (silences[:, 0] + silences[:, 1]) // 2
+    peaks = flux_peaks(flux)
+    candidates = sorted([(int(frame), 0) for frame in silence_middles] + [(int(frame), 1) for frame in peaks])
+    boundaries = []
+    for frame, kind in candidates:
+        if frame == 0:
+            continue
+        if boundaries and frame - boundaries[-1][0] < min_gap:
+            if kind < boundaries[-1][1]:
+                boundaries[-1] = (frame, kind)
+            continue
+        boundaries.append((frame, kind))
+    return np.array([frame for frame, _ in boundaries], dtype=np.int64)
+
+
+def audio_boundaries(path):
+    # boundary frames of the .wav at path, features of audio seen before come from the feature cache
+    arrays = feature_cache.load(path, AUDIO_FEATURE)
+    if arrays is None:
+        arrays = audio_features(path)
+        feature_cache.save(path, AUDIO_FEATURE, arrays)
+    return boundaries_from_features(arrays["energy_db"], arrays["flux"]), len(arrays["flux"])
+
+
+def refine_scenes(scenes, shots, boundaries, tolerance=PEAK_RADIUS, min_scene_len=300):
+    # scenes split at shot boundaries that have an audio boundary within tolerance frames,
+    # when both parts stay at least min_scene_len frames long. shots stay inside their scene
+    scenes = np.asarray(scenes, dtype=np.int64).reshape(-1, 2)
+    shot_starts = np.unique(np.asarray(shots, dtype=np.int64).reshape(-1, 2)[:, 0])
+    boundaries = np.sort(np.asarray(boundaries, dtype=np.int64))
+    if len(boundaries) == 0 or len(shot_starts) == 0:
+        return scenes
+    # distance from every shot start to the closest audio boundary
+    i = np.clip(np.searchsorted(boundaries, shot_starts), 1, len(boundaries))
+    nearest = np.minimum(np.abs(shot_starts - boundaries[i - 1]),
+                         np.abs(shot_starts - boundaries[np.minimum(i, len(boundaries) - 1)]))
+    cuts = shot_starts[nearest <= tolerance]
+    refined = []
+    for start_frame, end_frame in scenes:
+        prev_cut = start_frame
+        for cut in cuts[(cuts > start_frame) & (cuts < end_frame)]:
+            if cut - prev_cut >= min_scene_len and end_frame - cut >= min_scene_len:
+                refined.append([prev_cut, cut])
+                prev_cut = cut
+        refined.append([prev_cut, end_frame])
+    return np.array(refined, dtype=np.int64).reshape(-1, 2)
+
+
+def main(path, txt_dir="."):
+    # returns the [start_frame, end_frame] audio segments between the boundaries,
+    # audio.txt is written to txt_dir unless it is None
+    boundaries, frame_count = audio_boundaries(path)
+    edges = np.concatenate([[0], boundaries, [frame_count]])
+    output_list = np.stack([edges[:-1], edges[1:]], axis=1).astype(np.int64)
+    if txt_dir is not None:
+        with open(os.path.join(txt_dir, "audio.txt"), "w") as f:
+            for start_frame, end_frame in output_list:
+                f.write(str(start_frame) + " " + str(end_frame) + "\n")
+    return output_list
+
+
+if __name__ == "__main__":
+    for start_frame, end_frame in main(sys.argv[1]):
+        print(start_frame, end_frame)
@@ -1,8 +1,17 @@
+import os
 import numpy
 import numpy as np
 import argparse
 from PIL import Image
-import colorsys
+
+try:
+    from . import feature_cache, profiling
+except ImportError:
+    import feature_cache
+    import profiling
+
+# name of the quantized 16x9 codes in the feature cache
+GRID_FEATURE = "scene_grid_v1"
 
 def mean_pixel(mat):
     num_pixels = 9 * 16
@@ -11,45 +20,55 @@ def mean_pixel(mat):
     total = numpy.sum(abs)
     return total / float(num_pixels)
 
-def prepare_scores(video_name):
+def rgb_to_hsv(rgb):
+    # colorsys.rgb_to_hsv on arrays, same operations in the same order so the results are identical
+    r, g, b = rgb[..., 0] / 255, rgb[..., 1] / 255, rgb[..., 2] / 255
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    rangec = maxc - minc
+    v = maxc
+    gray = minc == maxc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.where(gray, 0.0, rangec / maxc)
+        rc = (maxc - r) / rangec
+        gc = (maxc - g) / rangec
+        bc = (maxc - b) / rangec
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(gray, 0.0, (h / 6.0) % 1.0)
+    return h, s, v
+
+
+def quantize(rgb):
+    h, s, v = rgb_to_hsv(rgb)
+    h_val = (h * 7).astype(np.int64)
+    s_val = (s > 0.65).astype(np.int64)
+    v_val = (v > 0.7).astype(np.int64)
+    return h_val * 2 * 2 + s_val * 2 + v_val
+
+
+@profiling.traced("detect_scene_v2_1.prepare_scores")
+def prepare_scores(video_name, with_frames=False, batch_size=1024, grid_frames=None):
+    # grid_frames: the (frames, 9, 16, 3) grid of an analysis proxy, read instead of the video
     height = 270
     width = 480
     scale_height = 9
     scale_width = 16
     scale_factor = 30
-    frames = []
-    score_arr = []
-    rawdata = open(video_name, "rb")
-    imgdata = rawdata.read(height * width * 3)
-    frame_num = -1
-
-    while imgdata:
-        img = Image.new("RGB", (scale_width, scale_height))
-        num = 0 
-        frame_num += 1
-        value = []
-        for j in range(0, scale_height):
-            for i in range(0, scale_width):
-                j_large = j * scale_factor
-                i_large = i * scale_factor
-                num = 3 * (j_large * width + i_large)
-                r = imgdata[num] & 0xff
-                num = num + 1
-                g = imgdata[num] & 0xff
-                num = num + 1
-                b = imgdata[num] & 0xff
-                num = num + 1
-                (h, s, v) = colorsys.rgb_to_hsv(r/255, g/255, b/255)
-                h_val = int(h * 7)
-                s_val = 1 if s > 0.65 else 0
-                v_val = 1 if v > 0.7 else 0
-                val = h_val * 2 * 2 + s_val * 2 + v_val
-                value.append(val)
-                img.putpixel((i, j), (r, g, b))
-        frames.append(img)
-        score_arr.append(value)
-        imgdata = rawdata.read(height * width * 3)
-    score_arr = np.array(score_arr)
+    if grid_frames is None:
+        imgs = np.memmap(video_name, dtype=np.uint8, mode='r').reshape(-1, height, width, 3)
+        imgs = imgs[:, 0:scale_height * scale_factor:scale_factor, 0:scale_width * scale_factor:scale_factor]
+    else:
+        imgs = grid_frames
+    score_arr = np.zeros((imgs.shape[0], scale_height * scale_width), dtype=np.int64)
+    frames = [] if with_frames else None
+    for start in range(0, imgs.shape[0], batch_size):
+        # 16x9 grid of pixels every 30 pixels, for a batch of frames
+        grid = np.array(imgs[start:start + batch_size])
+        score_arr[start:start + len(grid)] = quantize(grid).reshape(len(grid), -1)
+        if with_frames:
+            frames.extend(Image.fromarray(img, "RGB") for img in grid)
+    frame_num = imgs.shape[0] - 1
+    profiling.current().add_frames(imgs.shape[0])
     return frames, score_arr, frame_num
 
 def split_frames(frames, score_arr, start, end):
@@ -81,18 +100,22 @@ def frames_range(cuts, start_frame, end_frame):
             prev_cut = cut
     return res
 
-def read_shots(frames, score_arr, filename):
+@profiling.traced("detect_scene_v2_1.read_shots")
+def read_shots(frames, score_arr, filename, shots=None):
+    # shots are read from filename unless they are given
     avg_list = []
     start_frames = []
-    with open(filename, "r") as input:
-        for line in input:
-            param = line.strip().split(' ')
-            start_frame = int(param[0])
-            end_frame = int(param[1])
-            avg = split_frames(frames, score_arr, start_frame, end_frame)
-            avg_list.append(avg)
-            start_frames.append(start_frame)
-    input.close()
+    if shots is None:
+        shots = []
+        with open(filename, "r") as input:
+            for line in input:
+                param = line.strip().split(' ')
+                shots.append((int(param[0]), int(param[1])))
+        input.close()
+    for start_frame, end_frame in shots:
+        avg = split_frames(frames, score_arr, int(start_frame), int(end_frame))
+        avg_list.append(avg)
+        start_frames.append(int(start_frame))
     return start_frames, avg_list
 
 def find_max_diff(avg_list):
@@ -138,18 +161,30 @@ def get_scene_num(start_frames, break_index):
         selected_scenes.append(start_frames[i])
     return selected_scenes
 
-def output_scene(output_list):
-    with open("scene.txt", "w+") as f:
+def output_scene(output_list, txt_dir="."):
+    with open(os.path.join(txt_dir, "scene.txt"), "w+") as f:
         for tuple in output_list:
             f.write(str(tuple[0]) + " " + str(tuple[1]) + " ")
             f.write("\n")
     f.close()
 
 
-def main(path):
-    filename = "shot.txt"
-    frames, score_arr, frame_num = prepare_scores(path)
-    start_frames, avg_list = read_shots(frames, score_arr, filename)
+@profiling.traced("detect_scene_v2_1.main")
+def main(path, shots=None, txt_dir=".", grid_frames=None):
+    # returns the [start_frame, end_frame] scenes grouped from the shots (read from shot.txt in txt_dir by default),
+    # scene.txt is written to txt_dir unless it is None
+    filename = os.path.join(txt_dir or ".", "shot.txt")
+    # codes of a video seen before come from the feature cache
+    arrays = feature_cache.load(path, GRID_FEATURE)
+    if arrays is not None:
+        frames = None
+        score_arr = arrays["codes"].astype(np.int64)
+        frame_num = len(score_arr) - 1
+    else:
+        frames, score_arr, frame_num = prepare_scores(path, grid_frames=grid_frames)
+        # codes are below 32
+        feature_cache.save(path, GRID_FEATURE, {"codes": score_arr.astype(np.uint8)})
+    start_frames, avg_list = read_shots(frames, score_arr, filename, shots)
     #max_diff =  find_max_diff(avg_list)
     avg_diff = find_avg_diff(avg_list)
     threshold = 1
@@ -157,4 +192,6 @@ def main(path):
     #print(break_index)
     selected_scenes = get_scene_num(start_frames, break_index)
     output_list = frames_range(selected_scenes, 0, frame_num)
-    output_scene(output_list)
+    if txt_dir is not None:
+        output_scene(output_list, txt_dir)
+    return np.array(output_list, dtype=np.int64).reshape(-1, 2)
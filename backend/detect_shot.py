@@ -1,103 +1,63 @@
+import os
 import cv2
 import numpy
-import math
 
+try:
+    from . import shot_scores, feature_cache, profiling
+except ImportError:
+    import shot_scores
+    import feature_cache
+    import profiling
 
-def MSE(mat1, mat2):
-    dim = mat1.shape
-    pixels = dim[0] * dim[1]
-    diff = mat1.astype(numpy.int64) - mat2.astype(numpy.int64)
-    abs = numpy.abs(diff)
-    return (numpy.sum(abs) / float(pixels))
+MSE = shot_scores.MSE
 
+@profiling.traced("detect_shot.prepare_scores")
 def prepare_scores(cap):
+    # frames are scored as they are decoded and not kept around
+    scores = ShotDetector()
     frameNum = 0
-    scoreTotal = 0
-    scoreList = []
-    frames = []
-    timeList = []
     while (True):
-        ret, frame = cap.read()
+        ret, frame = shot_scores.read_frame(cap)
         if frame is None:
             break
-        frameNum += 1
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        hue, sat, lum = cv2.split(hsv)
-        if frameNum == 1:
-            prevHue, prevSat, prevLum = hue, sat, lum 
-            frames.append(frame)
-            continue
-        delta_hue = MSE(hue, prevHue)
-        delta_sat = MSE(sat, prevSat)
-        delta_lum = MSE(lum, prevLum)
-        score = (delta_hue + delta_sat + delta_lum) / 3
-        scoreTotal += score
-        scoreList.append(score)
         timestamp = cap.get(cv2.CAP_PROP_POS_MSEC)/1000
-        timeList.append(timestamp)
-        frames.append(frame)
-    avg = scoreTotal/(frameNum - 1)
-    var = 0
-    for i in range(frameNum - 1):
-        var += (avg - scoreList[i]) * (avg - scoreList[i])
-    sd = math.sqrt(var / (frameNum - 1))
-    return sd, frames, timeList
-
-def split_frames(sd, frames, start, end):
-    cutList = []
-    frameNum = start
-    outputFrameCount = 0
-    prevHue, prevSat, prevLum = None, None, None
-    frameList = []
-    cut = False
-    for i in range(start, end):
-        frame = frames[i]
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        hue, sat, lum = cv2.split(hsv)
-        if frameNum == start:
-            prevHue, prevSat, prevLum = hue, sat, lum
-            frameNum += 1
-            continue
-        delta_hue = MSE(hue, prevHue)
-        delta_sat = MSE(sat, prevSat)
-        delta_lum = MSE(lum, prevLum)
-        score = (delta_hue + delta_sat + delta_lum) / 3
-        if (score > sd + 2.5 and cut == False):
-            cut = True
-            changeH, changeS, changeL = prevHue, prevSat, prevLum
-            frameList.append([frame, score, frameNum])
-        elif cut == True and len(frameList) < 15:
-            delta_hue1 = MSE(hue, changeH)
-            delta_sat1 = MSE(sat, changeS)
-            delta_lum1 = MSE(lum, changeL)
-            score1 = (delta_hue1 + delta_sat1 + delta_lum1) / 3
-            frameList.append([frame, score1, frameNum])
-        elif cut == True and len(frameList) == 15:
-            maxFrame = None
-            maxScore = -1
-            maxFrameNum = -1
-            totalScore = 0
-            countFive = 0
-            maxStamp = 0
-            for arr in frameList:
-                totalScore += arr[1]
-                if arr[1] > maxScore:
-                    maxScore = arr[1]
-                    if (countFive < 5):
-                        maxFrame = arr[0]
-                        maxFrameNum = arr[2]
-                        countFive += 1
-            #cv2.imshow("Captured", maxFrame)
-            cutList.append(maxFrameNum)
-            outputFrameCount += 1
-            cut = False
-            changeH, changeS, changeL = None, None, None
-            frameList = []
+        scores.process(frameNum, shot_scores.cvt_color(frame, cv2.COLOR_BGR2HSV), timestamp)
         frameNum += 1
-        prevHue, prevSat, prevLum = hue, sat, lum
-        #cv2.imshow("Frame", frame)
-        #key = cv2.waitKey(1) & 0xFF
-    return cutList
+    scores.finish(frameNum)
+    # the frames after cuts are read again by seeking
+    scores.revisit(shot_scores.cap_reader(cap))
+    profiling.current().add_frames(frameNum)
+    return scores.sd, scores, scores.timeList
+
+# frame pipeline detector doing the same work as prepare_scores,
+# it gets the frames already converted to HSV
+class ShotDetector(shot_scores.ShotScorer):
+    # cached apart from ShotScorer, the arrays include the frame times
+    feature = "shot_detector_v2"
+
+    def __init__(self, fps=30, size=None):
+        super().__init__(size=size)
+        self.fps = fps
+        self.timeList = []
+
+    def process(self, frame_num, hsv, timestamp=None):
+        super().process(frame_num, hsv)
+        if frame_num > 0:
+            self.timeList.append((frame_num + 1) / self.fps if timestamp is None else timestamp)
+
+    def to_arrays(self):
+        arrays = super().to_arrays()
+        arrays["times"] = numpy.array(self.timeList, dtype=numpy.float64)
+        return arrays
+
+    def from_arrays(self, arrays):
+        super().from_arrays(arrays)
+        self.timeList = arrays["times"].tolist()
+
+
+def split_frames(sd, scores, start, end):
+    # cuts are found from the scores stored by prepare_scores / ShotDetector
+    return shot_scores.split_scores(sd, scores, start, end)
 
 def frames_range(cuts, time_list, start_frame, end_frame):
     l = len(cuts)
@@ -138,24 +98,50 @@ def frames_range(cuts, time_list, start_frame, end_frame):
 
         
 
-def main(path):
-    cap = cv2.VideoCapture(path)
-    sd, frames, time_list = prepare_scores(cap)
+@profiling.traced("detect_shot.main")
+def main(path, detector=None, workers=1, scenes=None, txt_dir="."):
+    # returns the [start_frame, end_frame] shots of the scenes (read from scene.txt in txt_dir by default),
+    # shot.txt is written to txt_dir unless it is None
+    if detector is None:
+        # scores of a video seen before come from the feature cache
+        arrays = feature_cache.load(path, ShotDetector.feature)
+        if arrays is not None:
+            detector = ShotDetector()
+            detector.from_arrays(arrays)
+        elif shot_scores.video_reader(path)[1] > shot_scores.PARALLEL_MIN_FRAMES:
+            # long inputs are scored in chunks on all cores
+            detector = shot_scores.parallel_scores(path, ShotDetector())
+            feature_cache.save(path, detector.feature, detector.to_arrays())
+        else:
+            cap = cv2.VideoCapture(path)
+            sd, detector, time_list = prepare_scores(cap)
+            feature_cache.save(path, detector.feature, detector.to_arrays())
+    # otherwise the frame pipeline already scored the frames
+    sd, scores, time_list = detector.sd, detector, detector.timeList
     output_list = []
     output_time = []
-    with open("scene.txt", "r") as input:
-        for line in input:
-            param = line.strip().split(' ')
-            start_frame = int(param[0])
-            end_frame = int(param[1])
-            arr = split_frames(sd, frames, start_frame, end_frame)
-            tuples, time = frames_range(arr, time_list, start_frame, end_frame)
-            output_list.append(tuples)
-            output_time.append(time)
-    input.close()
-    with open("shot.txt", "w+") as f:
-        for arr in output_list:
-            for a in arr:
-                f.write(str(a[0]) + " " + str(a[1]) + " ")
-                f.write("\n")
-    f.close()
+    if scenes is None:
+        scenes = []
+        with open(os.path.join(txt_dir, "scene.txt"), "r") as input:
+            for line in input:
+                param = line.strip().split(' ')
+                scenes.append((int(param[0]), int(param[1])))
+        input.close()
+    scenes = [(int(start_frame), int(end_frame)) for start_frame, end_frame in scenes]
+    # scenes are independent once sd is known, with workers > 1 they are split on a process pool
+    if workers != 1 and len(scenes) > 1:
+        cut_lists = shot_scores.split_scenes_parallel(sd, scores, scenes, workers)
+    else:
+        cut_lists = [split_frames(sd, scores, start_frame, end_frame) for start_frame, end_frame in scenes]
+    for (start_frame, end_frame), arr in zip(scenes, cut_lists):
+        tuples, time = frames_range(arr, time_list, start_frame, end_frame)
+        output_list.append(tuples)
+        output_time.append(time)
+    if txt_dir is not None:
+        with open(os.path.join(txt_dir, "shot.txt"), "w+") as f:
+            for arr in output_list:
+                for a in arr:
+                    f.write(str(a[0]) + " " + str(a[1]) + " ")
+                    f.write("\n")
+        f.close()
+    return numpy.array([a for arr in output_list for a in arr], dtype=numpy.int64).reshape(-1, 2)
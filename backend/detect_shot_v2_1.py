@@ -1,7 +1,13 @@
+import os
 import cv2
 import numpy
-import math
-import sys
+
+try:
+    from . import shot_scores, feature_cache, profiling
+except ImportError:
+    import shot_scores
+    import feature_cache
+    import profiling
 
 def MSE(mat1, mat2):
     height = 270
@@ -11,90 +17,18 @@ def MSE(mat1, mat2):
     abs = numpy.abs(diff)
     return (numpy.sum(abs) / float(pixels))
 
+@profiling.traced("detect_shot_v2_1.prepare_scores")
 def prepare_scores(cap):
-    frameNum = 0
-    scoreTotal = 0
-    scoreList = []
-    frames = []
-    while (True):
-        ret, frame = cap.read()
-        if frame is None:
-            break
-        frameNum += 1
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        hue, sat, lum = cv2.split(hsv)
-        if frameNum == 1:
-            prevHue, prevSat, prevLum = hue, sat, lum 
-            frames.append(frame)
-            continue
-        delta_hue = MSE(hue, prevHue)
-        delta_sat = MSE(sat, prevSat)
-        delta_lum = MSE(lum, prevLum)
-        score = (delta_hue + delta_sat + delta_lum) / 3
-        scoreTotal += score
-        scoreList.append(score)
-        frames.append(frame)
-    avg = scoreTotal/(frameNum - 1)
-    var = 0
-    for i in range(frameNum - 1):
-        var += (avg - scoreList[i]) * (avg - scoreList[i])
-    sd = math.sqrt(var / (frameNum - 1))
-    return sd, frames
+    # frames are scored as they are decoded and not kept around
+    scores = shot_scores.ShotScorer()
+    scores.add_capture(cap)
+    profiling.current().add_frames(scores.frame_count)
+    return scores.sd, scores
 
-def split_frames(sd, frames, start, end):
-    cutList = []
-    frameNum = start
-    outputFrameCount = 0
-    prevHue, prevSat, prevLum = None, None, None
-    frameList = []
-    cut = False
-    for frame in frames:
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        hue, sat, lum = cv2.split(hsv)
-        if frameNum == start:
-            prevHue, prevSat, prevLum = hue, sat, lum
-            frameNum += 1
-            continue
-        delta_hue = MSE(hue, prevHue)
-        delta_sat = MSE(sat, prevSat)
-        delta_lum = MSE(lum, prevLum)
-        score = (delta_hue + delta_sat + delta_lum) / 3
-        if (score > sd + 2.5 and cut == False):
-            cut = True
-            changeH, changeS, changeL = prevHue, prevSat, prevLum
-            frameList.append([frame, score, frameNum])
-        elif cut == True and len(frameList) < 15:
-            delta_hue1 = MSE(hue, changeH)
-            delta_sat1 = MSE(sat, changeS)
-            delta_lum1 = MSE(lum, changeL)
-            score1 = (delta_hue1 + delta_sat1 + delta_lum1) / 3
-            frameList.append([frame, score1, frameNum])
-        elif cut == True and len(frameList) == 15:
-            maxFrame = None
-            maxScore = -1
-            maxFrameNum = -1
-            totalScore = 0
-            countFive = 0
-            maxStamp = 0
-            for arr in frameList:
-                totalScore += arr[1]
-                if arr[1] > maxScore:
-                    maxScore = arr[1]
-                    if (countFive < 5):
-                        maxFrame = arr[0]
-                        maxFrameNum = arr[2]
-                        countFive += 1
-            #cv2.imshow("Captured", maxFrame)
-            cutList.append(maxFrameNum)
-            outputFrameCount += 1
-            cut = False
-            changeH, changeS, changeL = None, None, None
-            frameList = []
-        frameNum += 1
-        prevHue, prevSat, prevLum = hue, sat, lum
-        #cv2.imshow("Frame", frame)
-        #key = cv2.waitKey(1) & 0xFF
-    return cutList
+def split_frames(sd, scores, start, end):
+    # cuts are found from the scores stored by prepare_scores,
+    # like before every frame from start on is searched
+    return shot_scores.split_scores(sd, scores, start, start + scores.frame_count)
 
 def frames_range(cuts, start_frame, end_frame):
     l = len(cuts)
@@ -126,16 +60,36 @@ def frames_range(cuts, start_frame, end_frame):
 
         
 
-def main(path):
-    cap = cv2.VideoCapture(path)
-    sd, frames = prepare_scores(cap)
+@profiling.traced("detect_shot_v2_1.main")
+def main(path, txt_dir=".", scores=None):
+    # returns the [start_frame, end_frame] shots, shot.txt is written to txt_dir unless it is None
+    # scores of a video seen before come from the feature cache,
+    # scores already filled (from an analysis proxy) can be given instead
+    arrays = feature_cache.load(path, shot_scores.ShotScorer.feature) if scores is None else None
+    if scores is not None:
+        sd = scores.sd
+    elif arrays is not None:
+        scores = shot_scores.ShotScorer()
+        scores.from_arrays(arrays)
+        sd = scores.sd
+    elif shot_scores.video_reader(path)[1] > shot_scores.PARALLEL_MIN_FRAMES:
+        # long inputs are scored in chunks on all cores
+        scores = shot_scores.parallel_scores(path)
+        sd = scores.sd
+        feature_cache.save(path, scores.feature, scores.to_arrays())
+    else:
+        cap = cv2.VideoCapture(path)
+        sd, scores = prepare_scores(cap)
+        feature_cache.save(path, scores.feature, scores.to_arrays())
     output_list = []
     start_frame = 0
-    end_frame = len(frames) - 1
-    arr = split_frames(sd, frames, start_frame, end_frame)
+    end_frame = scores.frame_count - 1
+    arr = split_frames(sd, scores, start_frame, end_frame)
     output_list = frames_range(arr, start_frame, end_frame)
-    with open("shot.txt", "w+") as f:
-        for arr in output_list:
-            f.write(str(arr[0]) + " " + str(arr[1]) + " ")
-            f.write("\n")
-    f.close()
+    if txt_dir is not None:
+        with open(os.path.join(txt_dir, "shot.txt"), "w+") as f:
+            for arr in output_list:
+                f.write(str(arr[0]) + " " + str(arr[1]) + " ")
+                f.write("\n")
+        f.close()
+    return numpy.array(output_list, dtype=numpy.int64).reshape(-1, 2)
@@ -0,0 +1,82 @@
+import os
+import time
+import queue
+import threading
+
+try:
+    from . import profiling
+except ImportError:
+    import profiling
+
+# .rgb + .wav to .mp4 without holding the video in memory: a reader thread reads the .rgb
+# chunk_frames frames at a time into a queue of at most max_chunks chunks, and the chunks are
+# written to the stdin of an ffmpeg process that muxes them with the .wav.
+# memory stays at about (max_chunks + 1) chunks whatever the length of the video.
+FPS = 30
+
+
+@profiling.traced("encode_video")
+def encode_video(rgb_filepath, audio_filepath, width=480, height=270, mp4_filepath=None, fps=FPS,
+                 preset="medium", threads=0, crf=23, chunk_frames=16, max_chunks=4):
+    # threads=0 lets x264 pick, returns the path of the .mp4
+    try:
+        import ffmpeg
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError("Encoding needs the `ffmpeg` command line tool and its python wrapper, "
+                                  "install it by `pip install ffmpeg-python`.")
+    if mp4_filepath is None:
+        mp4_filepath = rgb_filepath.replace('.rgb', '.mp4')
+    frame_size = width * height * 3
+    frame_count = os.path.getsize(rgb_filepath) // frame_size
+
+    video = ffmpeg.input("pipe:", format="rawvideo", pix_fmt="rgb24", s="{}x{}".format(width, height), r=fps)
+    audio = ffmpeg.input(audio_filepath)
+    # the video sets the length like it did with moviepy, the audio is cut to it
+    process = (
+        ffmpeg.output(video, audio, mp4_filepath, vcodec="libx264", acodec="aac", pix_fmt="yuv420p",
+                      preset=preset, crf=crf, threads=threads, t=frame_count / fps)
+        .global_args("-loglevel", "error")
+        .overwrite_output()
+        .run_async(pipe_stdin=True)
+    )
+
+    chunks = queue.Queue(maxsize=max_chunks)
+
+    def read():
+        with open(rgb_filepath, "rb") as f:
+            data = f.read(frame_size * chunk_frames)
+            while len(data) >= frame_size:
+                # a partial frame at the end of the file is dropped
+                chunks.put(data[:len(data) - len(data) % frame_size])
+                data = f.read(frame_size * chunk_frames)
+        chunks.put(None)
+
+    reader = threading.Thread(target=read, daemon=True)
+    t1 = time.time()
+    reader.start()
+    written = 0
+    try:
+        while True:
+            data = chunks.get()
+            if data is None:
+                break
+            process.stdin.write(data)
+            written += len(data) // frame_size
+    except BrokenPipeError:
+        # ffmpeg stopped, its own error was printed
+        pass
+    finally:
+        process.stdin.close()
+        code = process.wait()
+        # let the reader finish if ffmpeg stopped early
+        while reader.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    if code != 0:
+        raise RuntimeError("ffmpeg exited with code {} while encoding {}".format(code, mp4_filepath))
+    seconds = time.time() - t1
+    profiling.current().add_frames(written)
+    print("[Encode] {} frames in {:.1f} s, {:.1f} fps".format(written, seconds, written / seconds if seconds else 0))
+    return mp4_filepath
@@ -0,0 +1,109 @@
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+
+# per-frame features are saved as .npz files named after a hash of the video contents
+# and the feature name, which includes the version of the code that extracted it.
+# files are touched when read and the least recently used ones are removed once
+# the cache grows past its size limit. several processes (batch workers) and threads
+# (server workers) can share the directory, any of them may remove a file another one lists.
+CACHE_DIR = os.environ.get("FEATURE_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "csci576_features"))
+MAX_BYTES = int(os.environ.get("FEATURE_CACHE_MAX_MB", 2048)) * 1024 * 1024
+# a temporary file this old was left by a process that crashed while saving
+STALE_TMP_SECONDS = 3600
+
+_hashes = {}
+
+
+def content_hash(path, chunk_size=1 << 22):
+    # remembered per process as long as the file is not modified
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _hashes:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            data = f.read(chunk_size)
+            while data:
+                h.update(data)
+                data = f.read(chunk_size)
+        _hashes[key] = h.hexdigest()
+    return _hashes[key]
+
+
+def cache_file(path, feature):
+    return os.path.join(CACHE_DIR, "{}_{}.npz".format(content_hash(path), feature))
+
+
+def load(path, feature):
+    if not os.path.exists(path):
+        return None
+    fn = cache_file(path, feature)
+    if not os.path.exists(fn):
+        return None
+    try:
+        with np.load(fn) as data:
+            arrays = {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        # half written or corrupted, extract again
+        return None
+    try:
+        os.utime(fn)
+    except FileNotFoundError:
+        # evicted meanwhile, the arrays are already read
+        pass
+    print("[FeatureCache] Loaded {} for {}".format(feature, path))
+    return arrays
+
+
+def save(path, feature, arrays):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fn = cache_file(path, feature)
+    tmp = "{}.{}-{}.tmp.npz".format(fn[:-len(".npz")], os.getpid(), threading.get_ident())
+    np.savez(tmp, **arrays)
+    os.replace(tmp, fn)
+    evict()
+    return fn
+
+
+def remove_file(fn):
+    try:
+        os.remove(fn)
+    except FileNotFoundError:
+        # another process removed it first
+        pass
+
+
+def evict_lru(entries, max_bytes, remove=remove_file):
+    # removes the least recently used of the (mtime, size, path) entries until the rest fit in max_bytes
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        remove(path)
+        total -= size
+
+
+def evict(max_bytes=None):
+    if max_bytes is None:
+        max_bytes = MAX_BYTES
+    if not os.path.isdir(CACHE_DIR):
+        return
+    now = time.time()
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".npz"):
+            continue
+        fn = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(fn)
+        except FileNotFoundError:
+            continue
+        if ".tmp." in name:
+            if now - stat.st_mtime > STALE_TMP_SECONDS:
+                remove_file(fn)
+            continue
+        entries.append((stat.st_mtime, stat.st_size, fn))
+    evict_lru(entries, max_bytes)
@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+
+try:
+    from . import feature_cache, profiling
+except ImportError:
+    import feature_cache
+    import profiling
+
+frameRate = 30
+width = 480
+height = 270
+num_channel = 3
+
+
+def readVideo(fn):
+    return np.memmap(fn, dtype=np.ubyte, mode='r').reshape(-1, height, width, num_channel)
+
+
+@profiling.hot("convert_frame")
+def convert_frame(frame, size=None, color='rgb'):
+    # frames in the .rgb file are RGB at 480x270
+    if size is not None and size != (frame.shape[1], frame.shape[0]):
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    if color == 'hsv':
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2HSV)
+    elif color == 'bgr':
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    return frame
+
+
+# reads every frame of the video once and hands it to all registered detectors.
+# a detector needs a `size` ((width, height) or None for full resolution),
+# a `color` ('rgb', 'bgr' or 'hsv'), a process(frame_num, frame) method
+# and a finish(frame_count) method.
+# detectors asking for the same size and color share the converted frame.
+# a detector with a revisit(read) method gets a reader of its frames after finish,
+# to look at some of them again (see shot_scores.ShotScorer).
+# detectors with a `feature` name and to_arrays()/from_arrays() are filled from
+# the feature cache when this video was seen before, and saved to it otherwise.
+class FramePipeline:
+    def __init__(self, path):
+        self.path = path
+        self.detectors = []
+        self.frame_count = 0
+
+    def add_detector(self, detector):
+        feature = getattr(detector, 'feature', None)
+        if feature is not None:
+            arrays = feature_cache.load(self.path, feature)
+            if arrays is not None:
+                detector.from_arrays(arrays)
+                return detector
+        self.detectors.append(detector)
+        return detector
+
+    def push(self, frame_num, frame):
+        converted = {}
+        for detector in self.detectors:
+            key = (detector.size, detector.color)
+            if key not in converted:
+                converted[key] = convert_frame(frame, detector.size, detector.color)
+            detector.process(frame_num, converted[key])
+        self.frame_count = frame_num + 1
+
+    def reader(self, size=None, color='rgb'):
+        # (start, end) -> (frame_num, frame, timestamp) of the converted frames, like the shot_scores readers
+        imgs = readVideo(self.path)
+
+        def read(start, end):
+            end = imgs.shape[0] if end is None else min(end, imgs.shape[0])
+            for frame_num in range(start, end):
+                yield frame_num, convert_frame(imgs[frame_num], size, color), (frame_num + 1) / frameRate
+        return read
+
+    def finish(self):
+        for detector in self.detectors:
+            detector.finish(self.frame_count)
+            if hasattr(detector, 'revisit'):
+                detector.revisit(self.reader(detector.size, detector.color))
+            if getattr(detector, 'feature', None) is not None:
+                feature_cache.save(self.path, detector.feature, detector.to_arrays())
+
+    def run(self):
+        if not self.detectors:
+            # everything came from the cache, nothing to decode
+            return
+        with profiling.span("FramePipeline.run", category="pipeline") as span:
+            imgs = readVideo(self.path)
+            for frame_num in range(imgs.shape[0]):
+                self.push(frame_num, imgs[frame_num])
+            self.finish()
+            span.add_frames(self.frame_count)
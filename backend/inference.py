@@ -0,0 +1,369 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+
+# backends running TransNetV2. every backend takes uint8 windows [batch, 100, 27, 48, 3] and returns
+# the single frame and many hot predictions [batch, 100, 1] after the sigmoid, as float32 arrays:
+#   tf            the SavedModel in transnetv2-weights, run eagerly by TensorFlow
+#   onnx          ONNX Runtime export of the same weights
+#   tflite        TFLite export of the same weights
+#   onnx-int8, tflite-int8   the exports quantized to int8, calibrated on real windows
+# the exports are made once by `python backend/inference.py export [--int8]` into transnetv2-export
+# (TRANSNET_EXPORT_DIR). exporting needs TensorFlow (and tf2onnx for onnx), running an export only
+# needs onnxruntime or tflite-runtime. TRANSNET_BACKEND picks the backend of transnetv2.get_model.
+# `parity` compares the predictions of a backend with the ones of the SavedModel and `benchmark`
+# measures the windows per second of every backend.
+BACKENDS = ("tf", "onnx", "onnx-int8", "tflite", "tflite-int8")
+WEIGHTS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "transnetv2-weights")
+EXPORT_DIR = os.environ.get("TRANSNET_EXPORT_DIR",
+                            os.path.join(os.path.dirname(os.path.realpath(__file__)), "transnetv2-export"))
+WINDOW_SHAPE = (100, 27, 48, 3)
+# a dict of outputs is flattened in key order
+OUTPUT_NAMES = ("many_hot", "single_frame")
+# largest difference to the SavedModel that parity accepts
+TOLERANCE = {"float": 1e-3, "int8": 0.1}
+
+
+def default_backend():
+    return os.environ.get("TRANSNET_BACKEND", "tf")
+
+
+def check_backend(name):
+    if name not in BACKENDS:
+        raise ValueError("unknown TransNetV2 backend {}, backends are {}".format(name, ", ".join(BACKENDS)))
+    return name
+
+
+def export_path(name):
+    # file of the export a backend runs
+    kind, _, quantization = check_backend(name).partition("-")
+    return os.path.join(EXPORT_DIR, "transnetv2{}.{}".format("-" + quantization if quantization else "", kind))
+
+
+def _import_tf():
+    try:
+        import tensorflow as tf
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError("The tf backend and exporting need TensorFlow, install it by `pip install tensorflow`.")
+    return tf
+
+
+def set_tf_threads(intra_op, inter_op=None):
+    # has to be called before the TensorFlow runtime starts
+    tf = _import_tf()
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+        if inter_op:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    except RuntimeError:
+        # TF runtime is already initialized, keep its settings
+        pass
+
+
+class TFBackend:
+    def __init__(self, model_dir=WEIGHTS_DIR, threads=(None, None)):
+        self._tf = _import_tf()
+        if threads[0]:
+            set_tf_threads(*threads)
+        try:
+            self._model = self._tf.saved_model.load(model_dir)
+        except OSError as exc:
+            raise IOError(f"[TransNetV2] It seems that files in {model_dir} are corrupted or missing. "
+                          f"Re-download them manually and retry. For more info, see: "
+                          f"https://github.com/soCzech/TransNetV2/issues/1#issuecomment-647357796") from exc
+
+    def predict(self, frames):
+        tf = self._tf
+        logits, dict_ = self._model(tf.cast(frames, tf.float32))
+        return tf.sigmoid(logits).numpy(), tf.sigmoid(dict_["many_hot"]).numpy()
+
+
+class OnnxBackend:
+    def __init__(self, path, threads=(None, None)):
+        try:
+            import onnxruntime as ort
+        except ModuleNotFoundError:
+            raise ModuleNotFoundError("The onnx backends need ONNX Runtime, install it by `pip install onnxruntime`.")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        intra_op, inter_op = threads
+        if intra_op:
+            options.intra_op_num_threads = intra_op
+        if inter_op:
+            options.inter_op_num_threads = inter_op
+        self._session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._input = self._session.get_inputs()[0].name
+
+    def predict(self, frames):
+        many_hot, single_frame = self._session.run(list(OUTPUT_NAMES), {self._input: frames.astype(np.float32)})
+        return single_frame, many_hot
+
+
+class TFLiteBackend:
+    def __init__(self, path, threads=(None, None)):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ModuleNotFoundError:
+            try:
+                import tensorflow as tf
+            except ModuleNotFoundError:
+                raise ModuleNotFoundError("The tflite backends need TFLite, install it by `pip install tflite-runtime` "
+                                          "(or `pip install tensorflow`).")
+            Interpreter = tf.lite.Interpreter
+        self._interpreter = Interpreter(model_path=path, num_threads=threads[0])
+        # resizes the input to the batch of every call
+        self._runner = self._interpreter.get_signature_runner()
+
+    def predict(self, frames):
+        outputs = self._runner(frames=frames.astype(np.float32))
+        return outputs["single_frame"], outputs["many_hot"]
+
+
+def load_backend(name, path=None, threads=(None, None)):
+    # path: the SavedModel directory for tf, the exported file otherwise
+    # threads: (intra_op, inter_op), None lets the runtime decide
+    if check_backend(name) == "tf":
+        return TFBackend(path or WEIGHTS_DIR, threads)
+    path = path or export_path(name)
+    if not os.path.isfile(path):
+        raise FileNotFoundError("[TransNetV2] ERROR: {} does not exist, make it by `python backend/inference.py export{}`."
+                                .format(path, " --int8" if name.endswith("-int8") else ""))
+    print("[TransNetV2] Using the {} export {}.".format(name, path))
+    return (OnnxBackend if name.startswith("onnx") else TFLiteBackend)(path, threads)
+
+
+def windows_from_rgb(path, count=32):
+    # the first count TransNetV2 input windows of an .rgb video
+    try:
+        from . import transnetv2
+        from .frame_pipeline import convert_frame, width, height
+    except ImportError:
+        import transnetv2
+        from frame_pipeline import convert_frame, width, height
+    imgs = np.memmap(path, dtype=np.uint8, mode='r').reshape(-1, height, width, 3)
+    frames = np.stack([convert_frame(img, (48, 27)) for img in imgs[:count * 50 + 25]])
+    return np.concatenate(list(transnetv2.input_windows(frames)))[:count]
+
+
+def sample_windows(rgb=None, count=32):
+    # windows of rgb, or of a synthetic video with cuts, dissolves and motion when there is none
+    if rgb is not None:
+        return windows_from_rgb(rgb, count)
+    try:
+        from . import benchmark
+    except ImportError:
+        import benchmark
+    with tempfile.TemporaryDirectory() as tmp:
+        inputs, _ = benchmark.synthetic_inputs(tmp, int(np.ceil((count * 50 + 50) / 30)))
+        return windows_from_rgb(inputs["rgb"], count)
+
+
+def _serving_function(tf, model_dir):
+    # the SavedModel with the sigmoid, on float32 windows of any batch size
+    model = tf.saved_model.load(model_dir)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, *WINDOW_SHAPE], tf.float32, name="frames")])
+    def transnet(frames):
+        logits, dict_ = model(frames)
+        return {"single_frame": tf.sigmoid(logits), "many_hot": tf.sigmoid(dict_["many_hot"])}
+
+    return model, transnet
+
+
+def export_onnx(model_dir=WEIGHTS_DIR, path=None, opset=13):
+    tf = _import_tf()
+    try:
+        import tf2onnx
+        import onnx
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError("Exporting to ONNX needs tf2onnx, install it by `pip install tf2onnx onnx`.")
+    path = path or export_path("onnx")
+    _, transnet = _serving_function(tf, model_dir)
+    model, _ = tf2onnx.convert.from_function(transnet, input_signature=transnet.input_signature, opset=opset)
+    # name the outputs, the backend asks for them by name
+    for output, name in zip(model.graph.output, OUTPUT_NAMES):
+        model.graph.node.append(onnx.helper.make_node("Identity", [output.name], [name]))
+        output.name = name
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    onnx.save(model, path)
+    return path
+
+
+def quantize_onnx(windows, path=None, output_path=None):
+    # static int8 quantization (QDQ, per channel weights) with the activation ranges of windows
+    try:
+        from onnxruntime import quantization
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError("Quantizing needs ONNX Runtime, install it by `pip install onnxruntime`.")
+    path = path or export_path("onnx")
+    output_path = output_path or export_path("onnx-int8")
+
+    class Calibration(quantization.CalibrationDataReader):
+        def __init__(self):
+            import onnxruntime as ort
+            self.name = ort.InferenceSession(path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+            self.windows = iter(windows)
+
+        def get_next(self):
+            window = next(self.windows, None)
+            return None if window is None else {self.name: window[np.newaxis].astype(np.float32)}
+
+    quantization.quantize_static(path, output_path, Calibration(), quant_format=quantization.QuantFormat.QDQ,
+                                 per_channel=True, activation_type=quantization.QuantType.QInt8,
+                                 weight_type=quantization.QuantType.QInt8)
+    return output_path
+
+
+def export_tflite(model_dir=WEIGHTS_DIR, path=None, windows=None):
+    # int8 weights and activations where TFLite has int8 kernels when windows for the calibration are given,
+    # input and outputs stay float32. ops without a TFLite kernel fall back to TensorFlow ones,
+    # an export needing them only runs with the interpreter of tensorflow, not tflite-runtime
+    tf = _import_tf()
+    path = path or export_path("tflite-int8" if windows is not None else "tflite")
+    model, transnet = _serving_function(tf, model_dir)
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([transnet.get_concrete_function()], model)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+    if windows is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([window[np.newaxis].astype(np.float32)] for window in windows)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+    return path
+
+
+def export(formats=("onnx", "tflite"), int8=False, calibration_rgb=None, calibration_windows=64, model_dir=WEIGHTS_DIR):
+    # exports of the SavedModel, the int8 ones too when int8 is set. returns their paths
+    paths = []
+    windows = sample_windows(calibration_rgb, calibration_windows) if int8 else None
+    if "onnx" in formats:
+        paths.append(export_onnx(model_dir))
+        print("[Export] {}".format(paths[-1]))
+        if int8:
+            paths.append(quantize_onnx(windows))
+            print("[Export] {}".format(paths[-1]))
+    if "tflite" in formats:
+        paths.append(export_tflite(model_dir))
+        print("[Export] {}".format(paths[-1]))
+        if int8:
+            paths.append(export_tflite(model_dir, windows=windows))
+            print("[Export] {}".format(paths[-1]))
+    return paths
+
+
+def _predict(model, windows, batch_size):
+    predictions = [model.predict_raw(windows[i:i + batch_size]) for i in range(0, len(windows), batch_size)]
+    return (np.concatenate([single_ for single_, all_ in predictions]),
+            np.concatenate([all_ for single_, all_ in predictions]))
+
+
+def parity(name, windows, batch_size=16, reference="tf", threads=(None, None), atol=None):
+    # predict_raw of backend name against the one of reference on the same windows.
+    # passes when no prediction is off by more than atol and the sub-shots of the windows are the same
+    try:
+        from . import transnetv2
+    except ImportError:
+        import transnetv2
+    atol = atol if atol is not None else TOLERANCE["int8" if name.endswith("-int8") else "float"]
+    expected = _predict(transnetv2.TransNetV2(backend=reference, threads=threads), windows, batch_size)
+    actual = _predict(transnetv2.TransNetV2(backend=name, threads=threads), windows, batch_size)
+    report = {"backend": name, "reference": reference, "windows": len(windows), "atol": atol}
+    for key, a, b in zip(("single_frame", "many_hot"), expected, actual):
+        diff = np.abs(a.astype(np.float64) - b)
+        report[key] = {"max_abs_diff": float(diff.max()), "mean_abs_diff": float(diff.mean()),
+                       "threshold_agreement": float(np.mean((a > 0.25) == (b > 0.25)))}
+    # the frames the pipeline keeps, the middle 50 of every window
+    scenes = [transnetv2.TransNetV2.predictions_to_scenes(single_frame[:, 25:75, 0].reshape(-1))
+              for single_frame, _ in (expected, actual)]
+    report["same_subshots"] = bool(np.array_equal(*scenes))
+    report["ok"] = report["same_subshots"] and max(report["single_frame"]["max_abs_diff"],
+                                                   report["many_hot"]["max_abs_diff"]) <= atol
+    return report
+
+
+def benchmark(names, windows, batch_size=16, threads=(None, None), repeats=3):
+    # windows per second of every backend, a backend that cannot be loaded is reported with its error
+    try:
+        from . import transnetv2
+    except ImportError:
+        import transnetv2
+    results = []
+    for name in names:
+        result = {"backend": name, "batch_size": batch_size, "threads": threads[0]}
+        try:
+            t1 = time.time()
+            model = transnetv2.TransNetV2(backend=name, threads=threads)
+            t2 = time.time()
+            model.warmup()
+            t3 = time.time()
+            for _ in range(repeats):
+                _predict(model, windows, batch_size)
+            seconds = time.time() - t3
+            result.update({"ok": True, "load_time": t2 - t1, "warmup_time": t3 - t2,
+                           "windows_per_second": len(windows) * repeats / seconds,
+                           "frames_per_second": len(windows) * repeats * 50 / seconds})
+        except Exception as exc:
+            result.update({"ok": False, "error": "{}: {}".format(type(exc).__name__, exc)})
+        results.append(result)
+    return results
+
+
+def print_benchmark(results):
+    print("{:<12} {:>10} {:>10} {:>10} {:>10}".format("backend", "load s", "warmup s", "windows/s", "frames/s"))
+    for result in results:
+        if result["ok"]:
+            print("{:<12} {:>10.2f} {:>10.2f} {:>10.1f} {:>10.0f}".format(
+                result["backend"], result["load_time"], result["warmup_time"], result["windows_per_second"],
+                result["frames_per_second"]))
+        else:
+            print("{:<12} {}".format(result["backend"], result["error"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export TransNetV2 to ONNX Runtime and TFLite, check and benchmark the backends")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Export the SavedModel to {}".format(EXPORT_DIR))
+    export_parser.add_argument('--formats', nargs='+', choices=['onnx', 'tflite'], default=['onnx', 'tflite'])
+    export_parser.add_argument('--int8', action='store_true', help='Also write the int8 quantized exports')
+    parity_parser = commands.add_parser("parity", help="Compare the predictions of a backend with the SavedModel")
+    parity_parser.add_argument('backend', choices=BACKENDS[1:])
+    parity_parser.add_argument('--atol', type=float, help='Largest accepted difference of a prediction, {} for float '
+                                                          'and {} for int8 backends by default'.format(
+                                                              TOLERANCE["float"], TOLERANCE["int8"]))
+    benchmark_parser = commands.add_parser("benchmark", help="Windows per second of every backend")
+    benchmark_parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    benchmark_parser.add_argument('--repeats', type=int, default=3)
+    benchmark_parser.add_argument('--output', help='Also write the results as json to this file')
+    for command in (export_parser, parity_parser, benchmark_parser):
+        command.add_argument('--rgb', help='Windows from this .rgb video instead of a synthetic one')
+        command.add_argument('--windows', type=int, default=64 if command is export_parser else 32,
+                             help='Windows to calibrate with' if command is export_parser else 'Windows to predict')
+    for command in (parity_parser, benchmark_parser):
+        command.add_argument('--batch-size', type=int, default=16)
+        command.add_argument('--threads', type=int, help='Intra-op threads, all cores by default')
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export(args.formats, args.int8, args.rgb, args.windows)
+        return 0
+    windows = sample_windows(args.rgb, args.windows)
+    threads = (args.threads or os.cpu_count(), None)
+    if args.command == "parity":
+        report = parity(args.backend, windows, args.batch_size, threads=threads, atol=args.atol)
+        print(json.dumps(report, indent=1))
+        print("[Parity] {} {} the SavedModel".format(args.backend, "matches" if report["ok"] else "does NOT match"))
+        return 0 if report["ok"] else 1
+    results = benchmark(args.backends, windows, args.batch_size, threads, args.repeats)
+    print_benchmark(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import atexit
+import threading
+from functools import wraps
+
+# opt-in instrumentation of the segmentation stages. a span (`with span(name, frames):`) records
+# wall time, process CPU time, frames and the RSS change of a stage and is exported as a
+# Chrome trace event (chrome://tracing, Perfetto). hot functions called per frame (decode, color
+# conversion, MSE, TF inference) are wrapped with @hot instead: their calls are only summed up,
+# per function and per enclosing span of the same thread, so the trace stays small.
+# turned on by enable() or by setting SEGMENT_PROFILE to the path of the trace to write at exit.
+# while disabled a span is a shared no-op object and a hot call is one attribute check.
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class _State:
+    enabled = False
+    trace_path = None
+    origin = 0.
+    events = []
+    totals = {}
+
+
+_state = _State()
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _add(table, name, calls, wall, cpu, frames=0, rss_delta=None):
+    entry = table.get(name)
+    if entry is None:
+        entry = table[name] = {"calls": 0, "wall": 0., "cpu": 0., "frames": 0, "rss_delta_max": None}
+    entry["calls"] += calls
+    entry["wall"] += wall
+    entry["cpu"] += cpu
+    entry["frames"] += frames
+    if rss_delta is not None:
+        # hot functions have no RSS change
+        entry["rss_delta_max"] = rss_delta if entry["rss_delta_max"] is None else max(entry["rss_delta_max"], rss_delta)
+
+
+class Span:
+    def __init__(self, name, frames=0, category="stage"):
+        self.name = name
+        self.frames = frames
+        self.category = category
+        self.hot = {}
+
+    def add_frames(self, frames):
+        self.frames += frames
+
+    def __enter__(self):
+        _stack().append(self)
+        self.rss = _rss_bytes()
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu
+        rss_delta = _rss_bytes() - self.rss
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        args = {"cpu_ms": round(cpu * 1000, 3), "frames": self.frames,
+                "rss_delta_mb": round(rss_delta / 2 ** 20, 3)}
+        if self.hot:
+            args["hot"] = {name: {"calls": entry["calls"], "ms": round(entry["wall"] * 1000, 3)}
+                           for name, entry in self.hot.items()}
+        if exc_type is not None:
+            args["error"] = exc_type.__name__
+        event = {"name": self.name, "cat": self.category, "ph": "X",
+                 "ts": round((self.start - _state.origin) * 1e6, 3), "dur": round(wall * 1e6, 3),
+                 "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+        with _lock:
+            _state.events.append(event)
+            _add(_state.totals, self.name, 1, wall, cpu, self.frames, rss_delta)
+        return False
+
+
+class _NullSpan:
+    frames = 0
+
+    def add_frames(self, frames):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, frames=0, category="stage"):
+    # set .frames on the span (or call add_frames) when the count is only known at the end
+    if not _state.enabled:
+        return _NULL_SPAN
+    return Span(name, frames, category)
+
+
+def current():
+    # innermost open span of this thread, for a traced function to add its frames to
+    stack = _stack() if _state.enabled else None
+    return stack[-1] if stack else _NULL_SPAN
+
+
+def traced(name, category="stage"):
+    # decorator putting every call of a function in a span
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            with Span(name, 0, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def hot(name):
+    # decorator summing up wall and thread CPU time of a function called per frame
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            cpu = time.thread_time()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                wall = time.perf_counter() - start
+                cpu = time.thread_time() - cpu
+                stack = _stack()
+                with _lock:
+                    _add(_state.totals, name, 1, wall, cpu)
+                    if stack:
+                        _add(stack[-1].hot, name, 1, wall, cpu)
+        return wrapper
+    return decorate
+
+
+def enabled():
+    return _state.enabled
+
+
+def enable(trace_path=None):
+    # trace_path: Chrome trace written by finish()
+    with _lock:
+        if not _state.enabled:
+            _state.origin = time.perf_counter()
+        _state.enabled = True
+        _state.trace_path = trace_path or _state.trace_path
+
+
+def disable():
+    _state.enabled = False
+
+
+def clear():
+    with _lock:
+        _state.events = []
+        _state.totals = {}
+
+
+def chrome_trace():
+    with _lock:
+        events = list(_state.events)
+    events.sort(key=lambda event: event["ts"])
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(path):
+    with open(path, "w") as f:
+        json.dump(chrome_trace(), f)
+    return path
+
+
+def summary():
+    # spans and hot functions as a text table, the most expensive first
+    with _lock:
+        totals = {name: dict(entry) for name, entry in _state.totals.items()}
+    rows = [("name", "calls", "wall s", "cpu s", "frames", "fps", "max rss +MB")]
+    for name, entry in sorted(totals.items(), key=lambda item: -item[1]["wall"]):
+        fps = entry["frames"] / entry["wall"] if entry["frames"] and entry["wall"] > 0 else None
+        rows.append((name, str(entry["calls"]), "{:.3f}".format(entry["wall"]), "{:.3f}".format(entry["cpu"]),
+                     str(entry["frames"] or ""), "{:.1f}".format(fps) if fps else "",
+                     "" if entry["rss_delta_max"] is None else "{:.1f}".format(entry["rss_delta_max"] / 2 ** 20)))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = []
+    for k, row in enumerate(rows):
+        lines.append("  ".join(cell.ljust(widths[i]) if i == 0 else cell.rjust(widths[i]) for i, cell in enumerate(row)))
+        if k == 0:
+            lines.append("-" * len(lines[0]))
+    return "\n".join(lines)
+
+
+def finish():
+    # writes the trace (when enable got a path) and prints the summary, once
+    if not _state.enabled:
+        return
+    if _state.trace_path:
+        write_chrome_trace(_state.trace_path)
+        print("[Profile] Chrome trace written to {}".format(_state.trace_path))
+    print(summary())
+    disable()
+
+
+if os.environ.get("SEGMENT_PROFILE"):
+    # SEGMENT_PROFILE=1 only prints the summary
+    enable(None if os.environ["SEGMENT_PROFILE"] == "1" else os.environ["SEGMENT_PROFILE"])
+    atexit.register(finish)
@@ -0,0 +1,255 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+from numpy.lib.format import open_memmap
+
+try:
+    from . import feature_cache
+    from .frame_pipeline import FramePipeline, height, width
+except ImportError:
+    import feature_cache
+    from frame_pipeline import FramePipeline, height, width
+
+# downscaled copies of a video computed in one pass and kept as memory-mapped .npy files,
+# so detectors read their resolution instead of decoding and resizing the video themselves:
+#   <w>x<h>_rgb.npy / <w>x<h>_hsv.npy  (frames, h, w, 3) uint8, converted like the frame pipeline does
+#   grid_rgb.npy                       (frames, 9, 16, 3) uint8, the pixels every 30 pixels detect_scene_v2_1 uses
+# only the levels a run reads are built (levels_for), a later run needing another level adds it.
+# proxies are stored by content hash of the video in PROXY_DIR. every level is written to a build
+# directory of its own process and thread and moved into the proxy with os.replace when it is
+# finished, so a level file in a proxy is always complete and concurrent builds never see each
+# other's half written arrays. proxies are touched when opened and the least recently used ones
+# are removed once PROXY_DIR grows past PROXY_MAX_MB, like the feature cache.
+PROXY_DIR = os.environ.get("PROXY_DIR", os.path.join(os.path.expanduser("~"), ".cache", "csci576_proxy"))
+MAX_BYTES = int(os.environ.get("PROXY_MAX_MB", 20480)) * 1024 * 1024
+PROXY_VERSION = 2
+LEVELS = ((240, 135), (120, 68), (48, 27))
+COLORS = ("rgb", "hsv")
+GRID_STEP = 30
+GRID_SIZE = (16, 9)
+GRID = "grid_rgb"
+MANIFEST_NAME = "manifest.json"
+BUILD_PREFIX = ".build-"
+
+
+def level_name(size, color):
+    return "{}x{}_{}".format(size[0], size[1], color)
+
+
+def levels_for(shot_size=None):
+    # what a segmentation run reads: 48x27 RGB for TransNetV2 and the grid for detect_scene_v2_1,
+    # HSV only at the level shots are scored on
+    levels = [level_name((48, 27), "rgb"), GRID]
+    if shot_size is not None:
+        levels.append(level_name(shot_size, "hsv"))
+    return levels
+
+
+def proxy_dir(path, root=None):
+    return os.path.join(root or PROXY_DIR, "{}_v{}".format(feature_cache.content_hash(path), PROXY_VERSION))
+
+
+# frame pipeline detectors writing into the mapped arrays
+class LevelWriter:
+    def __init__(self, array, size, color):
+        self.array = array
+        self.size = size
+        self.color = color
+
+    def process(self, frame_num, frame):
+        self.array[frame_num] = frame
+
+    def finish(self, frame_count):
+        self.array.flush()
+
+
+class GridWriter:
+    size = None
+    color = 'rgb'
+
+    def __init__(self, array):
+        self.array = array
+
+    def process(self, frame_num, frame):
+        self.array[frame_num] = frame[0:GRID_SIZE[1] * GRID_STEP:GRID_STEP, 0:GRID_SIZE[0] * GRID_STEP:GRID_STEP]
+
+    def finish(self, frame_count):
+        self.array.flush()
+
+
+class _Publisher:
+    # added after the writers, so it is finished after them
+    size = None
+    color = 'rgb'
+
+    def __init__(self, builder):
+        self.builder = builder
+
+    def process(self, frame_num, frame):
+        pass
+
+    def finish(self, frame_count):
+        self.builder.publish(frame_count)
+
+
+class Proxy:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_NAME), "r") as f:
+            self.manifest = json.load(f)
+        self.frame_count = self.manifest["frame_count"]
+        self._arrays = {}
+
+    @classmethod
+    def open(cls, path, root=None):
+        # the proxy of the video at path, None if none of its levels was finished
+        directory = proxy_dir(path, root)
+        try:
+            proxy = cls(directory)
+            os.utime(directory)
+        except FileNotFoundError:
+            return None
+        return proxy
+
+    def has(self, name):
+        return os.path.exists(os.path.join(self.directory, name + ".npy"))
+
+    def _array(self, name):
+        if name not in self._arrays:
+            if not self.has(name):
+                raise KeyError("proxy has no {} level".format(name))
+            self._arrays[name] = np.load(os.path.join(self.directory, name + ".npy"), mmap_mode='r')
+        return self._arrays[name]
+
+    def level(self, size, color='rgb'):
+        return self._array(level_name(size, color))
+
+    def grid(self):
+        return self._array(GRID)
+
+
+class ProxyBuilder:
+    def __init__(self, path, levels=None, root=None):
+        # levels: names of the levels to build (level_name or GRID), levels_for() by default
+        self.path = path
+        self.root = root or PROXY_DIR
+        self.levels = list(levels or levels_for())
+        for name in self.levels:
+            if name != GRID and name not in [level_name(size, color) for size in LEVELS for color in COLORS]:
+                raise ValueError("unknown proxy level {}".format(name))
+        self.directory = proxy_dir(path, root)
+        self.frame_count = os.path.getsize(path) // (width * height * 3)
+        self.build_dir = None
+
+    def missing(self):
+        return [name for name in self.levels if not os.path.exists(os.path.join(self.directory, name + ".npy"))]
+
+    def exists(self):
+        return not self.missing()
+
+    def add_to(self, pipeline):
+        # the missing levels are written while the pipeline decodes the video for other detectors as well
+        self.names = self.missing()
+        if not self.names:
+            return pipeline
+        self.build_dir = os.path.join(self.root, "{}{}-{}-{}".format(
+            BUILD_PREFIX, os.path.basename(self.directory), os.getpid(), threading.get_ident()))
+        os.makedirs(self.build_dir, exist_ok=True)
+        for name in self.names:
+            fn = os.path.join(self.build_dir, name + ".npy")
+            if name == GRID:
+                array = open_memmap(fn, mode='w+', dtype=np.uint8,
+                                    shape=(self.frame_count, GRID_SIZE[1], GRID_SIZE[0], 3))
+                pipeline.add_detector(GridWriter(array))
+            else:
+                size, color = name.rsplit("_", 1)
+                size = tuple(int(n) for n in size.split("x"))
+                array = open_memmap(fn, mode='w+', dtype=np.uint8, shape=(self.frame_count, size[1], size[0], 3))
+                pipeline.add_detector(LevelWriter(array, size, color))
+        pipeline.add_detector(_Publisher(self))
+        return pipeline
+
+    def publish(self, frame_count):
+        # moves the finished levels into the proxy, the manifest is the same for every build of the video
+        os.makedirs(self.directory, exist_ok=True)
+        for name in self.names:
+            os.replace(os.path.join(self.build_dir, name + ".npy"), os.path.join(self.directory, name + ".npy"))
+        manifest = {"version": PROXY_VERSION, "source": os.path.abspath(self.path), "frame_count": frame_count}
+        tmp = os.path.join(self.build_dir, MANIFEST_NAME)
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.directory, MANIFEST_NAME))
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+        evict(keep=self.directory, root=self.root)
+
+    def build(self):
+        pipeline = FramePipeline(self.path)
+        self.add_to(pipeline)
+        pipeline.run()
+        return Proxy(self.directory)
+
+
+def _directory_size(directory):
+    size = 0
+    for name in os.listdir(directory):
+        try:
+            size += os.stat(os.path.join(directory, name)).st_size
+        except FileNotFoundError:
+            pass
+    return size
+
+
+def _build_alive(name):
+    # a build directory of a process that is gone was left by a crash
+    try:
+        pid = int(name.split("-")[-2])
+        os.kill(pid, 0)
+    except (ValueError, IndexError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _remove_directory(directory):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def evict(max_bytes=None, keep=None, root=None):
+    # removes the least recently used proxies (but keep) until PROXY_DIR fits in max_bytes
+    root = root or PROXY_DIR
+    if max_bytes is None:
+        max_bytes = MAX_BYTES
+    if not os.path.isdir(root):
+        return
+    entries = []
+    for name in os.listdir(root):
+        directory = os.path.join(root, name)
+        try:
+            if name.startswith(BUILD_PREFIX):
+                if not _build_alive(name):
+                    _remove_directory(directory)
+                continue
+            if not os.path.isdir(directory):
+                continue
+            size = _directory_size(directory)
+            if directory == keep:
+                max_bytes -= size
+                continue
+            entries.append((os.stat(directory).st_mtime, size, directory))
+        except FileNotFoundError:
+            # removed by another process meanwhile
+            continue
+    feature_cache.evict_lru(entries, max(0, max_bytes), _remove_directory)
+
+
+def get_proxy(path, levels=None, root=None):
+    # the proxy of the .rgb file at path with the levels (levels_for() by default), missing ones are built first
+    builder = ProxyBuilder(path, levels, root)
+    proxy = Proxy.open(path, root)
+    if proxy is None or not builder.exists():
+        print("[Proxy] Building {} of the analysis proxy of {}".format(", ".join(builder.missing()), path))
+        proxy = builder.build()
+    return proxy
@@ -0,0 +1,103 @@
+import numpy as np
+
+try:
+    from . import profiling
+except ImportError:
+    import profiling
+
+LEVELS = ("scene", "shot", "subshot")
+
+
+def load_segments(filename):
+    # [start_frame, end_frame] rows of scene.txt / shot.txt / subshot.txt
+    try:
+        segments = np.loadtxt(filename, dtype=np.int64, ndmin=2)
+    except (OSError, ValueError):
+        return np.zeros((0, 2), dtype=np.int64)
+    return segments.reshape(-1, 2)
+
+
+# scenes, shots and subshots as sorted start/end frame arrays.
+# a segment's parent is the segment of the level above that contains it,
+# found with searchsorted, so building the hierarchy is O(n log n) and
+# finding the segment containing a frame or a time is O(log n).
+class SegmentIndex:
+    def __init__(self, scenes, shots, subshots, fps=30):
+        self.fps = fps
+        self.starts = {}
+        self.ends = {}
+        self.parents = {}
+        self.child_order = {}
+        self.child_offsets = {}
+        for level, segments in zip(LEVELS, (scenes, shots, subshots)):
+            segments = np.asarray(segments, dtype=np.int64).reshape(-1, 2)
+            order = np.argsort(segments[:, 0], kind="stable")
+            self.starts[level] = segments[order, 0]
+            self.ends[level] = segments[order, 1]
+        for parent, level in zip(LEVELS[:-1], LEVELS[1:]):
+            self._link(parent, level)
+
+    @classmethod
+    @profiling.traced("SegmentIndex.from_txts")
+    def from_txts(cls, scene_fn="scene.txt", shot_fn="shot.txt", subshot_fn="subshot.txt", fps=30):
+        return cls(load_segments(scene_fn), load_segments(shot_fn), load_segments(subshot_fn), fps)
+
+    def _link(self, parent, level):
+        starts, ends = self.starts[level], self.ends[level]
+        # last parent starting at or before the segment, it contains the segment if it also ends after it
+        idx = np.searchsorted(self.starts[parent], starts, side="right") - 1
+        valid = idx >= 0
+        valid[valid] = ends[valid] <= self.ends[parent][idx[valid]]
+        parents = np.where(valid, idx, -1)
+        self.parents[level] = parents
+        # children grouped by parent, in start order
+        order = np.argsort(parents, kind="stable")
+        order = order[parents[order] >= 0]
+        self.child_order[parent] = order
+        self.child_offsets[parent] = np.searchsorted(parents[order], np.arange(len(self.starts[parent]) + 1))
+
+    def __len__(self):
+        return len(self.starts["scene"])
+
+    def count(self, level):
+        return len(self.starts[level])
+
+    def children(self, level, i):
+        # indices of the segments of the next level contained in segment i
+        offsets = self.child_offsets[level]
+        return self.child_order[level][offsets[i]:offsets[i + 1]]
+
+    def parent(self, level, i):
+        return self.parents[level][i]
+
+    def find(self, level, frame):
+        # segment of this level containing frame, -1 if none
+        i = np.searchsorted(self.starts[level], frame, side="right") - 1
+        if i < 0 or frame > self.ends[level][i]:
+            return -1
+        return int(i)
+
+    def find_time(self, level, timestamp_ms):
+        return self.find(level, int(timestamp_ms * self.fps / 1000.))
+
+    def locate(self, frame):
+        # (scene, shot, subshot) containing frame
+        return tuple(self.find(level, frame) for level in LEVELS)
+
+    def timestamp_ms(self, level, i):
+        return round((self.starts[level][i] / self.fps) * 1000.)
+
+    def toc(self):
+        # the nested lists the VideoPlayer table of contents is built from:
+        # a list per scene, in it a list per shot with the shot's timestamp in ms
+        # followed by the timestamps of its subshots
+        scenes = []
+        for scene in range(self.count("scene")):
+            new_scene_list = []
+            for shot in self.children("scene", scene):
+                new_shot_list = [self.timestamp_ms("shot", shot)]
+                for subshot in self.children("shot", shot):
+                    new_shot_list.append(self.timestamp_ms("subshot", subshot))
+                new_scene_list.append(new_shot_list)
+            scenes.append(new_scene_list)
+        return scenes
@@ -0,0 +1,169 @@
+import os
+
+try:
+    from . import transnetv2, detect_shot, shot_scores, detect_audio, feature_cache, detect_shot_v2_1, detect_scene_v2_1
+    from .detect import detectScene
+    from .encode import encode_video
+    from .frame_pipeline import FramePipeline
+    from .proxy import ProxyBuilder, get_proxy, levels_for
+    from .segmentation_result import SegmentationResult, RESULT_NAME
+    from .stages import StageGraph
+except ImportError:
+    import transnetv2
+    import detect_shot
+    import shot_scores
+    import detect_audio
+    import feature_cache
+    import detect_shot_v2_1
+    import detect_scene_v2_1
+    from detect import detectScene
+    from encode import encode_video
+    from frame_pipeline import FramePipeline
+    from proxy import ProxyBuilder, get_proxy, levels_for
+    from segmentation_result import SegmentationResult, RESULT_NAME
+    from stages import StageGraph
+
+
+# the stages of run_videoplayer_final.py, also run by the batch command without the player,
+# and with version="v2_1" the ones of run_videoplayer_v2_1.1.py
+VERSIONS = ("final", "v2_1")
+
+
+def segmentation_stages(rgb_filepath, wav_filepath, output_dir, mp4_filepath=None, width=480, height=270,
+                        export_txt=False, preset="medium", threads=0, shot_size=None, on_subshots=None, encode=True,
+                        encode_dir=None, version="final", shot_workers=None):
+    # encode -> scene -> shot -> audio -> subshot -> timestamps, a re-run only executes the stages whose inputs
+    # or parameters changed. the result file and scene.txt, shot.txt, subshot.txt (when export_txt is set)
+    # are saved to output_dir by the timestamps stage
+    # when scene detection runs, the video is decoded once for it, full resolution shot scores
+    # and the analysis proxy. inputs longer than shot_scores.PARALLEL_MIN_FRAMES are scored
+    # in parallel chunks by the shot stage instead, and their scenes are split into shots on a process pool,
+    # both with shot_workers threads / processes (all cores by default). sub-shots and shots at a lower
+    # shot_size read their proxy level.
+    # the audio stage splits long scenes at shot boundaries where the sound changes or pauses.
+    # on_subshots gets the sub-shots of every group of shots as they are found.
+    # without encode there is no encode stage, the result refers to mp4_filepath if there is one.
+    # the encoded .mp4 is written next to the .rgb, or into encode_dir when it is given.
+    # version "v2_1" runs encode -> shot -> scene -> subshot -> timestamps instead: shots are scored on
+    # the .mp4 (on the proxy with shot_size) by detect_shot_v2_1 and grouped into scenes by
+    # detect_scene_v2_1 on the grid of the proxy, there is no audio stage
+    if version not in VERSIONS:
+        raise ValueError("unknown segmentation version {}, versions are {}".format(version, ", ".join(VERSIONS)))
+    if version == "v2_1" and not encode:
+        raise ValueError("the v2_1 stages score shots on the encoded .mp4, they need the encode stage")
+    detectors = {}
+    frame_count = os.path.getsize(rgb_filepath) // (width * height * 3)
+    shot_workers = shot_workers or os.cpu_count()
+    scene_params = {"detector": "adaptive", "adaptive_threshold": 8, "min_scene_len": 300}
+    shot_params = {"cut_offset": 2.5, "window": 15, "size": shot_size}
+    proxy_levels = levels_for(shot_size)
+    subshot_params = {"min_shot_len": 250, "threshold": 0.25}
+    if transnetv2.backend_name() != "tf":
+        # sub-shots of another TransNetV2 backend are redone, the ones of the SavedModel keep their key
+        subshot_params["backend"] = transnetv2.backend_name()
+    audio_params = {"feature": detect_audio.AUDIO_FEATURE, "silence_db": detect_audio.SILENCE_DB,
+                    "min_silence_frames": detect_audio.MIN_SILENCE_FRAMES, "flux_k": detect_audio.FLUX_K,
+                    "tolerance": detect_audio.PEAK_RADIUS, "min_scene_len": scene_params["min_scene_len"]}
+    if version == "v2_1":
+        scene_params = {"detector": "grid_hsv", "threshold": 1}
+
+    def encode_stage(outputs, journal):
+        if mp4_filepath:
+            # --mp4file, already encoded
+            return mp4_filepath
+        encoded = None
+        if encode_dir is not None:
+            encoded = os.path.join(encode_dir, os.path.splitext(os.path.basename(rgb_filepath))[0] + ".mp4")
+        return encode_video(rgb_filepath, wav_filepath, width, height, encoded, preset=preset, threads=threads)
+
+    def scene(outputs, journal):
+        pipeline = FramePipeline(rgb_filepath)
+        if shot_size is None and frame_count <= shot_scores.PARALLEL_MIN_FRAMES:
+            detectors["shot"] = pipeline.add_detector(detect_shot.ShotDetector())
+        # only the proxy levels this run reads, built while the scene pass decodes the video
+        ProxyBuilder(rgb_filepath, proxy_levels).add_to(pipeline)
+        return detectScene(rgb_filepath, pipeline, txt_dir=None)
+
+    def shot(outputs, journal):
+        if shot_size is not None:
+            hsv = get_proxy(rgb_filepath, proxy_levels).level(shot_size, 'hsv')
+            detectors["shot"] = shot_scores.proxy_scores(rgb_filepath, hsv, detect_shot.ShotDetector(size=shot_size),
+                                                         shot_workers)
+        elif "shot" not in detectors:
+            # a long input, or scene detection was up to date: the scores come from the feature cache
+            # or a pass of their own. long inputs are scored in chunks on all cores
+            pipeline = FramePipeline(rgb_filepath)
+            detector = detectors["shot"] = pipeline.add_detector(detect_shot.ShotDetector())
+            if pipeline.detectors and frame_count > shot_scores.PARALLEL_MIN_FRAMES:
+                shot_scores.parallel_scores(rgb_filepath, detector, shot_workers)
+                feature_cache.save(rgb_filepath, detector.feature, detector.to_arrays())
+            else:
+                pipeline.run()
+        # splitting the scenes of a short input is quicker than starting the pool
+        workers = shot_workers if frame_count > shot_scores.PARALLEL_MIN_FRAMES else 1
+        return detect_shot.main(rgb_filepath, detectors["shot"], workers, scenes=outputs["scene"], txt_dir=None)
+
+    def shot_v2_1(outputs, journal):
+        scores = None
+        if shot_size is not None:
+            hsv = get_proxy(rgb_filepath, proxy_levels).level(shot_size, 'hsv')
+            scores = shot_scores.proxy_scores(rgb_filepath, hsv, shot_scores.ShotScorer(size=shot_size), shot_workers)
+        return detect_shot_v2_1.main(outputs["encode"], txt_dir=None, scores=scores)
+
+    def scene_v2_1(outputs, journal):
+        return detect_scene_v2_1.main(rgb_filepath, shots=outputs["shot"], txt_dir=None,
+                                      grid_frames=get_proxy(rgb_filepath, proxy_levels).grid())
+
+    def audio(outputs, journal):
+        boundaries, _ = detect_audio.audio_boundaries(wav_filepath)
+        return detect_audio.refine_scenes(outputs["scene"], outputs["shot"], boundaries,
+                                          audio_params["tolerance"], audio_params["min_scene_len"])
+
+    def subshot(outputs, journal):
+        # the windows of all long shots go through TransNetV2 in batches, finished shots are journaled.
+        # the 48x27 frames are an area resize of the .rgb, not ffmpeg's scaling of the .mp4,
+        # sub-shots can be a frame or two apart from the ones found on the latter (tests/test_transnetv2.py)
+        long_shots = [(int(start_frame), int(end_frame)) for start_frame, end_frame in outputs["shot"]
+                      if end_frame - start_frame >= subshot_params["min_shot_len"]]
+        frames = get_proxy(rgb_filepath, proxy_levels).level((48, 27), 'rgb')
+        return transnetv2.resumable_subshots(rgb_filepath, long_shots, journal, frames, callback=on_subshots)
+
+    def timestamps(outputs, journal):
+        params = {"scene": scene_params, "shot": shot_params, "subshot": subshot_params}
+        if version == "final":
+            params["audio"] = audio_params
+        scenes = outputs["audio"] if version == "final" else outputs["scene"]
+        result = SegmentationResult({"scene": scenes, "shot": outputs["shot"], "subshot": outputs["subshot"]}, {
+            "fps": 30,
+            "frame_count": os.path.getsize(rgb_filepath) // (width * height * 3),
+            "rgb": os.path.abspath(rgb_filepath),
+            "mp4": os.path.abspath(outputs["encode"]) if encode else mp4_filepath and os.path.abspath(mp4_filepath),
+            "params": params,
+            "timings": dict(graph.timings),
+        })
+        result.save(os.path.join(output_dir, RESULT_NAME))
+        if export_txt:
+            result.export_txt(output_dir)
+        return result.index().toc()
+
+    graph = StageGraph(output_dir)
+    if encode:
+        graph.add("encode", encode_stage, inputs={"rgb": rgb_filepath, "wav": wav_filepath},
+                  params={"width": width, "height": height, "fps": 30, "codec": "libx264", "preset": preset,
+                          "mp4": mp4_filepath, "encode_dir": encode_dir})
+    if version == "final":
+        graph.add("scene", scene, inputs={"rgb": rgb_filepath}, params=scene_params)
+        graph.add("shot", shot, inputs={"rgb": rgb_filepath}, deps=("scene",), params=shot_params)
+        graph.add("audio", audio, inputs={"wav": wav_filepath}, deps=("scene", "shot"), params=audio_params)
+        scene_deps = ("audio",)
+    else:
+        graph.add("shot", shot_v2_1, inputs={"rgb": rgb_filepath}, deps=("encode",), params=shot_params)
+        graph.add("scene", scene_v2_1, inputs={"rgb": rgb_filepath}, deps=("shot",), params=scene_params)
+        scene_deps = ("scene",)
+    graph.add("subshot", subshot, inputs={"rgb": rgb_filepath}, deps=("shot",), params=subshot_params)
+    timestamps_params = {"fps": 30, "export_txt": export_txt}
+    if not encode:
+        timestamps_params["mp4"] = mp4_filepath
+    graph.add("timestamps", timestamps, deps=(("encode",) if encode else ()) + scene_deps + ("shot", "subshot"),
+              params=timestamps_params)
+    return graph
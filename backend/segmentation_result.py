@@ -0,0 +1,110 @@
+import os
+import json
+import struct
+import numpy as np
+
+try:
+    from .segment_index import SegmentIndex, LEVELS, load_segments
+except ImportError:
+    from segment_index import SegmentIndex, LEVELS, load_segments
+
+# one file per video holding the [start_frame, end_frame] arrays of every level and metadata
+# (fps, frame count, detector parameters, timings):
+#   8 byte magic, uint32 format version, uint32 header length, JSON header,
+#   then the raw arrays, each starting on an ALIGN byte boundary.
+# the header gives dtype, shape and offset of every array, so loading maps them without copying.
+MAGIC = b"SEGRES\0\0"
+FORMAT_VERSION = 1
+ALIGN = 64
+RESULT_NAME = "segments.seg"
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+class SegmentationResult:
+    def __init__(self, levels, metadata=None):
+        # views of mapped arrays stay mapped
+        self.levels = {name: np.asarray(segments, dtype=np.int64).reshape(-1, 2) for name, segments in levels.items()}
+        self.metadata = dict(metadata or {})
+
+    def __getitem__(self, level):
+        return self.levels[level]
+
+    def save(self, path):
+        # written next to the target and renamed, readers never see a half written file
+        names = list(self.levels)
+        arrays = [np.ascontiguousarray(self.levels[name]) for name in names]
+        header = {"metadata": self.metadata, "arrays": {}}
+        # offsets depend on the header length, which depends on the offsets, so size the header first
+        for name, array in zip(names, arrays):
+            header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": 0}
+        header_len = len(json.dumps(header).encode("utf-8")) + 32 * len(names) + 16
+        offset = _aligned(16 + header_len)
+        for name, array in zip(names, arrays):
+            header["arrays"][name]["offset"] = offset
+            offset = _aligned(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode("utf-8")
+        assert len(header_bytes) <= header_len
+        header_bytes = header_bytes.ljust(header_len)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = os.path.join(directory, ".{}.{}.tmp".format(os.path.basename(path), os.getpid()))
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<II", FORMAT_VERSION, header_len))
+            f.write(header_bytes)
+            for name, array in zip(names, arrays):
+                f.seek(header["arrays"][name]["offset"])
+                f.write(array.tobytes())
+            f.truncate(offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a segmentation result".format(path))
+            version, header_len = struct.unpack("<II", f.read(8))
+            if version > FORMAT_VERSION:
+                raise ValueError("{} has format version {}, newest supported is {}".format(path, version, FORMAT_VERSION))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+            levels = {}
+            for name, info in header["arrays"].items():
+                shape = tuple(info["shape"])
+                if mmap and np.prod(shape) > 0:
+                    levels[name] = np.memmap(path, dtype=np.dtype(info["dtype"]), mode="r",
+                                             offset=info["offset"], shape=shape)
+                else:
+                    f.seek(info["offset"])
+                    count = int(np.prod(shape))
+                    levels[name] = np.fromfile(f, dtype=np.dtype(info["dtype"]), count=count).reshape(shape)
+        return cls(levels, header["metadata"])
+
+    @classmethod
+    def from_txts(cls, directory=".", metadata=None):
+        return cls({level: load_segments(os.path.join(directory, level + ".txt")) for level in LEVELS}, metadata)
+
+    def export_txt(self, directory="."):
+        # scene.txt, shot.txt and subshot.txt like the backends used to write
+        os.makedirs(directory, exist_ok=True)
+        for level, segments in self.levels.items():
+            with open(os.path.join(directory, level + ".txt"), "w") as f:
+                for start, end in segments:
+                    f.write(str(start) + " " + str(end) + "\n")
+
+    def index(self):
+        return SegmentIndex(self.levels.get("scene", ()), self.levels.get("shot", ()),
+                            self.levels.get("subshot", ()), self.metadata.get("fps", 30))
+
+
+def job_dir(video_path, root="results"):
+    # every video gets its own output directory instead of sharing the working directory
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    parent = os.path.basename(os.path.dirname(os.path.abspath(video_path)))
+    return os.path.join(root, "{}_{}".format(parent, name) if parent else name)
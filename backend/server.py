@@ -0,0 +1,301 @@
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from . import feature_cache, transnetv2
+    from .segmentation import segmentation_stages
+    from .segmentation_result import SegmentationResult, RESULT_NAME
+except ImportError:
+    import feature_cache
+    import transnetv2
+    from segmentation import segmentation_stages
+    from segmentation_result import SegmentationResult, RESULT_NAME
+
+# segmentation as a local service. the process loads TransNetV2 once and keeps a fixed
+# number of worker threads running the stages of the final player (detectScene,
+# detect_shot.main, the audio refinement and TransNetV2 sub-shots) for submitted jobs:
+#   POST /jobs               {"rgb": path, "wav": path, "mp4": path?, "shot_size": "120x68"?,
+#                             "encode": bool?, "force": bool?}
+#                            202 with the job, 200 when the result is already cached,
+#                            503 with Retry-After when the queue is full
+#   GET  /jobs/<id>          status (queued, running, done, failed) and progress
+#   GET  /jobs/<id>/result   the scene/shot/subshot hierarchy in frames and the ToC timestamps
+#   GET  /health             queue length and workers
+# results are cached by content: a job runs in <RESULT_CACHE_DIR>/<hash of the .rgb and .wav
+# contents and parameters>, a finished segments.seg there answers the same content straight away
+# whatever its path, and an unfinished one continues from the stages already done.
+# the contents are hashed by the worker, submitting only looks at the paths, sizes and modification
+# times: files seen before are answered from the cache at once, others are queued and a worker
+# that finds their result cached finishes the job without running the stages.
+# with "encode" the .mp4 is written into the job directory, never next to the submitted files.
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR",
+                                  os.path.join(os.path.expanduser("~"), ".cache", "csci576_results"))
+RESULT_VERSION = 1
+MAX_JOBS_KEPT = 1000
+STAGE_NAMES = ("encode", "scene", "shot", "audio", "subshot", "timestamps")
+
+
+def file_key(rgb, wav, params):
+    # cheap stand-in for result_key as long as the files are not modified
+    files = [(os.path.realpath(path), os.stat(path)) for path in (rgb, wav)]
+    key = {"files": [[path, stat.st_size, stat.st_mtime_ns] for path, stat in files],
+           "params": params, "version": RESULT_VERSION}
+    return hashlib.blake2b(json.dumps(key, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def result_key(rgb, wav, params):
+    key = {"rgb": feature_cache.content_hash(rgb), "wav": feature_cache.content_hash(wav),
+           "params": params, "version": RESULT_VERSION}
+    return hashlib.blake2b(json.dumps(key, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def hierarchy(result):
+    # nested {"start", "end", "shots": [{..., "subshots": [...]}]} of a SegmentationResult, in frames
+    index = result.index()
+
+    def segment(level, i):
+        return {"start": int(index.starts[level][i]), "end": int(index.ends[level][i])}
+
+    scenes = []
+    for scene in range(index.count("scene")):
+        entry = segment("scene", scene)
+        entry["shots"] = []
+        for shot in index.children("scene", scene):
+            shot_entry = segment("shot", shot)
+            shot_entry["subshots"] = [segment("subshot", subshot) for subshot in index.children("shot", shot)]
+            entry["shots"].append(shot_entry)
+        scenes.append(entry)
+    return {"fps": result.metadata.get("fps", 30), "frame_count": result.metadata.get("frame_count"),
+            "scenes": scenes, "toc": index.toc()}
+
+
+class Job:
+    def __init__(self, job_id, request, params, file_key, key=None):
+        self.id = job_id
+        self.request = request
+        self.params = params
+        self.file_key = file_key
+        # the result key, known once a worker hashed the contents
+        self.key = key
+        self.status = "queued"
+        self.stages_done = []
+        self.stage = None
+        self.subshot_groups = 0
+        self.error = None
+        self.cached = False
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def output_dir(self):
+        return os.path.join(RESULT_CACHE_DIR, self.key)
+
+    def progress(self):
+        stages = [name for name in STAGE_NAMES if name != "encode" or self.request.get("encode")]
+        return len([name for name in self.stages_done if name in stages]) / len(stages)
+
+    def to_json(self):
+        return {"id": self.id, "status": self.status, "progress": 1. if self.status == "done" else self.progress(),
+                "stage": self.stage, "stages_done": list(self.stages_done), "subshot_groups": self.subshot_groups,
+                "cached": self.cached, "error": self.error, "rgb": self.request["rgb"],
+                "submitted": self.submitted, "started": self.started, "finished": self.finished}
+
+
+class SegmentationService:
+    def __init__(self, workers=1, queue_size=8, load_model=True):
+        self.jobs = {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.next_id = 0
+        # file_key -> result_key of the files hashed so far, and a lock per result_key
+        # so that jobs for the same content run one after the other
+        self.result_keys = {}
+        self.key_locks = {}
+        if load_model:
+            # warm before the first job, the workers share it
+            transnetv2.get_model()
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, request):
+        # the job, served from the result cache when possible; raises queue.Full when there is no room
+        for key in ("rgb", "wav"):
+            if not request.get(key) or not os.path.isfile(request[key]):
+                raise ValueError("{} is not a file".format(request.get(key)))
+        if request.get("mp4") and not os.path.isfile(request["mp4"]):
+            raise ValueError("{} is not a file".format(request["mp4"]))
+        if request.get("shot_size") and request["shot_size"] not in ("240x135", "120x68", "48x27"):
+            raise ValueError("shot_size has to be 240x135, 120x68 or 48x27")
+        # the result refers to the given .mp4, so its path is part of the key
+        params = {"shot_size": request.get("shot_size"), "encode": bool(request.get("encode")),
+                  "mp4": os.path.realpath(request["mp4"]) if request.get("mp4") else None}
+        if transnetv2.backend_name() != "tf":
+            params["backend"] = transnetv2.backend_name()
+        fkey = file_key(request["rgb"], request["wav"], params)
+        with self.lock:
+            job = Job(str(self.next_id), dict(request), params, fkey, self.result_keys.get(fkey))
+            if job.key and os.path.exists(os.path.join(job.output_dir, RESULT_NAME)) and not request.get("force"):
+                job.status = "done"
+                job.cached = True
+                job.finished = time.time()
+            else:
+                # same files already queued or running, follow that job instead of repeating it
+                for other in self.jobs.values():
+                    if other.file_key == fkey and other.status in ("queued", "running"):
+                        return other
+                self.queue.put_nowait(job)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            self._forget_old()
+        return job
+
+    def _forget_old(self):
+        finished = [job for job in self.jobs.values() if job.status in ("done", "failed")]
+        for job in sorted(finished, key=lambda job: job.submitted)[:max(0, len(self.jobs) - MAX_JOBS_KEPT)]:
+            del self.jobs[job.id]
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            job.status = "running"
+            job.started = time.time()
+            try:
+                self._run(job)
+                job.status = "done"
+            except Exception as exc:
+                traceback.print_exc()
+                job.error = "{}: {}".format(type(exc).__name__, exc)
+                job.status = "failed"
+            job.finished = time.time()
+            job.stage = None
+            self.queue.task_done()
+
+    def _run(self, job):
+        request = job.request
+        if job.key is None:
+            job.key = result_key(request["rgb"], request["wav"], job.params)
+            with self.lock:
+                self.result_keys[job.file_key] = job.key
+        with self.lock:
+            key_lock = self.key_locks.setdefault(job.key, threading.Lock())
+        with key_lock:
+            # the same content under another path may have been segmented meanwhile
+            if os.path.exists(os.path.join(job.output_dir, RESULT_NAME)) and not request.get("force"):
+                job.cached = True
+                return
+            self._run_stages(job)
+
+    def _run_stages(self, job):
+        request = job.request
+        shot_size = tuple(int(n) for n in request["shot_size"].split("x")) if request.get("shot_size") else None
+
+        def on_subshots(segments):
+            job.subshot_groups += 1
+
+        graph = segmentation_stages(request["rgb"], request["wav"], job.output_dir, request.get("mp4"),
+                                    shot_size=shot_size, on_subshots=on_subshots, encode=bool(request.get("encode")),
+                                    encode_dir=job.output_dir)
+        names = [stage.name for stage in graph.stages]
+
+        def on_output(name, value):
+            # the stage running is the one after the last finished
+            job.stages_done.append(name)
+            following = names.index(name) + 1
+            job.stage = names[following] if following < len(names) else None
+
+        job.stage = names[0]
+        graph.run(tuple(names) if request.get("force") else (), on_output=on_output)
+
+    def result(self, job):
+        return hierarchy(SegmentationResult.load(os.path.join(job.output_dir, RESULT_NAME), mmap=False))
+
+    def health(self):
+        return {"queued": self.queue.qsize(), "queue_size": self.queue.maxsize, "workers": len(self.workers),
+                "running": len([job for job in self.jobs.values() if job.status == "running"]),
+                "jobs": len(self.jobs), "model_loads": transnetv2.model_stats["loads"],
+                "backend": transnetv2.backend_name()}
+
+
+class Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send(self, code, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self._send(404, {"error": "not found"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            job = self.service.submit(request)
+        except queue.Full:
+            # backpressure, the client retries later
+            return self._send(503, {"error": "job queue is full"}, {"Retry-After": "5"})
+        except (ValueError, KeyError, AttributeError) as exc:
+            return self._send(400, {"error": str(exc)})
+        self._send(200 if job.status == "done" else 202, job.to_json(), {"Location": "/jobs/" + job.id})
+
+    def do_GET(self):
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if parts == ["health"]:
+            return self._send(200, self.service.health())
+        if len(parts) < 2 or parts[0] != "jobs" or len(parts) > 3 or (len(parts) == 3 and parts[2] != "result"):
+            return self._send(404, {"error": "not found"})
+        job = self.service.jobs.get(parts[1])
+        if job is None:
+            return self._send(404, {"error": "no job {}".format(parts[1])})
+        if len(parts) == 2:
+            return self._send(200, job.to_json())
+        if job.status != "done":
+            return self._send(409, {"error": "job is {}".format(job.status), "job": job.to_json()})
+        self._send(200, self.service.result(job))
+
+    def log_message(self, format, *args):
+        print("[Server] " + format % args)
+
+
+def serve(host="127.0.0.1", port=8576, workers=1, queue_size=8, load_model=True, backend=None):
+    if backend:
+        transnetv2.set_backend(backend)
+    Handler.service = SegmentationService(workers, queue_size, load_model)
+    server = ThreadingHTTPServer((host, port), Handler)
+    print("[Server] Listening on http://{}:{} with {} workers, results in {}".format(host, port, workers, RESULT_CACHE_DIR))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local segmentation service with an HTTP job API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8576)
+    parser.add_argument('--workers', type=int, default=1, help='Jobs segmented at the same time')
+    parser.add_argument('--queue-size', type=int, default=8, help='Jobs waiting before new ones are refused with 503')
+    parser.add_argument('--backend', choices=transnetv2.inference.BACKENDS,
+                        help='TransNetV2 backend, TRANSNET_BACKEND or tf by default')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.queue_size, backend=args.backend)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+import os
+import cv2
+import numpy
+import math
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from . import feature_cache, profiling
+except ImportError:
+    import feature_cache
+    import profiling
+
+# a frame starts a cut when its score is above sd + CUT_OFFSET,
+# the cut is placed after WINDOW frames were compared with the frame before it
+CUT_OFFSET = 2.5
+WINDOW = 15
+
+
+def MSE(mat1, mat2):
+    dim = mat1.shape
+    pixels = dim[0] * dim[1]
+    diff = mat1.astype(numpy.int64) - mat2.astype(numpy.int64)
+    abs = numpy.abs(diff)
+    return (numpy.sum(abs) / float(pixels))
+
+
+@profiling.hot("MSE")
+def plane_score(hsv1, hsv2):
+    # MSE of the hue, saturation and value planes of two HSV frames averaged,
+    # the sums are exact so this is the same number without splitting the planes or int64 copies
+    pixels = float(hsv1.shape[0] * hsv1.shape[1])
+    sums = cv2.sumElems(cv2.absdiff(hsv1, hsv2))
+    return (sums[0] / pixels + sums[1] / pixels + sums[2] / pixels) / 3
+
+
+@profiling.hot("decode")
+def read_frame(cap):
+    return cap.read()
+
+
+@profiling.hot("cvtColor")
+def cvt_color(frame, code):
+    return cv2.cvtColor(frame, code)
+
+
+def score_sd(scoreList):
+    # same arithmetic as prepare_scores always did
+    if len(scoreList) == 0:
+        return 0
+    scoreTotal = 0
+    for score in scoreList:
+        scoreTotal += score
+    avg = scoreTotal / len(scoreList)
+    var = 0
+    for score in scoreList:
+        var += (avg - score) * (avg - score)
+    return math.sqrt(var / len(scoreList))
+
+
+# streaming shot scores, every frame is converted to HSV once and only the previous
+# frame is kept. a frame is scored against the previous one and against the first frame,
+# sd comes from the latter: prepare_scores never moved its previous frame forward and
+# the thresholds were tuned on that.
+# split_scores also compares the WINDOW frames after a cut start with the frame before it.
+# the cut starts are only known with sd, so revisit(read) reads those few frames again
+# once all were scored. can be used as a frame pipeline detector, which calls revisit.
+# with a size the frames are scored at that analysis resolution,
+# the scores are per pixel so the thresholds stay the same.
+class ShotScorer:
+    size = None
+    color = 'hsv'
+    feature = "shot_scores_v2"
+
+    def __init__(self, first=None, size=None):
+        # first: HSV frame 0 when scoring a chunk that starts later in the video
+        if size is not None:
+            self.size = tuple(size)
+            # subclasses caching other arrays keep their own feature name
+            self.feature = "{}_{}x{}".format(type(self).feature, size[0], size[1])
+        self.prev = None
+        self.first = first
+        self.firstScores = []
+        self.scoreList = []
+        self.lags = {}
+        self.frame_count = 0
+        self.sd = 0
+
+    def process(self, frame_num, hsv):
+        if frame_num == 0:
+            if self.first is None:
+                self.first = hsv
+        else:
+            self.firstScores.append(plane_score(hsv, self.first))
+            self.scoreList.append(plane_score(hsv, self.prev))
+        self.prev = hsv
+        self.frame_count = frame_num + 1
+
+    def finish(self, frame_count):
+        self.prev = None
+        self.first = None
+        self.sd = score_sd(self.firstScores)
+
+    def cut_starts(self):
+        # frames split_scores starts a cut at, whatever range it searches
+        threshold = self.sd + CUT_OFFSET
+        return [frame_num for frame_num in range(1, self.frame_count) if self.scoreList[frame_num - 1] > threshold]
+
+    def revisit(self, read):
+        # compares the frames after every cut start with the frame before it, read ((start, end) ->
+        # (frame_num, hsv, timestamp), see rgb_reader) gives the frames again. only ranges of WINDOW frames
+        # around the cut starts are read
+        starts = self.cut_starts()
+        ranges = []
+        for cut_frame in starts:
+            lo, hi = cut_frame - 1, min(cut_frame + WINDOW, self.frame_count)
+            if ranges and lo <= ranges[-1][1]:
+                ranges[-1][1] = hi
+            else:
+                ranges.append([lo, hi])
+        starts = set(starts)
+        self.lags = {}
+        for lo, hi in ranges:
+            frames = deque(maxlen=WINDOW)
+            for frame_num, hsv, timestamp in read(lo, hi):
+                for cut_frame in range(max(lo + 1, frame_num - WINDOW + 1), frame_num):
+                    if cut_frame in starts:
+                        # frame before the cut, cut_frame - 1, is frame_num - cut_frame + 1 frames back
+                        self.lags[(frame_num, cut_frame - 1)] = plane_score(hsv, frames[cut_frame - frame_num - 1])
+                frames.append(hsv)
+
+    def to_arrays(self):
+        # for the feature cache
+        return {
+            "scores": numpy.array(self.scoreList, dtype=numpy.float64),
+            "first_scores": numpy.array(self.firstScores, dtype=numpy.float64),
+            "lag_keys": numpy.array(list(self.lags.keys()), dtype=numpy.int64).reshape(-1, 2),
+            "lag_scores": numpy.array(list(self.lags.values()), dtype=numpy.float64),
+            "frame_count": numpy.array(self.frame_count),
+        }
+
+    def from_arrays(self, arrays):
+        self.scoreList = arrays["scores"].tolist()
+        self.firstScores = arrays["first_scores"].tolist()
+        self.lags = dict(zip(map(tuple, arrays["lag_keys"].tolist()), arrays["lag_scores"].tolist()))
+        self.frame_count = int(arrays["frame_count"])
+        self.sd = score_sd(self.firstScores)
+
+    def score(self, frame_num):
+        # score between frame_num and the frame before it
+        return self.scoreList[frame_num - 1]
+
+    def lag_score(self, frame_num, ref_frame):
+        return self.lags[(frame_num, ref_frame)]
+
+    def add_capture(self, cap):
+        # feed every frame of a cv2.VideoCapture, the frames after cuts are read again by seeking
+        frameNum = 0
+        while (True):
+            ret, frame = read_frame(cap)
+            if frame is None:
+                break
+            self.process(frameNum, cvt_color(frame, cv2.COLOR_BGR2HSV))
+            frameNum += 1
+        self.finish(frameNum)
+        self.revisit(cap_reader(cap))
+
+
+def split_scores(sd, scores, start, end):
+    # cut search of split_frames on the stored scores, no frames needed
+    cutList = []
+    frameList = []
+    cut = False
+    for frameNum in range(start, end):
+        if frameNum == start:
+            continue
+        score = scores.score(frameNum)
+        if (score > sd + CUT_OFFSET and cut == False):
+            cut = True
+            changeFrame = frameNum - 1
+            frameList.append([score, frameNum])
+        elif cut == True and len(frameList) < WINDOW:
+            score1 = scores.lag_score(frameNum, changeFrame)
+            frameList.append([score1, frameNum])
+        elif cut == True and len(frameList) == WINDOW:
+            maxScore = -1
+            maxFrameNum = -1
+            countFive = 0
+            for arr in frameList:
+                if arr[0] > maxScore:
+                    maxScore = arr[0]
+                    if (countFive < 5):
+                        maxFrameNum = arr[1]
+                        countFive += 1
+            cutList.append(maxFrameNum)
+            cut = False
+            frameList = []
+    return cutList
+
+
+# parallel score extraction: the video is cut into frame ranges scored on worker threads
+# (cv2 and numpy release the GIL). a chunk also decodes the frame before it for the score
+# against the previous frame. the stitched lists are the same as scoring the video in one go,
+# the frames after cuts are revisited once sd is known.
+PARALLEL_MIN_FRAMES = 3 * 60 * 30
+
+
+def rgb_reader(path, width=480, height=270):
+    imgs = numpy.memmap(path, dtype=numpy.uint8, mode='r').reshape(-1, height, width, 3)
+
+    def read(start, end, fps=30):
+        end = imgs.shape[0] if end is None else min(end, imgs.shape[0])
+        for frame_num in range(start, end):
+            yield frame_num, cvt_color(imgs[frame_num], cv2.COLOR_RGB2HSV), (frame_num + 1) / fps
+    return read, imgs.shape[0]
+
+
+def cap_reader(cap):
+    # frames of an open cv2.VideoCapture (or anything with read/get/set like it) by seeking
+    def read(start, end):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        frame_num = start
+        # the last chunk reads to the end, the frame count of a container is not always exact
+        while end is None or frame_num < end:
+            ret, frame = read_frame(cap)
+            if frame is None:
+                break
+            yield frame_num, cvt_color(frame, cv2.COLOR_BGR2HSV), cap.get(cv2.CAP_PROP_POS_MSEC)/1000
+            frame_num += 1
+    return read
+
+
+def capture_reader(path):
+    cap = cv2.VideoCapture(path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    def read(start, end):
+        # a capture per call, chunks are read on several threads
+        cap = cv2.VideoCapture(path)
+        try:
+            yield from cap_reader(cap)(start, end)
+        finally:
+            cap.release()
+    return read, frame_count
+
+
+def proxy_reader(frames, fps=30):
+    # HSV frames of an analysis proxy level
+    def read(start, end):
+        end = frames.shape[0] if end is None else min(end, frames.shape[0])
+        for frame_num in range(start, end):
+            yield frame_num, numpy.asarray(frames[frame_num]), (frame_num + 1) / fps
+    return read, frames.shape[0]
+
+
+def video_reader(path):
+    if path.endswith(".rgb"):
+        return rgb_reader(path)
+    return capture_reader(path)
+
+
+def _score_chunk(read, first, start, end):
+    warm = max(0, start - 1)
+    chunk = ShotScorer(first)
+    times = []
+    for frame_num, hsv, timestamp in read(warm, end):
+        chunk.process(frame_num - warm, hsv)
+        if frame_num >= max(start, 1):
+            times.append(timestamp)
+    return chunk.scoreList, chunk.firstScores, times, warm + chunk.frame_count
+
+
+@profiling.traced("shot_scores.parallel_scores")
+def parallel_scores(path, scores=None, workers=None, chunk_frames=None, reader=None):
+    # fills scores (a new ShotScorer by default) like feeding it every frame of the .rgb or video file,
+    # or of reader ((read, frame_count), see proxy_reader) when given. a timeList on scores is filled too
+    if scores is None:
+        scores = ShotScorer()
+    read, frame_count = reader or video_reader(path)
+    first = None
+    for frame_num, hsv, timestamp in read(0, 1):
+        first = hsv
+    if first is None:
+        return scores
+    workers = workers or os.cpu_count()
+    if chunk_frames is None:
+        chunk_frames = max(300, frame_count // (workers * 4) + 1)
+    starts = list(range(0, max(frame_count, 1), chunk_frames))
+    ends = starts[1:] + [None]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunks = list(executor.map(lambda r: _score_chunk(read, first, r[0], r[1]), zip(starts, ends)))
+    for scoreList, firstScores, times, chunk_end in chunks:
+        scores.scoreList.extend(scoreList)
+        scores.firstScores.extend(firstScores)
+        if hasattr(scores, "timeList"):
+            scores.timeList.extend(times)
+        scores.frame_count = max(scores.frame_count, chunk_end)
+    scores.finish(scores.frame_count)
+    scores.revisit(read)
+    profiling.current().add_frames(scores.frame_count)
+    return scores
+
+
+def proxy_scores(path, frames, scores, workers=None):
+    # fills scores from the HSV frames of an analysis proxy level of the video at path,
+    # they are cached under the feature name of scores, which includes its class
+    # (ShotDetector keeps frame times, ShotScorer does not) and the resolution
+    arrays = feature_cache.load(path, scores.feature)
+    if arrays is not None:
+        scores.from_arrays(arrays)
+        return scores
+    parallel_scores(path, scores, workers, reader=proxy_reader(frames))
+    feature_cache.save(path, scores.feature, scores.to_arrays())
+    return scores
+
+
+# scores saved as .npy files, so worker processes map them instead of getting them pickled
+def save_mapped(scores, directory):
+    arrays = scores.to_arrays()
+    for name in ("scores", "lag_keys", "lag_scores"):
+        numpy.save(os.path.join(directory, name + ".npy"), arrays[name])
+
+
+class MappedScores:
+    def __init__(self, directory):
+        self.scoreList = numpy.load(os.path.join(directory, "scores.npy"), mmap_mode='r')
+        self.lag_keys = numpy.load(os.path.join(directory, "lag_keys.npy"), mmap_mode='r')
+        self.lag_values = numpy.load(os.path.join(directory, "lag_scores.npy"), mmap_mode='r')
+        self.lags = {}
+
+    def load_range(self, start, end):
+        # lags are stored in frame order, only the ones of this range are looked up
+        lo, hi = numpy.searchsorted(self.lag_keys[:, 0], [start, end])
+        self.lags = dict(zip(map(tuple, self.lag_keys[lo:hi].tolist()), self.lag_values[lo:hi].tolist()))
+
+    def score(self, frame_num):
+        return float(self.scoreList[frame_num - 1])
+
+    def lag_score(self, frame_num, ref_frame):
+        return self.lags[(frame_num, ref_frame)]
+
+
+_mapped = None
+
+
+def _init_worker(directory):
+    global _mapped
+    _mapped = MappedScores(directory)
+
+
+def _split_scene(args):
+    sd, start, end = args
+    _mapped.load_range(start, end)
+    return split_scores(sd, _mapped, start, end)
+
+
+def split_scenes_parallel(sd, scores, scenes, workers=None):
+    # split_scores for every (start, end) scene on a process pool, cut lists come back in scene order
+    with tempfile.TemporaryDirectory() as directory:
+        save_mapped(scores, directory)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(directory,)) as executor:
+            chunksize = max(1, len(scenes) // (4 * (workers or os.cpu_count())))
+            return list(executor.map(_split_scene, [(sd, start, end) for start, end in scenes], chunksize=chunksize))
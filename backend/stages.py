@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+
+try:
+    from . import feature_cache, profiling
+except ImportError:
+    import feature_cache
+    import profiling
+
+# the player runs encode -> scene -> shot -> subshot -> timestamps as a graph of stages.
+# every stage records in <output_dir>/stages/manifest.json a key made of the content hashes
+# of its input files, the output hashes of the stages it depends on and its parameters.
+# a re-run only executes the stages whose key changed or whose output is missing or modified,
+# a stage whose output comes out the same does not make the stages after it run again.
+# outputs are saved next to the manifest: arrays as .npy, file paths (the encoded mp4) as is,
+# anything else as json.
+# a stage can keep partial progress in a journal, which survives a crash and is only
+# reused when the stage runs again with the same key.
+STAGE_DIR = "stages"
+MANIFEST_NAME = "manifest.json"
+
+
+def _hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _hash_value(value):
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        return _hash_bytes(value.dtype.str.encode("utf-8") + str(value.shape).encode("utf-8") + value.tobytes())
+    return _hash_bytes(json.dumps(value, sort_keys=True).encode("utf-8"))
+
+
+def _write_json(path, data):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+class Journal:
+    # one json line per finished item, flushed as it is written
+    def __init__(self, path, key):
+        self.path = path
+        self.items = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                lines = f.read().splitlines()
+            # the last line can be cut short by a crash
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+            if records and records[0].get("key") == key:
+                for record in records[1:]:
+                    self.items[tuple(record["item"])] = record["value"]
+            else:
+                os.remove(path)
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                f.write(json.dumps({"key": key}) + "\n")
+        self._file = open(path, "a")
+
+    def __contains__(self, item):
+        return tuple(item) in self.items
+
+    def __getitem__(self, item):
+        return self.items[tuple(item)]
+
+    def __len__(self):
+        return len(self.items)
+
+    def record(self, item, value):
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        self.items[tuple(item)] = value
+        self._file.write(json.dumps({"item": list(item), "value": value}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self.close()
+        os.remove(self.path)
+
+
+class Stage:
+    def __init__(self, name, run, inputs=None, deps=(), params=None):
+        # run(outputs, journal) gets the outputs of deps by stage name
+        self.name = name
+        self.run = run
+        self.inputs = dict(inputs or {})
+        self.deps = tuple(deps)
+        self.params = dict(params or {})
+
+
+class StageGraph:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.stage_dir = os.path.join(output_dir, STAGE_DIR)
+        self.manifest_path = os.path.join(self.stage_dir, MANIFEST_NAME)
+        self.stages = []
+        self.outputs = {}
+        self.timings = {}
+        self.executed = []
+        try:
+            with open(self.manifest_path, "r") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def add(self, name, run, inputs=None, deps=(), params=None):
+        # stages run in the order they are added, dependencies have to be added first
+        for dep in deps:
+            if dep not in [stage.name for stage in self.stages]:
+                raise ValueError("stage {} depends on {}, which was not added before it".format(name, dep))
+        self.stages.append(Stage(name, run, inputs, deps, params))
+        return self
+
+    def key(self, stage):
+        return _hash_value({
+            "inputs": {name: feature_cache.content_hash(path) for name, path in stage.inputs.items()},
+            "deps": {dep: self.manifest[dep]["output_hash"] for dep in stage.deps},
+            "params": stage.params,
+        })
+
+    def _load_output(self, record):
+        kind, artifact = record["kind"], record["artifact"]
+        if not os.path.exists(artifact):
+            return None
+        if kind == "npy":
+            value = np.load(artifact)
+            hash = _hash_value(value)
+        elif kind == "path":
+            value = artifact
+            hash = feature_cache.content_hash(artifact)
+        else:
+            with open(artifact, "r") as f:
+                value = json.load(f)
+            hash = _hash_value(value)
+        if hash != record["output_hash"]:
+            # modified since the stage wrote it
+            return None
+        return value
+
+    def _save_output(self, stage, value):
+        if isinstance(value, np.ndarray):
+            artifact = os.path.join(self.stage_dir, stage.name + ".npy")
+            tmp = "{}.{}.tmp.npy".format(artifact[:-len(".npy")], os.getpid())
+            np.save(tmp, value)
+            os.replace(tmp, artifact)
+            return "npy", artifact, _hash_value(value)
+        if isinstance(value, str) and os.path.isfile(value):
+            return "path", os.path.abspath(value), feature_cache.content_hash(value)
+        artifact = os.path.join(self.stage_dir, stage.name + ".json")
+        _write_json(artifact, value)
+        return "json", artifact, _hash_value(value)
+
+    def run(self, force=(), on_output=None):
+        # executes what is out of date, returns {stage name: output}.
+        # on_output(stage name, output) is called as soon as each stage's output is known
+        os.makedirs(self.stage_dir, exist_ok=True)
+        for stage in self.stages:
+            key = self.key(stage)
+            record = self.manifest.get(stage.name)
+            if stage.name not in force and record is not None and record["key"] == key:
+                value = self._load_output(record)
+                if value is not None:
+                    print("[Stages] {} is up to date".format(stage.name))
+                    self.outputs[stage.name] = value
+                    self.timings[stage.name] = record["seconds"]
+                    if on_output is not None:
+                        on_output(stage.name, value)
+                    continue
+            print("[Stages] Running {}".format(stage.name))
+            journal = Journal(os.path.join(self.stage_dir, stage.name + ".journal"), key)
+            t1 = time.time()
+            with profiling.span("stage " + stage.name, category="stages"):
+                value = stage.run({dep: self.outputs[dep] for dep in stage.deps}, journal)
+            seconds = time.time() - t1
+            kind, artifact, output_hash = self._save_output(stage, value)
+            self.manifest[stage.name] = {
+                "key": key,
+                "inputs": {name: os.path.abspath(path) for name, path in stage.inputs.items()},
+                "deps": list(stage.deps),
+                "params": stage.params,
+                "kind": kind,
+                "artifact": artifact,
+                "output_hash": output_hash,
+                "seconds": seconds,
+                "finished": time.time(),
+            }
+            # the journal is only needed until the output is recorded
+            _write_json(self.manifest_path, self.manifest)
+            journal.discard()
+            self.outputs[stage.name] = self._load_output(self.manifest[stage.name]) if kind != "path" else artifact
+            self.timings[stage.name] = seconds
+            self.executed.append(stage.name)
+            if on_output is not None:
+                on_output(stage.name, self.outputs[stage.name])
+        return self.outputs
@@ -1,12 +1,45 @@
 import os
+import time
+import itertools
 import numpy as np
-import tensorflow as tf
 from PIL import Image
 import cv2
+
+try:
+    from . import feature_cache, profiling, inference
+except ImportError:
+    import feature_cache
+    import profiling
+    import inference
+
+# name of the predictions in the feature cache
+SHOTS_FEATURE = "transnet_shots_v1"
+
+
+def input_windows(frames: np.ndarray):
+    # return windows of size 100 where the first/last 25 frames are from the previous/next batch
+    # the first and last window must be padded by copies of the first and last frame of the video
+    no_padded_frames_start = 25
+    no_padded_frames_end = 25 + 50 - (len(frames) % 50 if len(frames) % 50 != 0 else 50)  # 25 - 74
+
+    start_frame = np.expand_dims(frames[0], 0)
+    end_frame = np.expand_dims(frames[-1], 0)
+    padded_inputs = np.concatenate(
+        [start_frame] * no_padded_frames_start + [frames] + [end_frame] * no_padded_frames_end, 0
+    )
+
+    ptr = 0
+    while ptr + 100 <= len(padded_inputs):
+        out = padded_inputs[ptr:ptr + 100]
+        ptr += 50
+        yield out[np.newaxis]
+
+
 class TransNetV2:
 
-    def __init__(self, model_dir=None):
-        if model_dir is None:
+    def __init__(self, model_dir=None, backend="tf", threads=(None, None)):
+        # backend: one of inference.BACKENDS, model_dir is the exported file for the ones other than tf
+        if model_dir is None and backend == "tf":
             model_dir = os.path.join(os.path.dirname(__file__), "transnetv2-weights/")
             if not os.path.isdir(model_dir):
                 raise FileNotFoundError(f"[TransNetV2] ERROR: {model_dir} is not a directory.")
@@ -14,52 +47,31 @@ class TransNetV2:
                 print(f"[TransNetV2] Using weights from {model_dir}.")
 
         self._input_size = (27, 48, 3)
-        try:
-            self._model = tf.saved_model.load(model_dir)
-        except OSError as exc:
-            raise IOError(f"[TransNetV2] It seems that files in {model_dir} are corrupted or missing. "
-                          f"Re-download them manually and retry. For more info, see: "
-                          f"https://github.com/soCzech/TransNetV2/issues/1#issuecomment-647357796") from exc
+        self.backend = backend
+        self._backend = inference.load_backend(backend, model_dir, threads)
 
+    def warmup(self):
+        # the first call traces the graph (or allocates the buffers of an export),
+        # do it on a dummy window so it is not paid by a real shot
+        self.predict_raw(np.zeros((1, 100, *self._input_size), dtype=np.uint8))
+
+    @profiling.hot("TransNetV2.predict_raw")
     def predict_raw(self, frames: np.ndarray):
         assert len(frames.shape) == 5 and frames.shape[2:] == self._input_size, \
             "[TransNetV2] Input shape must be [batch, frames, height, width, 3]."
-        frames = tf.cast(frames, tf.float32)
-
-        logits, dict_ = self._model(frames)
-        single_frame_pred = tf.sigmoid(logits)
-        all_frames_pred = tf.sigmoid(dict_["many_hot"])
-
-        return single_frame_pred, all_frames_pred
+        # numpy arrays [batch, frames, 1] of every backend
+        return self._backend.predict(frames)
 
     def predict_frames(self, frames: np.ndarray):
         assert len(frames.shape) == 4 and frames.shape[1:] == self._input_size, \
             "[TransNetV2] Input shape must be [frames, height, width, 3]."
 
-        def input_iterator():
-            # return windows of size 100 where the first/last 25 frames are from the previous/next batch
-            # the first and last window must be padded by copies of the first and last frame of the video
-            no_padded_frames_start = 25
-            no_padded_frames_end = 25 + 50 - (len(frames) % 50 if len(frames) % 50 != 0 else 50)  # 25 - 74
-
-            start_frame = np.expand_dims(frames[0], 0)
-            end_frame = np.expand_dims(frames[-1], 0)
-            padded_inputs = np.concatenate(
-                [start_frame] * no_padded_frames_start + [frames] + [end_frame] * no_padded_frames_end, 0
-            )
-
-            ptr = 0
-            while ptr + 100 <= len(padded_inputs):
-                out = padded_inputs[ptr:ptr + 100]
-                ptr += 50
-                yield out[np.newaxis]
-
         predictions = []
 
-        for inp in input_iterator():
+        for inp in input_windows(frames):
             single_frame_pred, all_frames_pred = self.predict_raw(inp)
-            predictions.append((single_frame_pred.numpy()[0, 25:75, 0],
-                                all_frames_pred.numpy()[0, 25:75, 0]))
+            predictions.append((single_frame_pred[0, 25:75, 0],
+                                all_frames_pred[0, 25:75, 0]))
 
             print("\r[TransNetV2] Processing video frames {}/{}".format(
                 min(len(predictions) * 50, len(frames)), len(frames)
@@ -71,7 +83,45 @@ class TransNetV2:
 
         return single_frame_pred[:len(frames)], all_frames_pred[:len(frames)]  # remove extra padded frames
 
-    def predict_video(self, video_fn: str,start_frame, end_frame):
+    def predict_frames_batched(self, frame_list, batch_size: int = 16):
+        # same as predict_frames for every array in frame_list (shots, possibly of different videos),
+        # but the 100 frame windows of all of them are run through the model batch_size at a time
+        for frames in frame_list:
+            assert len(frames.shape) == 4 and frames.shape[1:] == self._input_size, \
+                "[TransNetV2] Input shape must be [frames, height, width, 3]."
+
+        def all_windows():
+            for idx, frames in enumerate(frame_list):
+                for inp in input_windows(frames):
+                    yield idx, inp
+
+        predictions = [[] for _ in frame_list]
+        total = sum(len(frames) for frames in frame_list)
+        done = 0
+        windows = all_windows()
+        while True:
+            batch = list(itertools.islice(windows, batch_size))
+            if not batch:
+                break
+            single_frame_pred, all_frames_pred = self.predict_raw(np.concatenate([inp for _, inp in batch], 0))
+            single_frame_pred = single_frame_pred[:, 25:75, 0]
+            all_frames_pred = all_frames_pred[:, 25:75, 0]
+            # scatter the predictions back to the shot each window came from
+            for k, (idx, _) in enumerate(batch):
+                predictions[idx].append((single_frame_pred[k], all_frames_pred[k]))
+            done += 50 * len(batch)
+
+            print("\r[TransNetV2] Processing video frames {}/{}".format(min(done, total), total), end="")
+        print("")
+
+        results = []
+        for frames, preds in zip(frame_list, predictions):
+            single_frame_pred = np.concatenate([single_ for single_, all_ in preds])
+            all_frames_pred = np.concatenate([all_ for single_, all_ in preds])
+            results.append((single_frame_pred[:len(frames)], all_frames_pred[:len(frames)]))
+        return results
+
+    def read_video(self, video_fn: str, start_frame=None, end_frame=None):
         try:
             import ffmpeg
         except ModuleNotFoundError:
@@ -80,10 +130,16 @@ class TransNetV2:
                                       "install python wrapper by `pip install ffmpeg-python`.")
 
         print("[TransNetV2] Extracting frames from {}".format(video_fn))
-        video_stream, err = ffmpeg.input(video_fn).trim(start_frame=start_frame, end_frame=end_frame).setpts('PTS-STARTPTS').output(
+        stream = ffmpeg.input(video_fn)
+        if start_frame is not None:
+            stream = stream.trim(start_frame=start_frame, end_frame=end_frame).setpts('PTS-STARTPTS')
+        video_stream, err = stream.output(
             "pipe:", format="rawvideo", pix_fmt="rgb24", s="48x27"
         ).run(capture_stdout=True, capture_stderr=True)
-        video = np.frombuffer(video_stream, np.uint8).reshape([-1, 27, 48, 3])
+        return np.frombuffer(video_stream, np.uint8).reshape([-1, 27, 48, 3])
+
+    def predict_video(self, video_fn: str,start_frame, end_frame):
+        video = self.read_video(video_fn, start_frame, end_frame)
         return (video, *self.predict_frames(video))
 
     @staticmethod
@@ -106,14 +162,171 @@ class TransNetV2:
         return np.array(scenes, dtype=np.int32)
 
 
-def main(path,start_frame, end_frame):
-    model = TransNetV2(os.path.dirname(os.path.realpath(__file__)) + "/transnetv2-weights")
-    video_frames, single_frame_predictions, all_frame_predictions = model.predict_video(path,start_frame, end_frame)
+# the model is loaded and warmed up once per process and shared by every shot and video.
+# the backend running it is TRANSNET_BACKEND (tf by default) unless set_backend picks another
+_model = None
+_model_key = None
+_backend = inference.check_backend(inference.default_backend())
+_threads = (None, None)
+model_stats = {"loads": 0, "load_time": 0.0, "warmup_time": 0.0, "backend": None}
+
+
+def set_backend(name):
+    # has to be called before anything is predicted, the predictions are cached per backend
+    global _backend
+    _backend = inference.check_backend(name)
+
+
+def backend_name():
+    return _backend
+
+
+def set_threads(intra_op=None, inter_op=None):
+    # batched windows are large enough for one call to use all cores. has to be called before
+    # the model is loaded: TF takes the threads when its runtime starts, the exports when they are loaded
+    global _threads
+    _threads = (intra_op or os.cpu_count(), inter_op)
+    if _backend == "tf":
+        inference.set_tf_threads(*_threads)
+
+
+@profiling.traced("TransNetV2.get_model")
+def get_model(model_dir=None):
+    # model_dir: the SavedModel directory of the tf backend or the file of an export, the default one if None
+    global _model, _model_key
+    if model_dir is None and _backend == "tf":
+        model_dir = os.path.dirname(os.path.realpath(__file__)) + "/transnetv2-weights"
+    if _model is None or _model_key != (_backend, model_dir):
+        if _threads[0] is None:
+            set_threads()
+        t1 = time.time()
+        _model = TransNetV2(model_dir, _backend, _threads)
+        t2 = time.time()
+        _model.warmup()
+        t3 = time.time()
+        _model_key = (_backend, model_dir)
+        model_stats["loads"] += 1
+        model_stats["load_time"] += t2 - t1
+        model_stats["warmup_time"] += t3 - t2
+        model_stats["backend"] = _backend
+        print("[TransNetV2] {} model loaded in {:.2f}s, warm-up took {:.2f}s".format(_backend, t2 - t1, t3 - t2))
+    return _model
+
+
+def main(path,start_frame, end_frame, frames=None):
+    model = get_model()
+    if frames is None:
+        video_frames, single_frame_predictions, all_frame_predictions = model.predict_video(path,start_frame, end_frame)
+    else:
+        # same frames the ffmpeg trim filter would give, [start_frame, end_frame)
+        video_frames = frames[start_frame:end_frame]
+        single_frame_predictions, all_frame_predictions = model.predict_frames(video_frames)
     scenes = model.predictions_to_scenes(single_frame_predictions,start_frame=start_frame)
     f = open("subshot.txt","a")
     if scenes.shape[0] !=1:
         np.savetxt(f, scenes, fmt="%d")
     f.close()
 
+
+def feature_name(feature):
+    # predictions of the exports (the int8 ones above all) are not exactly the SavedModel's,
+    # they are cached under their own name
+    return feature if _backend == "tf" else "{}_{}".format(feature, _backend.replace("-", "_"))
+
+
+def load_shot_predictions(path):
+    # {(start_frame, end_frame): (single_frame_pred, all_frames_pred)} from the feature cache
+    arrays = feature_cache.load(path, feature_name(SHOTS_FEATURE))
+    if arrays is None:
+        return {}
+    offsets = np.concatenate([[0], np.cumsum(arrays["lengths"])])
+    return {(int(shot[0]), int(shot[1])): (arrays["single"][offsets[i]:offsets[i + 1]],
+                                           arrays["all"][offsets[i]:offsets[i + 1]])
+            for i, shot in enumerate(arrays["shots"])}
+
+
+def needs_frames(shots, path):
+    # whether any of the (start_frame, end_frame) shots is missing from the prediction cache of path,
+    # callers only get the 48x27 frames then
+    return not set((int(start_frame), int(end_frame)) for start_frame, end_frame in shots) <= \
+        set(load_shot_predictions(path))
+
+
+def save_shot_predictions(path, predictions):
+    shots = list(predictions.keys())
+    feature_cache.save(path, feature_name(SHOTS_FEATURE), {
+        "shots": np.array(shots, dtype=np.int64).reshape(-1, 2),
+        "lengths": np.array([len(predictions[shot][0]) for shot in shots], dtype=np.int64),
+        "single": np.concatenate([predictions[shot][0] for shot in shots]),
+        "all": np.concatenate([predictions[shot][1] for shot in shots]),
+    })
+
+
+def shot_subshots(path, shots, frames=None, batch_size=16, source=None, use_cache=True):
+    # sub-shots of every (start_frame, end_frame) shot, in shot order.
+    # every shot is predicted on its own frames with its own padding, like main does for it.
+    # without frames the 48x27 frames of the whole video are decoded once and the shots sliced out of them.
+    # predictions are cached by the contents of source (the video the frames came from, path by default),
+    # the model is only loaded when something has to be predicted
+    key = source or path
+    cached = load_shot_predictions(key) if use_cache else {}
+    missing = [(start_frame, end_frame) for start_frame, end_frame in shots if (start_frame, end_frame) not in cached]
+    if missing:
+        model = get_model()
+        if frames is None:
+            # one decode instead of an ffmpeg trim per shot, which decodes everything before its start
+            frames = model.read_video(path)
+        shot_frames = [frames[start_frame:end_frame] for start_frame, end_frame in missing]
+        cached.update(zip(missing, model.predict_frames_batched(shot_frames, batch_size)))
+        if use_cache:
+            save_shot_predictions(key, cached)
+    return [TransNetV2.predictions_to_scenes(cached[(start_frame, end_frame)][0], start_frame=start_frame)
+            for start_frame, end_frame in shots]
+
+
+@profiling.traced("transnetv2.main_batched")
+def main_batched(path, shots, frames=None, batch_size=16, source=None, txt_dir="."):
+    # sub-shots of all the (start_frame, end_frame) shots with their windows batched together,
+    # appends to subshot.txt in txt_dir (unless it is None) in shot order like calling main for every shot.
+    # returns the [start_frame, end_frame] sub-shots
+    subshots = [scenes for scenes in shot_subshots(path, shots, frames, batch_size, source)
+                if scenes.shape[0] !=1]
+    if txt_dir is not None:
+        f = open(os.path.join(txt_dir, "subshot.txt"),"a")
+        for scenes in subshots:
+            np.savetxt(f, scenes, fmt="%d")
+        f.close()
+    return np.concatenate(subshots).astype(np.int64) if subshots else np.zeros((0, 2), dtype=np.int64)
+
+
+@profiling.traced("transnetv2.resumable_subshots")
+def resumable_subshots(path, shots, journal, frames=None, batch_size=16, source=None, group_size=8, callback=None):
+    # main_batched without the txt file, shots go through the model group_size at a time and their
+    # sub-shots are recorded in journal (anything with __contains__, __getitem__ and record(shot, scenes)),
+    # so after a crash only the shots missing from it are predicted again.
+    # callback(sub-shots) gets the [start_frame, end_frame] sub-shots of every group as it is done
+    shots = [(int(start_frame), int(end_frame)) for start_frame, end_frame in shots]
+    missing = [shot for shot in shots if shot not in journal]
+    if callback is not None and len(missing) < len(shots):
+        done = [np.asarray(journal[shot], dtype=np.int64).reshape(-1, 2) for shot in shots if shot in journal]
+        done = [scenes for scenes in done if scenes.shape[0] != 1]
+        if done:
+            callback(np.concatenate(done))
+    if frames is None and needs_frames(missing, source or path):
+        # decoded once for all the groups
+        frames = get_model().read_video(path)
+    for i in range(0, len(missing), group_size):
+        group = missing[i:i + group_size]
+        found = []
+        for shot, scenes in zip(group, shot_subshots(path, group, frames, batch_size, source=source)):
+            journal.record(shot, scenes)
+            if scenes.shape[0] != 1:
+                found.append(np.asarray(scenes, dtype=np.int64))
+        if callback is not None and found:
+            callback(np.concatenate(found))
+    subshots = [np.asarray(journal[shot], dtype=np.int64).reshape(-1, 2) for shot in shots]
+    subshots = [scenes for scenes in subshots if scenes.shape[0] != 1]
+    return np.concatenate(subshots) if subshots else np.zeros((0, 2), dtype=np.int64)
+
 if __name__ == "__main__":
     main()
@@ -10,28 +10,83 @@ import argparse
 import pyaudio
 import wave
 import time
+import threading
+from collections import deque
+
+
+# decodes frames of the .rgb ahead of playback on a background thread into a ring buffer
+# of at most capacity frames, so memory does not depend on the length of the video.
+# frames are PIL images, tkinter objects can only be made on the main thread
+class FrameDecoder:
+    def __init__(self, video_filepath, width, height, capacity=48):
+        self.frames = np.memmap(video_filepath, dtype=np.uint8, mode='r').reshape(-1, height, width, 3)
+        self.frame_count = self.frames.shape[0]
+        self.capacity = capacity
+        self.buffer = deque()
+        self.next_frame = 0
+        self.dropped = 0
+        self.running = True
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    def decode(self):
+        while True:
+            with self.cond:
+                while self.running and (len(self.buffer) >= self.capacity or self.next_frame >= self.frame_count):
+                    self.cond.wait()
+                if not self.running:
+                    return
+                frame_idx = self.next_frame
+            # read from the file outside the lock
+            image = Image.fromarray(np.array(self.frames[frame_idx]), mode="RGB")
+            with self.cond:
+                # a seek while reading makes the frame useless
+                if frame_idx == self.next_frame:
+                    self.buffer.append((frame_idx, image))
+                    self.next_frame += 1
+                    self.cond.notify_all()
+
+    def get(self, frame_idx):
+        # the frame to show at frame_idx, frames before it that were never shown are dropped.
+        # None if the decoder has not got there yet
+        with self.cond:
+            image = None
+            while self.buffer and self.buffer[0][0] <= frame_idx:
+                if image is not None:
+                    self.dropped += 1
+                _, image = self.buffer.popleft()
+            if not self.buffer and self.next_frame < frame_idx < self.frame_count:
+                # the decoder is behind, skip ahead instead of decoding everything in between
+                self.dropped += frame_idx - self.next_frame
+                self.next_frame = frame_idx
+            self.cond.notify_all()
+            return image
+
+    def seek(self, frame_idx):
+        with self.cond:
+            self.buffer.clear()
+            self.next_frame = min(max(frame_idx, 0), self.frame_count)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
 
 class VideoPlayer:
     def __init__(self, video_filepath, audio_filepath):
         self.width = 480
         self.height = 270
-        fps = 30
-        self.delay = 1000 // fps 
-        self.delay_float = 1000./fps
+        self.fps = 30
 
         self.root = tk.Tk()
 
-        self.video_buffer = []
+        # frames come from a memory-mapped file through the decoder, nothing is read up front
+        self.decoder = FrameDecoder(video_filepath, self.width, self.height)
         self.frame_idx = 0
-        video = open(video_filepath, "rb")
-        video_data = video.read(self.height * self.width * 3)
-        while(video_data):
-            data2 = np.frombuffer(video_data, dtype=np.uint8).reshape(270, 480, 3)
-            photo = ImageTk.PhotoImage(image=Image.fromarray(data2, mode="RGB"))
-            # self.video_buffer.append(data2)
-            self.video_buffer.append(photo)
-            video_data = video.read(self.height * self.width * 3)
-        video.close()
+        self.photo = ImageTk.PhotoImage(Image.new("RGB", (self.width, self.height)))
 
         self.root.title('Video Player')
         
@@ -48,7 +103,7 @@ class VideoPlayer:
         # self.video_canvas = tk.Canvas(right_frame, width=self.width, height=self.height)
         # self.video_canvas.pack(side=tk.TOP)
 
-        self.video_label = tk.Label(right_frame)
+        self.video_label = tk.Label(right_frame, image=self.photo)
         self.video_label.pack(side=tk.TOP)
 
         play_button = tk.Button(right_frame, text='PLAY', command=self.play_pressed)
@@ -129,14 +184,21 @@ class VideoPlayer:
         with wave.open(audio_filepath,"rb") as audf:
             audio_params = dict((audf.getparams()._asdict()))
             self.audio = audf.readframes(audio_params['nframes'])
+        self.audio_rate = audio_params['framerate']
+        bytes_per_frame = audio_params['sampwidth'] * audio_params['nchannels']
 
         self.pyaud = pyaudio.PyAudio()
         self.curr_aud_frame = 0
+        # the audio clock: audio frame the last callback started at and when it ran
+        self.clock_aud_frame = 0
+        self.clock_time = None
 
         def callback(in_data, frame_count, time_info, status):
-            frame_start = self.curr_aud_frame*4
-            frame_end = frame_start + (frame_count*4)
+            frame_start = self.curr_aud_frame*bytes_per_frame
+            frame_end = frame_start + (frame_count*bytes_per_frame)
             data = self.audio[frame_start:frame_end]
+            self.clock_aud_frame = self.curr_aud_frame
+            self.clock_time = time.monotonic()
             self.curr_aud_frame += frame_count
             return (data, pyaudio.paContinue)
         
@@ -145,9 +207,8 @@ class VideoPlayer:
                 rate = audio_params['framerate'],  ## 44.1 khz
                 output = True,
                 stream_callback=callback)
-        
-        self.last_update_time = time.time()
-    
+        self.audio_latency = self.audio_stream.get_output_latency()
+
 
     def run(self):
         self.update()
@@ -155,6 +216,7 @@ class VideoPlayer:
 
     def close(self):
         self.play = 0
+        self.decoder.close()
         self.audio_stream.close()
         self.pyaud.terminate()
         self.root.destroy()
@@ -163,13 +225,17 @@ class VideoPlayer:
         self.play = 1
         self.paused = 0
         self.stopped = 0
-        self.audio_stream.start_stream()
+        if not self.audio_stream.is_active():
+            self.audio_stream.start_stream()
 
     def pause_pressed(self):
         self.play = 0
         self.paused = 1
         self.stopped = 0
         self.audio_stream.stop_stream()
+        # the clock stays where the audio stopped until it plays again
+        self.clock_aud_frame = self.curr_aud_frame
+        self.clock_time = None
 
     def stop_pressed(self):
         self.play = 0
@@ -179,31 +245,38 @@ class VideoPlayer:
         # TODO eventually we want the player to reset to the beginning of the shot its on
         # here i am just resetting back to the beginning
         self.curr_aud_frame = 0
+        self.clock_aud_frame = 0
+        self.clock_time = None
         self.frame_idx = 0
-        
-    # TODO figure out the right amount of time to delay in order to closely mimic fps of video
+        self.decoder.seek(0)
+
+    def audio_clock(self):
+        # seconds of audio heard so far: where the last callback started, plus the time since,
+        # minus what is still in the output buffer. the callbacks keep it from drifting
+        position = self.clock_aud_frame / self.audio_rate
+        if self.clock_time is not None:
+            position += time.monotonic() - self.clock_time
+            position = min(position, self.curr_aud_frame / self.audio_rate)
+        return max(position - self.audio_latency, 0.)
+
     def update(self):
-        start_time = time.time()
-        if self.play:
-            # self.photo = ImageTk.PhotoImage(image=Image.fromarray(self.video_buffer[self.frame_idx], mode="RGB"))
-            # self.video_canvas.create_image(0, 0, image=self.photo, anchor=tk.NW)
-            # self.video_label.config(image=self.photo)
-            # self.video_label.image=self.photo
-            self.video_label.config(image=self.video_buffer[self.frame_idx])
-            self.video_label.image=self.video_buffer[self.frame_idx]
-            self.frame_idx += 1
-        updated_time = time.time()
-        # process_time_ms_float = ((updated_time - self.last_update_time) * 1000.)
-        process_time_ms_float = (updated_time - start_time) * 1000.
-        # print(start_time, updated_time, process_time_ms_float)
-        # time_since_update = (updated_time - self.last_update_time) // 1_000_000 # gives ms
-        time_to_wait = round(self.delay_float - process_time_ms_float)
-       
-        # self.last_update_time = updated_time
-        delay = max(time_to_wait, 0)
-        # self.root.after(33, self.update)
-        self.root.after(30, self.update)
-        # self.root.after(1000//15, self.update)
+        # shows the frame the audio clock is at and runs again when the next one is due,
+        # frames the player fell behind on are dropped by the decoder
+        if not self.play:
+            self.root.after(50, self.update)
+            return
+        clock = self.audio_clock()
+        frame_idx = int(clock * self.fps)
+        if frame_idx >= self.decoder.frame_count:
+            # past the last frame, it stays on screen
+            self.root.after(50, self.update)
+            return
+        image = self.decoder.get(frame_idx)
+        if image is not None:
+            self.photo.paste(image)
+            self.frame_idx = frame_idx
+        next_due = (frame_idx + 1) / self.fps - clock
+        self.root.after(max(int(next_due * 1000), 1), self.update)
 
 def main():
     parser = argparse.ArgumentParser()
@@ -1,100 +1,215 @@
 import argparse
+import bisect
+import math
+import os
 import sys
+import traceback
 import tempfile
 import cv2
 import numpy as np
-from moviepy.editor import ImageSequenceClip, AudioFileClip
-from PyQt5.QtCore import Qt, QUrl, pyqtSignal
+from PyQt5.QtCore import Qt, QUrl, QThread, QTimer, QAbstractItemModel, QModelIndex, pyqtSignal
+from PyQt5.QtGui import QBrush, QColor
 from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
 from PyQt5.QtWidgets import *
 from PyQt5.QtMultimediaWidgets import QVideoWidget
-from backend import transnetv2, detect_shot
-from backend.detect import detectScene
-
-
-def get_scenes_shots_subshots(rgb_filepath, mp4_filepath):
-    # saves results as scene.txt, shot.txt, subshot.txt
-    # for scene detection
-    detectScene()
-
-    # # for shot detection
-    detect_shot.main(mp4_filepath)
-
-    # for sub-shot detection
-    with open("shot.txt", "r") as input:
-        file = open("subshot.txt", "w")
-        file.close()
-        for line in input:
-            param = line.strip().split(' ')
-            start_frame = int(param[0])
-            end_frame = int(param[1])
-            if end_frame - start_frame < 250:
+from backend import profiling
+from backend.segmentation import segmentation_stages
+from backend.segmentation_result import job_dir
+from backend.segment_index import SegmentIndex
+
+
+# runs the segmentation stages away from the GUI thread, results reach the player through signals
+# as soon as each stage (or group of sub-shots) is done
+class SegmentationWorker(QThread):
+    video_ready = pyqtSignal(str)
+    segments_ready = pyqtSignal(str, object)
+    subshots_found = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, make_graph, force=()):
+        # make_graph(on_subshots) returns the stage graph
+        super().__init__()
+        self.make_graph = make_graph
+        self.force = force
+
+    def run(self):
+        try:
+            graph = self.make_graph(self.subshots_found.emit)
+            graph.run(self.force, on_output=self.stage_output)
+        except Exception as exc:
+            traceback.print_exc()
+            self.failed.emit(str(exc))
+
+    def stage_output(self, name, value):
+        if name == "encode":
+            self.video_ready.emit(value)
+        elif name in ("scene", "shot", "subshot"):
+            self.segments_ready.emit(name, np.array(value, dtype=np.int64).reshape(-1, 2))
+        elif name == "audio":
+            # the scenes split where the sound changes
+            self.segments_ready.emit("scene", np.array(value, dtype=np.int64).reshape(-1, 2))
+
+
+# entries of the table of contents, a scene has shots as children and a shot its subshots
+class ToCNode:
+    def __init__(self, name, timestamp_ms, parent=None):
+        self.name = name
+        self.timestamp_ms = timestamp_ms
+        self.parent = parent
+        self.children = []
+        self.row = 0
+
+
+# the table of contents as a tree model, the view only creates what is visible.
+# the entry the video is at is shown in red through ForegroundRole
+class ToCModel(QAbstractItemModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.root = ToCNode("", 0)
+        self.shot_nodes = []
+        # entries in table of contents order and their timestamps, which never decrease in that order
+        self.flat = []
+        self.boundaries = []
+        self.current = None
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = parent.internalPointer() if parent.isValid() else self.root
+        if column != 0 or row < 0 or row >= len(node.children):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        node = index.internalPointer().parent
+        if node is None or node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        node = parent.internalPointer() if parent.isValid() else self.root
+        return len(node.children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role == Qt.DisplayRole:
+            return node.name
+        if role == Qt.ForegroundRole:
+            return QBrush(QColor("red" if node is self.current else "black"))
+        if role == Qt.UserRole:
+            return node.timestamp_ms
+        return None
+
+    def node_index(self, node):
+        return self.createIndex(node.row, 0, node)
+
+    def set_current(self, node):
+        old, self.current = self.current, node
+        for changed in (old, node):
+            if changed is not None and changed is not self.root:
+                index = self.node_index(changed)
+                self.dataChanged.emit(index, index, [Qt.ForegroundRole])
+
+    def node_at(self, position):
+        # last entry starting at or before position, the first one if there is none.
+        # of entries starting together (a scene, its first shot and subshot) that is the innermost
+        if not self.flat:
+            return None
+        return self.flat[max(bisect.bisect_right(self.boundaries, position) - 1, 0)]
+
+    def next_boundary(self, position):
+        # first timestamp after position in ms, None after the last entry
+        i = bisect.bisect_right(self.boundaries, position)
+        return self.boundaries[i] if i < len(self.boundaries) else None
+
+    @staticmethod
+    def subshot_timestamps(index, shot):
+        # labels are shown for subshots only if there is more than 1 subshot for any given shot,
+        # the first one starting with the shot
+        timestamps = [index.timestamp_ms("shot", shot)]
+        timestamps += [index.timestamp_ms("subshot", subshot) for subshot in index.children("shot", shot)]
+        return timestamps if len(timestamps) > 1 else []
+
+    def _subshot_nodes(self, shot_node, timestamps):
+        nodes = [ToCNode("Subshot {}".format(i + 1), timestamp, shot_node) for i, timestamp in enumerate(timestamps)]
+        for row, node in enumerate(nodes):
+            node.row = row
+        return nodes
+
+    def _flatten(self):
+        self.flat = []
+        for scene in self.root.children:
+            self.flat.append(scene)
+            for shot in scene.children:
+                self.flat.append(shot)
+                self.flat.extend(shot.children)
+        self.boundaries = [node.timestamp_ms for node in self.flat]
+
+    def set_segments(self, segments, position=0):
+        # rebuilds the tree from the {level: [start_frame, end_frame] array} segments,
+        # position is where the video is in ms
+        index = SegmentIndex(segments["scene"], segments["shot"], segments["subshot"])
+        self.beginResetModel()
+        self.root.children = []
+        self.shot_nodes = [None] * index.count("shot")
+        for scene_idx in range(index.count("scene")):
+            shots = index.children("scene", scene_idx)
+            if len(shots):
+                scene_timestamp = index.timestamp_ms("shot", shots[0])
+            else:
+                # shots are not known yet
+                scene_timestamp = index.timestamp_ms("scene", scene_idx)
+            scene_node = ToCNode("Scene {}".format(scene_idx + 1), scene_timestamp, self.root)
+            scene_node.row = scene_idx
+            self.root.children.append(scene_node)
+            for shot_idx, shot in enumerate(shots):
+                shot_node = ToCNode("Shot {}".format(shot_idx + 1), index.timestamp_ms("shot", shot), scene_node)
+                shot_node.row = shot_idx
+                shot_node.children = self._subshot_nodes(shot_node, self.subshot_timestamps(index, shot))
+                scene_node.children.append(shot_node)
+                self.shot_nodes[shot] = shot_node
+        self._flatten()
+        self.current = self.node_at(position)
+        self.endResetModel()
+
+    def update_subshots(self, segments):
+        # only the shots whose subshots changed get their rows replaced, returns their indexes
+        index = SegmentIndex(segments["scene"], segments["shot"], segments["subshot"])
+        changed = []
+        for shot, shot_node in enumerate(self.shot_nodes):
+            if shot_node is None:
                 continue
-            transnetv2.main(mp4_filepath, start_frame, end_frame)
-
-
-def convert_txts_to_timestamps(fps=30):
-    scenes = []
-
-    scenes_np = np.loadtxt('scene.txt').astype(np.int)
-    shots_np = np.loadtxt('shot.txt').astype(np.int)
-    subshots_np = np.loadtxt('subshot.txt').astype(np.int)
-    for scene in scenes_np:
-        start_scene, end_scene = scene
-        new_scene_list = []
-        for shot in shots_np:
-            start_shot, end_shot = shot
-            if start_shot >= start_scene and end_shot <= end_scene:
-                timestamp_ms = round((start_shot / fps) * 1000.)
-                new_shot_list = [timestamp_ms]
-                for subshot in subshots_np:
-                    start_subshot, end_subshot = subshot
-                    if start_subshot >= start_shot and end_subshot <= end_shot:
-                        timestamp_ms = round((start_subshot / fps) * 1000.)
-                        new_shot_list.append(timestamp_ms)
-                new_scene_list.append(new_shot_list)
-        scenes.append(new_scene_list)
-    return scenes
-
-
-# helper utility function for constructing an .mp4 file from .rgb and .wav files
-def write_video(rgb_filepath, audio_filepath, width, height, mp4_filepath=None):
-    frames = []
-
-    if mp4_filepath is None:
-        mp4_filepath = rgb_filepath.replace('.rgb', '.mp4')
-
-    with open(rgb_filepath, "rb") as f:
-        video_data = f.read(height * width * 3)
-        while (video_data):
-            frame = np.frombuffer(video_data, dtype=np.uint8).reshape(height, width, 3)
-            frames.append(frame)
-            video_data = f.read(height * width * 3)
-
-    clip = ImageSequenceClip(frames, fps=30)
-
-    audio_file = AudioFileClip(audio_filepath)
-
-    final_clip = clip.set_audio(audio_file)
-
-    final_clip.write_videofile(mp4_filepath, codec="libx264")
-
-    return mp4_filepath
-
-
-# this class specifically for shot and subshot label in table of contents
-# designed such that when they are clicked, the label can be easily identified
-class ToCLabel(QLabel):
-    clicked = pyqtSignal()
-
-    def mousePressEvent(self, event):
-        self.clicked.emit()
-        QLabel.mousePressEvent(self, event)
+            timestamps = self.subshot_timestamps(index, shot)
+            if timestamps == [node.timestamp_ms for node in shot_node.children]:
+                continue
+            parent = self.node_index(shot_node)
+            if shot_node.children:
+                if self.current in shot_node.children:
+                    self.current = shot_node
+                self.beginRemoveRows(parent, 0, len(shot_node.children) - 1)
+                shot_node.children = []
+                self.endRemoveRows()
+            if timestamps:
+                self.beginInsertRows(parent, 0, len(timestamps) - 1)
+                shot_node.children = self._subshot_nodes(shot_node, timestamps)
+                self.endInsertRows()
+            changed.append(parent)
+        if changed:
+            self._flatten()
+        return changed
 
 
 # main class for the UI interface
 class VideoPlayer(QMainWindow):
-    def __init__(self, mp4_filepath, scenes):
+    def __init__(self, mp4_filepath=None):
+        # the video and the table of contents can be given later, with set_video and set_segments
         super().__init__()
         self.setWindowTitle('Video Player')
         window_width = 720
@@ -111,15 +226,18 @@ class VideoPlayer(QMainWindow):
 
         # create media player
         self.media_player = QMediaPlayer(None, QMediaPlayer.VideoSurface)
-        media_content = QMediaContent(QUrl.fromLocalFile(mp4_filepath))
-        self.media_player.setMedia(media_content)
+        self.mp4_filepath = None
         self.media_player.positionChanged.connect(self.video_updated_func)
+        self.media_player.stateChanged.connect(self.playback_state_changed)
         self.media_player.setVideoOutput(video_widget)
 
-        # every 200 ms, check position of video
-        # do not set value too low, may collide with clicking label click event check
-        # if it still collides, then raise interval value
-        self.media_player.setNotifyInterval(200)
+        # the highlight moves when boundary_timer fires at the start of the next entry,
+        # position updates only catch seeks and drift, so they can be rare
+        self.boundary_timer = QTimer(self)
+        self.boundary_timer.setSingleShot(True)
+        self.boundary_timer.setTimerType(Qt.PreciseTimer)
+        self.boundary_timer.timeout.connect(self.boundary_reached)
+        self.media_player.setNotifyInterval(1000)
 
         # create play pause stop buttons
         self.play_button = QPushButton('Play')
@@ -146,63 +264,25 @@ class VideoPlayer(QMainWindow):
         vid_and_buttons_layout.addWidget(video_widget)
         vid_and_buttons_layout.addLayout(button_layout)
 
-        # set up table of contents layout
-        self.toc_layout = QGridLayout()
-        self.toc_layout.setHorizontalSpacing((window_width - video_width) // 6)  # just an arbitrary number
-
-        # each list in scenes is a scene.
-        # within each list are more lists, each of those a shot.
-        # within those lists, are timestamps in ms of when the subshot begins (examples for now)
-        # labels are shown for subshots only if there is more than 1 subshot for any given shot
-        self.rowcol_to_timestamp = dict()
-
-        num_labels_gen = 0
-        for scene_idx, scene in enumerate(scenes):
-            label = ToCLabel("Scene {}".format(scene_idx + 1))
-            label.setStyleSheet("color: black")
-            label.setCursor(Qt.PointingHandCursor)
-            label.clicked.connect(self.label_click_func)
-            self.toc_layout.addWidget(label, num_labels_gen, 0, Qt.Alignment())
-            self.rowcol_to_timestamp[(num_labels_gen, 0)] = scene[0][0]
-            num_labels_gen += 1
-
-            for shot_idx, shot in enumerate(scene):
-                label = ToCLabel("Shot {}".format(shot_idx + 1))
-                label.setStyleSheet("color: black")
-                label.setCursor(Qt.PointingHandCursor)
-                label.clicked.connect(self.label_click_func)
-                self.toc_layout.addWidget(label, num_labels_gen, 1, Qt.Alignment())
-                self.rowcol_to_timestamp[(num_labels_gen, 1)] = shot[0]
-                num_labels_gen += 1
-
-                if len(shot) > 1:
-                    for subshot_idx, subshot in enumerate(shot):
-                        label = ToCLabel("Subshot {}".format(subshot_idx + 1))
-                        label.setStyleSheet("color: black")
-                        label.setCursor(Qt.PointingHandCursor)
-                        label.clicked.connect(self.label_click_func)
-                        self.toc_layout.addWidget(label, num_labels_gen, 2, Qt.Alignment())
-                        self.rowcol_to_timestamp[(num_labels_gen, 2)] = subshot
-                        num_labels_gen += 1
-
-        # starting on scene1
-        self.curr_shot = self.toc_layout.itemAtPosition(0,0).widget()
-        self.curr_shot.setStyleSheet("color: red")
-
-        # set layout of table of contents widget
-        toc_widget = QWidget()
-        toc_widget.setLayout(self.toc_layout)
-
-        # create scrollbar widget for table of contents widget
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        scroll.setFixedHeight(window_height)
-        scroll.setFixedWidth(window_width - video_width)
-        scroll.setWidget(toc_widget)
+        # [start_frame, end_frame] segments found so far, the table of contents model is built from them
+        self.segments = {level: np.zeros((0, 2), dtype=np.int64) for level in ("scene", "shot", "subshot")}
+        self.segmentation_error = None
+
+        # set up table of contents, a tree view only creates the rows that are visible
+        self.toc_model = ToCModel(self)
+        self.toc_view = QTreeView()
+        self.toc_view.setModel(self.toc_model)
+        self.toc_view.setHeaderHidden(True)
+        self.toc_view.setUniformRowHeights(True)
+        self.toc_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.toc_view.setCursor(Qt.PointingHandCursor)
+        self.toc_view.clicked.connect(self.label_click_func)
+        self.toc_view.setFixedHeight(window_height)
+        self.toc_view.setFixedWidth(window_width - video_width)
 
         # set up central widget layout
         master_layout = QHBoxLayout()
-        master_layout.addWidget(scroll)
+        master_layout.addWidget(self.toc_view)
         master_layout.addLayout(vid_and_buttons_layout)
 
         # set the layout of the central widget
@@ -210,26 +290,77 @@ class VideoPlayer(QMainWindow):
         main_widget.setLayout(master_layout)
         self.setCentralWidget(main_widget)
 
+        self.statusBar().showMessage('Preparing video...')
+        if mp4_filepath is not None:
+            self.set_video(mp4_filepath)
+
+    def set_video(self, mp4_filepath):
+        if mp4_filepath == self.mp4_filepath:
+            return
+        self.mp4_filepath = mp4_filepath
+        self.media_player.setMedia(QMediaContent(QUrl.fromLocalFile(os.path.abspath(mp4_filepath))))
         self.media_player.play()
+        self.statusBar().showMessage('Segmenting...')
+
+    def set_segments(self, level, segments):
+        # all the segments of a level, replaces what was found so far
+        self.segments[level] = np.asarray(segments, dtype=np.int64).reshape(-1, 2)
+        self.toc_model.set_segments(self.segments, self.media_player.position())
+        self.toc_view.expandAll()
+        self.schedule_boundary()
+
+    def add_subshots(self, segments):
+        self.segments["subshot"] = np.concatenate([self.segments["subshot"],
+                                                   np.asarray(segments, dtype=np.int64).reshape(-1, 2)])
+        for index in self.toc_model.update_subshots(self.segments):
+            self.toc_view.expand(index)
+        self.video_updated_func(self.media_player.position())
+
+    def segmentation_failed(self, message):
+        self.segmentation_error = message
+        self.statusBar().showMessage('Segmentation failed: {}'.format(message))
+
+    def segmentation_finished(self):
+        if self.segmentation_error is None:
+            self.statusBar().showMessage('Segmentation done', 5000)
 
     def video_updated_func(self, position):
-        curr_shot_idx = self.toc_layout.indexOf(self.curr_shot)
-        if curr_shot_idx == self.toc_layout.count() - 1:
+        # straight to the entry at position, also after a seek or several short entries.
+        # a clicked entry stays highlighted while the video is in it, even if one starting
+        # at the same time is nested in it
+        node = self.toc_model.node_at(position)
+        current = self.toc_model.current
+        if current is None or node is None or node.timestamp_ms != current.timestamp_ms:
+            self.toc_model.set_current(node)
+        self.schedule_boundary(position)
+
+    def schedule_boundary(self, position=None):
+        # fire when the video gets past the start of the next entry
+        self.boundary_timer.stop()
+        if self.media_player.state() != QMediaPlayer.PlayingState:
+            return
+        if position is None:
+            position = self.media_player.position()
+        next_ms = self.toc_model.next_boundary(position)
+        if next_ms is None:
             return
-        row, col, _, _ = self.toc_layout.getItemPosition(curr_shot_idx + 1)
-        timestamp_ms = self.rowcol_to_timestamp[(row, col)]
-        if position > timestamp_ms:
-            self.curr_shot.setStyleSheet("color: black")
-            next_shot_label = self.toc_layout.itemAtPosition(row, col).widget()
-            next_shot_label.setStyleSheet("color: red")
-            self.curr_shot = next_shot_label
+        rate = self.media_player.playbackRate() or 1.0
+        self.boundary_timer.start(int(math.ceil((next_ms - position) / rate)))
+
+    def boundary_reached(self):
+        self.video_updated_func(self.media_player.position())
+
+    def playback_state_changed(self, state):
+        self.schedule_boundary()
+
+    def restart_highlight(self):
+        # starting on scene1
+        self.toc_model.set_current(self.toc_model.flat[0] if self.toc_model.flat else None)
 
     def play_button_func(self):
         # if button pressed at the end of .mp4 video, then pyqt restarts the video
         if self.media_player.mediaStatus() == QMediaPlayer.EndOfMedia:
-            self.curr_shot.setStyleSheet("color: black")
-            self.curr_shot = self.toc_layout.itemAtPosition(0, 0).widget()
-            self.curr_shot.setStyleSheet("color: red")
+            self.restart_highlight()
         self.media_player.play()
         self.stop_button.setChecked(False)
         self.play_button.setChecked(True)
@@ -238,32 +369,27 @@ class VideoPlayer(QMainWindow):
     def pause_button_func(self):
         # if button pressed at the end of .mp4 video, then pyqt restarts the video
         if self.media_player.mediaStatus() == QMediaPlayer.EndOfMedia:
-            self.curr_shot.setStyleSheet("color: black")
-            self.curr_shot = self.toc_layout.itemAtPosition(0, 0).widget()
-            self.curr_shot.setStyleSheet("color: red")
+            self.restart_highlight()
         self.media_player.pause()
         self.stop_button.setChecked(False)
         self.play_button.setChecked(False)
         self.pause_button.setChecked(True)
 
     def stop_button_func(self):
-        curr_shot_idx = self.toc_layout.indexOf(self.curr_shot)
-        row, col, _, _ = self.toc_layout.getItemPosition(curr_shot_idx)
-        timestamp_ms = self.rowcol_to_timestamp[(row, col)]
+        timestamp_ms = 0
+        if self.toc_model.current is not None:
+            timestamp_ms = self.toc_model.current.timestamp_ms
         self.media_player.setPosition(timestamp_ms)
         self.media_player.pause()
         self.stop_button.setChecked(True)
         self.play_button.setChecked(False)
         self.pause_button.setChecked(False)
 
-    def label_click_func(self):
-        label = self.sender()
-        self.curr_shot.setStyleSheet("color: black")
-        label.setStyleSheet("color: red")
-        row, col, _, _ = self.toc_layout.getItemPosition(self.toc_layout.indexOf(label))
-        timestamp_ms = self.rowcol_to_timestamp[(row, col)]
-        self.media_player.setPosition(timestamp_ms)
-        self.curr_shot = label
+    def label_click_func(self, index):
+        node = index.internalPointer()
+        self.toc_model.set_current(node)
+        self.media_player.setPosition(node.timestamp_ms)
+        self.schedule_boundary(node.timestamp_ms)
 
 
 def main():
@@ -273,21 +399,48 @@ def main():
     parser.add_argument('--width', default=480)
     parser.add_argument('--height', default=270)
     parser.add_argument('--mp4file', help='Optionally, Skip generating a .mp4 if it already exists in this path')
+    parser.add_argument('--output-dir', help='Directory for the segmentation results, results/<video name> by default')
+    parser.add_argument('--txt', action='store_true', help='Also write scene.txt, shot.txt and subshot.txt to the output directory')
+    parser.add_argument('--preset', default='medium', help='x264 preset used to encode the .mp4')
+    parser.add_argument('--threads', type=int, default=0, help='Encoder threads, 0 picks them automatically')
+    parser.add_argument('--shot-size', choices=['240x135', '120x68', '48x27'],
+                        help='Score shots on this level of the analysis proxy instead of full resolution')
+    parser.add_argument('--shot-workers', type=int,
+                        help='Threads scoring and processes splitting the shots of long videos, all cores by default')
+    parser.add_argument('--force', nargs='*', default=[], metavar='STAGE',
+                        help='Run these stages (encode, scene, shot, audio, subshot, timestamps) even if they are up to date')
+    parser.add_argument('--profile', metavar='TRACE', help='Time the stages, write a Chrome trace to TRACE and print a summary on exit')
     args = parser.parse_args()
-
-    if not args.mp4file:
-        mp4_filepath = write_video(args.rgbfile, args.wavfile, args.width, args.height)
-    else:
-        mp4_filepath = args.mp4file
-
-    get_scenes_shots_subshots(args.rgbfile, mp4_filepath)  # saves results as scene.txt, shot.txt, subshot.txt
-    scenes = convert_txts_to_timestamps()
-
+    if args.profile:
+        profiling.enable(args.profile)
+    output_dir = args.output_dir or job_dir(args.rgbfile)
+    shot_size = tuple(int(n) for n in args.shot_size.split('x')) if args.shot_size else None
+
+    # only the stages whose inputs changed since the last run in output_dir are executed
+    def make_graph(on_subshots):
+        return segmentation_stages(args.rgbfile, args.wavfile, output_dir, args.mp4file,
+                                   int(args.width), int(args.height), args.txt, args.preset, args.threads,
+                                   shot_size, on_subshots, shot_workers=args.shot_workers)
+
+    # the window opens right away and plays as soon as there is an .mp4,
+    # the table of contents fills in while the stages run in the background
     app = QApplication(sys.argv)
-    player = VideoPlayer(mp4_filepath, scenes)
+    player = VideoPlayer(args.mp4file)
+    worker = SegmentationWorker(make_graph, args.force)
+    worker.video_ready.connect(player.set_video)
+    worker.segments_ready.connect(player.set_segments)
+    worker.subshots_found.connect(player.add_subshots)
+    worker.failed.connect(player.segmentation_failed)
+    worker.finished.connect(player.segmentation_finished)
     player.show()
-    sys.exit(app.exec_())
+    worker.start()
+    code = app.exec_()
+    # the stages are resumable, closing the window does not wait for the one running,
+    # the next run picks up from where it was
+    profiling.finish()
+    sys.stdout.flush()
+    os._exit(code)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -2,25 +2,34 @@ import argparse
 import sys
 import tempfile
 import cv2
-import numpy as np
-from moviepy.editor import ImageSequenceClip, AudioFileClip
 from PyQt5.QtCore import Qt, QUrl, pyqtSignal
 from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
 from PyQt5.QtWidgets import *
 from PyQt5.QtMultimediaWidgets import QVideoWidget
-from backend import transnetv2, detect_shot
+from backend.encode import encode_video
+from backend import transnetv2, detect_shot, profiling
+from backend.segment_index import SegmentIndex
 from backend.detect import detectScene
+from backend.frame_pipeline import FramePipeline
+from backend.proxy import get_proxy, level_name
 
+@profiling.traced("get_scenes_shots_subshots")
 def get_scenes_shots_subshots(rgb_filepath, mp4_filepath):
     # saves results as scene.txt, shot.txt, subshot.txt
+    # the video is decoded once, scene detection drives the pass and
+    # shot detection gets its frames from the same pipeline
+    pipeline = FramePipeline(rgb_filepath)
+    shot_detector = pipeline.add_detector(detect_shot.ShotDetector())
+
     # for scene detection
-    detectScene()
+    detectScene(rgb_filepath, pipeline)
 
     # # for shot detection
-    detect_shot.main(mp4_filepath)
+    detect_shot.main(mp4_filepath, shot_detector)
 
-    # for sub-shot detection
-    with open("shot.txt", "r") as input:
+    # for sub-shot detection, the windows of all long shots go through TransNetV2 in batches
+    shots = []
+    with profiling.span("shot.txt read", category="io"), open("shot.txt", "r") as input:
         file = open("subshot.txt","w")
         file.close()
         for line in input:
@@ -29,54 +38,23 @@ def get_scenes_shots_subshots(rgb_filepath, mp4_filepath):
             end_frame = int(param[1])
             if end_frame-start_frame<250:
                 continue
-            transnetv2.main(mp4_filepath, start_frame, end_frame)
+            shots.append((start_frame, end_frame))
+    # the 48x27 frames of the analysis proxy are mapped, and only when a shot is missing from the prediction cache
+    frames = None
+    if transnetv2.needs_frames(shots, rgb_filepath):
+        frames = get_proxy(rgb_filepath, [level_name((48, 27), 'rgb')]).level((48, 27), 'rgb')
+    transnetv2.main_batched(mp4_filepath, shots, frames, source=rgb_filepath)
 
 def convert_txts_to_timestamps(fps=30):
-    scenes = []
-
-    scenes_np = np.loadtxt('scene.txt').astype(np.int)
-    shots_np = np.loadtxt('shot.txt').astype(np.int)
-    subshots_np = np.loadtxt('subshot.txt').astype(np.int)
-    for scene in scenes_np:
-        start_scene, end_scene = scene
-        new_scene_list = []
-        for shot in shots_np:
-            start_shot, end_shot = shot
-            if start_shot >= start_scene and end_shot <= end_scene:
-                timestamp_ms = round((start_shot/fps) * 1000.)
-                new_shot_list = [timestamp_ms]
-                for subshot in subshots_np:
-                    start_subshot, end_subshot = subshot
-                    if start_subshot >= start_shot and end_subshot <= end_shot:
-                        timestamp_ms = round((start_subshot/fps) * 1000.)
-                        new_shot_list.append(timestamp_ms)
-                new_scene_list.append(new_shot_list)
-        scenes.append(new_scene_list)
-    return scenes
+    # scene/shot/subshot hierarchy from the sorted segment index instead of nested containment loops
+    index = SegmentIndex.from_txts('scene.txt', 'shot.txt', 'subshot.txt', fps)
+    return index.toc()
 
 # helper utility function for constructing an .mp4 file from .rgb and .wav files
-def write_video(rgb_filepath, audio_filepath, width, height, mp4_filepath=None):
-    frames = []
-
-    if mp4_filepath is None:
-        mp4_filepath = rgb_filepath.replace('.rgb', '.mp4')
-
-    with open(rgb_filepath, "rb") as f:
-        video_data = f.read(height*width*3)
-        while(video_data):
-            frame = np.frombuffer(video_data, dtype=np.uint8).reshape(height, width, 3)
-            frames.append(frame)
-            video_data = f.read(height*width*3)
-
-    clip = ImageSequenceClip(frames, fps=30)
-
-    audio_file = AudioFileClip(audio_filepath)
-
-    final_clip = clip.set_audio(audio_file)
-
-    final_clip.write_videofile(mp4_filepath, codec="libx264")
-
-    return mp4_filepath
+# the frames are streamed to ffmpeg in chunks, the video is never held in memory
+def write_video(rgb_filepath, audio_filepath, width, height, mp4_filepath=None, preset="medium", threads=0):
+    return encode_video(rgb_filepath, audio_filepath, int(width), int(height), mp4_filepath,
+                        preset=preset, threads=threads)
 
 # this class specifically for shot and subshot label in table of contents
 # designed such that when they are clicked, the label can be easily identified
@@ -2,84 +2,13 @@ import argparse
 import sys
 import tempfile
 import cv2
-import numpy as np
-from moviepy.editor import ImageSequenceClip, AudioFileClip
 from PyQt5.QtCore import Qt, QUrl, pyqtSignal
 from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
 from PyQt5.QtWidgets import *
 from PyQt5.QtMultimediaWidgets import QVideoWidget
-from backend import transnetv2, detect_shot_v2_1, detect_scene_v2_1
-
-
-def get_scenes_shots_subshots(rgb_filepath, mp4_filepath):
-    # saves results as scene.txt, shot.txt, subshot.txt
-
-    # # for shot detection
-    detect_shot_v2_1.main(mp4_filepath)
-
-    # for scene detection
-    detect_scene_v2_1.main(rgb_filepath)
-
-    # for sub-shot detection
-    with open("shot.txt", "r") as input:
-        file = open("subshot.txt", "w")
-        file.close()
-        for line in input:
-            param = line.strip().split(' ')
-            start_frame = int(param[0])
-            end_frame = int(param[1])
-            if end_frame - start_frame < 250:
-                continue
-            transnetv2.main(mp4_filepath, start_frame, end_frame)
-
-
-def convert_txts_to_timestamps(fps=30):
-    scenes = []
-
-    scenes_np = np.loadtxt('scene.txt').astype(np.int)
-    shots_np = np.loadtxt('shot.txt').astype(np.int)
-    subshots_np = np.loadtxt('subshot.txt').astype(np.int)
-    for scene in scenes_np:
-        start_scene, end_scene = scene
-        new_scene_list = []
-        for shot in shots_np:
-            start_shot, end_shot = shot
-            if start_shot >= start_scene and end_shot <= end_scene:
-                timestamp_ms = round((start_shot / fps) * 1000.)
-                new_shot_list = [timestamp_ms]
-                for subshot in subshots_np:
-                    start_subshot, end_subshot = subshot
-                    if start_subshot >= start_shot and end_subshot <= end_shot:
-                        timestamp_ms = round((start_subshot / fps) * 1000.)
-                        new_shot_list.append(timestamp_ms)
-                new_scene_list.append(new_shot_list)
-        scenes.append(new_scene_list)
-    return scenes
-
-
-# helper utility function for constructing an .mp4 file from .rgb and .wav files
-def write_video(rgb_filepath, audio_filepath, width, height, mp4_filepath=None):
-    frames = []
-
-    if mp4_filepath is None:
-        mp4_filepath = rgb_filepath.replace('.rgb', '.mp4')
-
-    with open(rgb_filepath, "rb") as f:
-        video_data = f.read(height * width * 3)
-        while (video_data):
-            frame = np.frombuffer(video_data, dtype=np.uint8).reshape(height, width, 3)
-            frames.append(frame)
-            video_data = f.read(height * width * 3)
-
-    clip = ImageSequenceClip(frames, fps=30)
-
-    audio_file = AudioFileClip(audio_filepath)
-
-    final_clip = clip.set_audio(audio_file)
-
-    final_clip.write_videofile(mp4_filepath, codec="libx264")
-
-    return mp4_filepath
+from backend import profiling
+from backend.segmentation import segmentation_stages
+from backend.segmentation_result import job_dir
 
 
 # this class specifically for shot and subshot label in table of contents
@@ -275,15 +204,30 @@ def main():
     parser.add_argument('--width', default=480)
     parser.add_argument('--height', default=270)
     parser.add_argument('--mp4file', help='Optionally, Skip generating a .mp4 if it already exists in this path')
+    parser.add_argument('--output-dir', help='Directory for the segmentation results, results/<video name> by default')
+    parser.add_argument('--txt', action='store_true', help='Also write scene.txt, shot.txt and subshot.txt to the output directory')
+    parser.add_argument('--preset', default='medium', help='x264 preset used to encode the .mp4')
+    parser.add_argument('--threads', type=int, default=0, help='Encoder threads, 0 picks them automatically')
+    parser.add_argument('--shot-size', choices=['240x135', '120x68', '48x27'],
+                        help='Score shots on this level of the analysis proxy instead of the full resolution .mp4')
+    parser.add_argument('--force', nargs='*', default=[], metavar='STAGE',
+                        help='Run these stages (encode, shot, scene, subshot, timestamps) even if they are up to date')
+    parser.add_argument('--profile', metavar='TRACE', help='Time the stages, write a Chrome trace to TRACE and print a summary')
     args = parser.parse_args()
-
-    if not args.mp4file:
-        mp4_filepath = write_video(args.rgbfile, args.wavfile, args.width, args.height)
-    else:
-        mp4_filepath = args.mp4file
-
-    get_scenes_shots_subshots(args.rgbfile, mp4_filepath)  # saves results as scene.txt, shot.txt, subshot.txt
-    scenes = convert_txts_to_timestamps()
+    if args.profile:
+        profiling.enable(args.profile)
+    output_dir = args.output_dir or job_dir(args.rgbfile)
+
+    # only the stages whose inputs changed since the last run in output_dir are executed,
+    # the v2_1 stages score shots on the .mp4 and group them into scenes on the proxy grid
+    graph = segmentation_stages(args.rgbfile, args.wavfile, output_dir, args.mp4file,
+                                int(args.width), int(args.height), args.txt, args.preset, args.threads,
+                                tuple(int(n) for n in args.shot_size.split('x')) if args.shot_size else None,
+                                version="v2_1")
+    outputs = graph.run(force=args.force)
+    profiling.finish()
+    mp4_filepath = outputs["encode"]
+    scenes = outputs["timestamps"]
 
     app = QApplication(sys.argv)
     player = VideoPlayer(mp4_filepath, scenes)
@@ -2,14 +2,15 @@ import argparse
 import sys
 import tempfile
 import cv2
-import numpy as np
-from moviepy.editor import ImageSequenceClip, AudioFileClip
 from PyQt5.QtCore import Qt, QUrl, pyqtSignal
 from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
 from PyQt5.QtWidgets import *
 from PyQt5.QtMultimediaWidgets import QVideoWidget
-from backend import transnetv2, detect_shot_v2_1, detect_scene_v2_1
+from backend.encode import encode_video
+from backend import transnetv2, detect_shot_v2_1, detect_scene_v2_1, profiling
+from backend.segment_index import SegmentIndex
 
+@profiling.traced("get_scenes_shots_subshots")
 def get_scenes_shots_subshots(rgb_filepath, mp4_filepath):
     # saves results as scene.txt, shot.txt, subshot.txt
 
@@ -19,8 +20,9 @@ def get_scenes_shots_subshots(rgb_filepath, mp4_filepath):
     # for scene detection
     detect_scene_v2_1.main(rgb_filepath)
     
-    # for sub-shot detection
-    with open("shot.txt", "r") as input:
+    # for sub-shot detection, the windows of all long shots go through TransNetV2 in batches
+    shots = []
+    with profiling.span("shot.txt read", category="io"), open("shot.txt", "r") as input:
         file = open("subshot.txt","w")
         file.close()
         for line in input:
@@ -29,55 +31,20 @@ def get_scenes_shots_subshots(rgb_filepath, mp4_filepath):
             end_frame = int(param[1])
             if end_frame-start_frame<250:
                 continue
-            transnetv2.main(mp4_filepath, start_frame, end_frame)
+            shots.append((start_frame, end_frame))
+    transnetv2.main_batched(mp4_filepath, shots)
     
 
 def convert_txts_to_timestamps(fps=30):
-    scenes = []
-
-    scenes_np = np.loadtxt('scene.txt').astype(np.int)
-    shots_np = np.loadtxt('shot.txt').astype(np.int)
-    subshots_np = np.loadtxt('subshot.txt').astype(np.int)
-    for scene in scenes_np:
-        start_scene, end_scene = scene
-        new_scene_list = []
-        for shot in shots_np:
-            start_shot, end_shot = shot
-            if start_shot >= start_scene and end_shot <= end_scene:
-                timestamp_ms = round((start_shot/fps) * 1000.)
-                new_shot_list = [timestamp_ms]
-                for subshot in subshots_np:
-                    start_subshot, end_subshot = subshot
-                    if start_subshot >= start_shot and end_subshot <= end_shot:
-                        timestamp_ms = round((start_subshot/fps) * 1000.)
-                        new_shot_list.append(timestamp_ms)
-                new_scene_list.append(new_shot_list)
-        scenes.append(new_scene_list)
-    return scenes
+    # scene/shot/subshot hierarchy from the sorted segment index instead of nested containment loops
+    index = SegmentIndex.from_txts('scene.txt', 'shot.txt', 'subshot.txt', fps)
+    return index.toc()
 
 # helper utility function for constructing an .mp4 file from .rgb and .wav files
-def write_video(rgb_filepath, audio_filepath, width, height, mp4_filepath=None):
-    frames = []
-
-    if mp4_filepath is None:
-        mp4_filepath = rgb_filepath.replace('.rgb', '.mp4')
-
-    with open(rgb_filepath, "rb") as f:
-        video_data = f.read(height*width*3)
-        while(video_data):
-            frame = np.frombuffer(video_data, dtype=np.uint8).reshape(height, width, 3)
-            frames.append(frame)
-            video_data = f.read(height*width*3)
-
-    clip = ImageSequenceClip(frames, fps=30)
-
-    audio_file = AudioFileClip(audio_filepath)
-
-    final_clip = clip.set_audio(audio_file)
-
-    final_clip.write_videofile(mp4_filepath, codec="libx264")
-
-    return mp4_filepath
+# the frames are streamed to ffmpeg in chunks, the video is never held in memory
+def write_video(rgb_filepath, audio_filepath, width, height, mp4_filepath=None, preset="medium", threads=0):
+    return encode_video(rgb_filepath, audio_filepath, int(width), int(height), mp4_filepath,
+                        preset=preset, threads=threads)
 
 # this class specifically for shot and subshot label in table of contents
 # designed such that when they are clicked, the label can be easily identified
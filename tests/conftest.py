@@ -0,0 +1,40 @@
+import os
+import sys
+
+import cv2
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import benchmark
+
+
+@pytest.fixture(scope="session")
+def clip(tmp_path_factory):
+    # 12 s of synthetic video with hard cuts, dissolves and motion, as BGR frames like cv2 decodes them
+    inputs, truth = benchmark.synthetic_inputs(str(tmp_path_factory.mktemp("clip")), 12)
+    rgb = numpy.fromfile(inputs["rgb"], dtype=numpy.uint8).reshape(-1, benchmark.height, benchmark.width, 3)
+    return inputs["rgb"], numpy.ascontiguousarray(rgb[..., ::-1]), truth
+
+
+@pytest.fixture(scope="session")
+def mp4_clip(clip, tmp_path_factory):
+    # the clip encoded with OpenCV's mp4v, read back through cv2.VideoCapture like the .mp4 of the player
+    _, frames, _ = clip
+    path = str(tmp_path_factory.mktemp("mp4") / "clip.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), benchmark.fps, (benchmark.width, benchmark.height))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    # empty feature cache and proxy directories of the test's own
+    import feature_cache
+    import proxy
+    monkeypatch.setattr(feature_cache, "CACHE_DIR", str(tmp_path / "features"))
+    monkeypatch.setattr(proxy, "PROXY_DIR", str(tmp_path / "proxy"))
+    return tmp_path
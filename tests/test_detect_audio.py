@@ -0,0 +1,35 @@
+import numpy
+
+from detect_audio import refine_scenes
+
+
+SHOTS = [[0, 120], [120, 400], [400, 700], [700, 1000], [1000, 1500]]
+
+
+def test_scene_split_at_shot_near_boundary():
+    # the boundary at 705 is 5 frames from the shot starting at 700, the one at 1250 is not near a shot
+    refined = refine_scenes([[0, 1500]], SHOTS, [705, 1250], tolerance=15, min_scene_len=300)
+    assert refined.tolist() == [[0, 700], [700, 1500]]
+    assert refine_scenes([[0, 1500]], SHOTS, [720], tolerance=15, min_scene_len=300).tolist() == [[0, 1500]]
+
+
+def test_parts_keep_min_scene_len():
+    # 120 is too close to the start of the scene, 1300 to its end
+    refined = refine_scenes([[0, 1500]], SHOTS + [[1300, 1500]], [118, 402, 1000, 1300], tolerance=15,
+                            min_scene_len=300)
+    assert refined.tolist() == [[0, 400], [400, 1000], [1000, 1500]]
+    refined = refine_scenes([[0, 1500]], SHOTS, [118, 402, 1000], tolerance=15, min_scene_len=100)
+    assert refined.tolist() == [[0, 120], [120, 400], [400, 1000], [1000, 1500]]
+
+
+def test_cuts_stay_inside_their_scene():
+    scenes = [[0, 700], [700, 1500]]
+    # a boundary at an existing scene start does not add an empty scene
+    refined = refine_scenes(scenes, SHOTS, [700, 1000], tolerance=15, min_scene_len=300)
+    assert refined.tolist() == [[0, 700], [700, 1000], [1000, 1500]]
+
+
+def test_no_boundaries():
+    scenes = numpy.array([[0, 700], [700, 1500]])
+    assert refine_scenes(scenes, SHOTS, []).tolist() == scenes.tolist()
+    assert refine_scenes(scenes, [], [705]).tolist() == scenes.tolist()
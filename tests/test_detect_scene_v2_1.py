@@ -0,0 +1,36 @@
+import colorsys
+
+import numpy
+
+from detect_scene_v2_1 import quantize
+
+
+# the per-pixel loop of detect_scene_v2_1 before it worked on arrays
+def old_quantize(rgb):
+    values = numpy.zeros(rgb.shape[:-1], dtype=numpy.int64)
+    for index in numpy.ndindex(*rgb.shape[:-1]):
+        r, g, b = (int(c) for c in rgb[index])
+        (h, s, v) = colorsys.rgb_to_hsv(r/255, g/255, b/255)
+        h_val = int(h * 7)
+        s_val = 1 if s > 0.65 else 0
+        v_val = 1 if v > 0.7 else 0
+        values[index] = h_val * 2 * 2 + s_val * 2 + v_val
+    return values
+
+
+def test_quantize_matches_colorsys(clip):
+    rng = numpy.random.default_rng(0)
+    random = rng.integers(0, 256, size=(40, 9, 16, 3), dtype=numpy.uint8)
+    assert (quantize(random) == old_quantize(random)).all()
+    _, frames, _ = clip
+    grid = frames[::25, 0:270:30, 0:480:30, ::-1]
+    assert (quantize(grid) == old_quantize(grid)).all()
+
+
+def test_quantize_edge_values():
+    # grays, primaries, hues next to a bin edge and saturation / value next to their thresholds
+    pixels = numpy.array([[0, 0, 0], [255, 255, 255], [128, 128, 128], [255, 0, 0], [0, 255, 0], [0, 0, 255],
+                          [255, 0, 1], [255, 1, 0], [255, 0, 255], [255, 219, 0], [255, 220, 0],
+                          [178, 62, 62], [179, 63, 63], [178, 100, 100], [179, 179, 178], [1, 0, 0]],
+                         dtype=numpy.uint8)
+    assert (quantize(pixels) == old_quantize(pixels)).all()
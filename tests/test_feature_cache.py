@@ -0,0 +1,72 @@
+import os
+import time
+
+import numpy
+
+import feature_cache
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_content_hash_follows_the_contents(tmp_path):
+    a = write(tmp_path / "a.rgb", b"x" * 100)
+    b = write(tmp_path / "b.rgb", b"x" * 100)
+    assert feature_cache.content_hash(a) == feature_cache.content_hash(b)
+    first = feature_cache.content_hash(a)
+    write(tmp_path / "a.rgb", b"y" * 100)
+    # the remembered hash is not reused for the modified file
+    os.utime(a, ns=(0, os.stat(b).st_mtime_ns + 1))
+    assert feature_cache.content_hash(a) != first
+
+
+def test_save_load_round_trip(tmp_path, caches):
+    video = write(tmp_path / "a.rgb", b"x" * 100)
+    assert feature_cache.load(video, "scores") is None
+    arrays = {"scores": numpy.arange(10, dtype=numpy.float64), "cuts": numpy.array([3, 7])}
+    fn = feature_cache.save(video, "scores", arrays)
+    assert os.path.basename(fn) == "{}_scores.npz".format(feature_cache.content_hash(video))
+    loaded = feature_cache.load(video, "scores")
+    assert sorted(loaded) == ["cuts", "scores"]
+    assert all((loaded[name] == arrays[name]).all() for name in arrays)
+    # another feature of the same video is another file
+    assert feature_cache.load(video, "other") is None
+    with open(fn, "wb") as f:
+        f.write(b"half written")
+    assert feature_cache.load(video, "scores") is None
+
+
+def test_evict_keeps_recently_used(tmp_path, caches):
+    videos = [write(tmp_path / "{}.rgb".format(i), bytes([i]) * 10) for i in range(4)]
+    for i, video in enumerate(videos):
+        fn = feature_cache.save(video, "scores", {"scores": numpy.zeros(1000)})
+        os.utime(fn, (time.time() - 100 + i, time.time() - 100 + i))
+    size = os.path.getsize(feature_cache.cache_file(videos[0], "scores"))
+    # reading the oldest one makes it the most recently used
+    feature_cache.load(videos[0], "scores")
+    feature_cache.evict(2 * size)
+    assert [os.path.exists(feature_cache.cache_file(video, "scores")) for video in videos] == [True, False, False, True]
+
+
+def test_evict_removes_stale_temporary_files(caches):
+    os.makedirs(feature_cache.CACHE_DIR)
+    stale = write(os.path.join(feature_cache.CACHE_DIR, "a_scores.1-2.tmp.npz"), b"x")
+    fresh = write(os.path.join(feature_cache.CACHE_DIR, "b_scores.1-2.tmp.npz"), b"x")
+    old = time.time() - feature_cache.STALE_TMP_SECONDS - 10
+    os.utime(stale, (old, old))
+    feature_cache.evict(0)
+    # a file being saved by another process is left alone
+    assert not os.path.exists(stale) and os.path.exists(fresh)
+
+
+def test_evict_lru_tolerates_missing_files(tmp_path):
+    present = write(tmp_path / "present", b"x")
+    entries = [(1, 10, str(tmp_path / "gone")), (2, 10, present), (3, 10, str(tmp_path / "kept"))]
+    feature_cache.evict_lru(entries, 10)
+    assert not os.path.exists(present)
+    removed = []
+    feature_cache.evict_lru(entries, 25, removed.append)
+    assert removed == [str(tmp_path / "gone")]
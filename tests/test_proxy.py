@@ -0,0 +1,47 @@
+import os
+
+import cv2
+import numpy
+
+import proxy
+
+
+def test_levels_are_area_resizes(clip, caches):
+    rgb_path, frames, _ = clip
+    names = [proxy.level_name((120, 68), "rgb"), proxy.level_name((48, 27), "hsv"), proxy.GRID]
+    levels = proxy.get_proxy(rgb_path, names)
+    assert levels.frame_count == len(frames)
+    rgb = frames[..., ::-1]
+    for i in (0, 45, len(frames) - 1):
+        assert (levels.level((120, 68), "rgb")[i] == cv2.resize(rgb[i], (120, 68), interpolation=cv2.INTER_AREA)).all()
+        small = cv2.resize(rgb[i], (48, 27), interpolation=cv2.INTER_AREA)
+        assert (levels.level((48, 27), "hsv")[i] == cv2.cvtColor(small, cv2.COLOR_RGB2HSV)).all()
+        assert (levels.grid()[i] == rgb[i, 0:270:30, 0:480:30]).all()
+
+
+def test_only_requested_levels_are_built(clip, caches):
+    rgb_path, _, _ = clip
+    levels = proxy.get_proxy(rgb_path, [proxy.level_name((48, 27), "rgb")])
+    assert levels.has(proxy.level_name((48, 27), "rgb"))
+    assert not levels.has(proxy.GRID) and not levels.has(proxy.level_name((240, 135), "hsv"))
+    # a later run adds its levels to the same proxy
+    levels = proxy.get_proxy(rgb_path, proxy.levels_for((120, 68)))
+    assert sorted(os.listdir(levels.directory)) == ["120x68_hsv.npy", "48x27_rgb.npy", "grid_rgb.npy",
+                                                    proxy.MANIFEST_NAME]
+    assert [name for name in os.listdir(proxy.PROXY_DIR) if name.startswith(proxy.BUILD_PREFIX)] == []
+
+
+def test_evict_keeps_current_proxy(clip, caches, tmp_path):
+    rgb_path, _, _ = clip
+    other = str(tmp_path / "other.rgb")
+    with open(rgb_path, "rb") as src, open(other, "wb") as dst:
+        dst.write(src.read()[:480 * 270 * 3 * 30])
+    name = [proxy.level_name((48, 27), "rgb")]
+    current = proxy.get_proxy(rgb_path, name).directory
+    old = proxy.get_proxy(other, name).directory
+    os.utime(current, (0, 0))
+    # a build left by a crashed process
+    crashed = os.path.join(proxy.PROXY_DIR, "{}x-999999999-1".format(proxy.BUILD_PREFIX))
+    os.makedirs(crashed)
+    proxy.evict(1, keep=current)
+    assert os.path.isdir(current) and not os.path.exists(old) and not os.path.exists(crashed)
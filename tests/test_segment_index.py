@@ -0,0 +1,110 @@
+import numpy
+import pytest
+
+from segment_index import SegmentIndex, load_segments
+from segmentation_result import SegmentationResult, MAGIC
+
+
+# convert_txts_to_timestamps of the player before the segment index, on arrays
+def old_toc(scenes, shots, subshots, fps=30):
+    toc = []
+    for start_scene, end_scene in scenes:
+        new_scene_list = []
+        for start_shot, end_shot in shots:
+            if start_shot >= start_scene and end_shot <= end_scene:
+                new_shot_list = [round((start_shot / fps) * 1000.)]
+                for start_subshot, end_subshot in subshots:
+                    if start_subshot >= start_shot and end_subshot <= end_shot:
+                        new_shot_list.append(round((start_subshot / fps) * 1000.))
+                new_scene_list.append(new_shot_list)
+        toc.append(new_scene_list)
+    return toc
+
+
+def partition(rng, start, end, count):
+    # count sorted [start_frame, end_frame] segments covering start..end
+    cuts = numpy.sort(rng.choice(numpy.arange(start + 1, end), size=count - 1, replace=False))
+    edges = numpy.concatenate([[start], cuts, [end]])
+    return [[int(a), int(b) - 1] for a, b in zip(edges[:-1], edges[1:])]
+
+
+def hierarchy(seed):
+    rng = numpy.random.default_rng(seed)
+    scenes = partition(rng, 0, 3000, 6)
+    shots = [shot for start, end in scenes for shot in partition(rng, start, end + 1, int(rng.integers(1, 5)))]
+    subshots = [sub for start, end in shots if end - start > 250
+                for sub in partition(rng, start, end + 1, int(rng.integers(2, 4)))]
+    # detectors do not always line up, a shot across two scenes and a subshot across two shots
+    shots.append([scenes[1][1] - 10, scenes[2][0] + 10])
+    subshots.append([shots[0][1] - 5, shots[1][0] + 5])
+    return scenes, shots, subshots
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_toc_matches_nested_loops(seed):
+    scenes, shots, subshots = hierarchy(seed)
+    # sorted like the txt files, the index sorts by itself
+    assert SegmentIndex(scenes, shots, subshots).toc() == old_toc(scenes, sorted(shots), sorted(subshots))
+    rng = numpy.random.default_rng(seed)
+    assert SegmentIndex(scenes, rng.permutation(shots), rng.permutation(subshots)).toc() == \
+        old_toc(scenes, sorted(shots), sorted(subshots))
+
+
+def test_find_and_locate():
+    index = SegmentIndex([[0, 99], [100, 199]], [[0, 49], [50, 99], [100, 199]], [[50, 74], [75, 99]])
+    assert index.locate(0) == (0, 0, -1)
+    assert index.locate(80) == (0, 1, 1)
+    assert index.locate(150) == (1, 2, -1)
+    assert index.locate(200) == (-1, -1, -1)
+    assert index.find_time("shot", 50 / 30 * 1000) == 1
+    assert list(index.children("scene", 0)) == [0, 1]
+    assert index.parent("subshot", 0) == 1
+
+
+def test_empty_levels(tmp_path):
+    assert load_segments(str(tmp_path / "missing.txt")).shape == (0, 2)
+    index = SegmentIndex([[0, 99]], [], [])
+    assert index.toc() == [[]]
+    assert index.locate(5) == (0, -1, -1)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_result_round_trip(tmp_path, mmap):
+    scenes, shots, subshots = hierarchy(0)
+    metadata = {"fps": 30, "frame_count": 3000, "params": {"shot": {"size": None}}, "rgb": "a.rgb"}
+    result = SegmentationResult({"scene": scenes, "shot": shots, "subshot": subshots, "empty": []}, metadata)
+    path = result.save(str(tmp_path / "out" / "segments.seg"))
+    loaded = SegmentationResult.load(path, mmap=mmap)
+    assert loaded.metadata == metadata
+    for level in ("scene", "shot", "subshot", "empty"):
+        assert loaded[level].dtype == numpy.int64
+        assert (numpy.asarray(loaded[level]) == result[level]).all()
+        assert loaded[level].shape == result[level].shape
+    # a view of the read-only mapping, or a copy read into memory
+    assert loaded["shot"].flags.writeable != mmap
+    assert loaded.index().toc() == result.index().toc()
+    # no temporary file is left next to it
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["segments.seg"]
+
+
+def test_result_txt_round_trip(tmp_path):
+    scenes, shots, subshots = hierarchy(1)
+    result = SegmentationResult({"scene": scenes, "shot": shots, "subshot": subshots})
+    result.export_txt(str(tmp_path))
+    loaded = SegmentationResult.from_txts(str(tmp_path))
+    for level in ("scene", "shot", "subshot"):
+        assert (loaded[level] == result[level]).all()
+
+
+def test_result_rejects_other_files(tmp_path):
+    path = tmp_path / "segments.seg"
+    path.write_bytes(b"not a result file")
+    with pytest.raises(ValueError):
+        SegmentationResult.load(str(path))
+    SegmentationResult({"scene": [[0, 1]]}).save(str(path))
+    data = bytearray(path.read_bytes())
+    # a newer format version
+    data[len(MAGIC)] = 99
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        SegmentationResult.load(str(path))
@@ -0,0 +1,159 @@
+import math
+
+import cv2
+import numpy
+import pytest
+
+import shot_scores
+
+
+# the frame-list shot detection of detect_shot before it moved to shot_scores,
+# kept as the reference the rolling-window scorer has to match
+def old_prepare_scores(frames):
+    scoreList = []
+    for frameNum, frame in enumerate(frames):
+        hue, sat, lum = cv2.split(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV))
+        if frameNum == 0:
+            prevHue, prevSat, prevLum = hue, sat, lum
+            continue
+        scoreList.append((shot_scores.MSE(hue, prevHue) + shot_scores.MSE(sat, prevSat)
+                          + shot_scores.MSE(lum, prevLum)) / 3)
+    avg = sum(scoreList) / len(scoreList)
+    var = 0
+    for score in scoreList:
+        var += (avg - score) * (avg - score)
+    return math.sqrt(var / len(scoreList))
+
+
+def old_split_frames(sd, frames, start, end):
+    cutList = []
+    frameList = []
+    cut = False
+    for frameNum in range(start, end):
+        hue, sat, lum = cv2.split(cv2.cvtColor(frames[frameNum], cv2.COLOR_BGR2HSV))
+        if frameNum == start:
+            prevHue, prevSat, prevLum = hue, sat, lum
+            continue
+        score = (shot_scores.MSE(hue, prevHue) + shot_scores.MSE(sat, prevSat) + shot_scores.MSE(lum, prevLum)) / 3
+        if score > sd + 2.5 and not cut:
+            cut = True
+            changeH, changeS, changeL = prevHue, prevSat, prevLum
+            frameList.append([score, frameNum])
+        elif cut and len(frameList) < 15:
+            score1 = (shot_scores.MSE(hue, changeH) + shot_scores.MSE(sat, changeS)
+                      + shot_scores.MSE(lum, changeL)) / 3
+            frameList.append([score1, frameNum])
+        elif cut and len(frameList) == 15:
+            maxScore = -1
+            maxFrameNum = -1
+            countFive = 0
+            for arr in frameList:
+                if arr[0] > maxScore:
+                    maxScore = arr[0]
+                    if countFive < 5:
+                        maxFrameNum = arr[1]
+                        countFive += 1
+            cutList.append(maxFrameNum)
+            cut = False
+            frameList = []
+        prevHue, prevSat, prevLum = hue, sat, lum
+    return cutList
+
+
+def frames_reader(frames):
+    def read(start, end):
+        for frame_num in range(start, min(end, len(frames))):
+            yield frame_num, cv2.cvtColor(frames[frame_num], cv2.COLOR_BGR2HSV), None
+    return read
+
+
+def serial_scores(frames):
+    scores = shot_scores.ShotScorer()
+    for frame_num, frame in enumerate(frames):
+        scores.process(frame_num, cv2.cvtColor(frame, cv2.COLOR_BGR2HSV))
+    scores.finish(len(frames))
+    scores.revisit(frames_reader(frames))
+    return scores
+
+
+def test_rolling_window_matches_frame_list(clip):
+    _, frames, truth = clip
+    scores = serial_scores(frames)
+    sd = old_prepare_scores(frames)
+    assert scores.sd == pytest.approx(sd, rel=1e-12, abs=1e-12)
+    ranges = [(0, len(frames))] + [tuple(shot) for shot in truth["shots"]]
+    for start, end in ranges:
+        assert shot_scores.split_scores(sd, scores, start, end) == old_split_frames(sd, frames, start, end)
+    assert shot_scores.split_scores(sd, scores, 0, len(frames))
+    # only the frames after cut starts are compared again
+    assert len(scores.lags) <= len(scores.cut_starts()) * (shot_scores.WINDOW - 1)
+    # the real sd finds the synthetic cuts, sd = 0 starts a cut search at every frame above 2.5
+    scores.sd = 0
+    scores.revisit(frames_reader(frames))
+    for start, end in ranges:
+        assert shot_scores.split_scores(0, scores, start, end) == old_split_frames(0, frames, start, end)
+
+
+def test_parallel_chunks_match_serial(clip):
+    rgb_path, frames, _ = clip
+    serial = serial_scores(frames)
+    # small chunks so that cut searches cross chunk borders
+    for workers, chunk_frames in ((3, 50), (2, 97)):
+        parallel = shot_scores.parallel_scores(rgb_path, workers=workers, chunk_frames=chunk_frames)
+        assert parallel.frame_count == serial.frame_count
+        assert parallel.scoreList == serial.scoreList
+        assert parallel.firstScores == serial.firstScores
+        assert parallel.lags == serial.lags
+        assert parallel.sd == serial.sd
+
+
+def test_shot_detectors_do_not_share_cache_entries(mp4_clip, caches):
+    import detect_shot
+    import detect_shot_v2_1
+    import feature_cache
+    shots = detect_shot_v2_1.main(mp4_clip, txt_dir=None)
+    # the ShotScorer arrays cached by detect_shot_v2_1 have no frame times, detect_shot reads its own
+    assert (detect_shot.main(mp4_clip, scenes=[(0, int(shots[-1][1]))], txt_dir=None) == shots).all()
+    assert feature_cache.load(mp4_clip, detect_shot.ShotDetector.feature) is not None
+
+
+def test_proxy_scores_keep_scorer_and_detector_apart(clip, caches):
+    import detect_shot
+    import proxy
+    rgb_path, _, _ = clip
+    size = (120, 68)
+    hsv = proxy.get_proxy(rgb_path, proxy.levels_for(size)).level(size, 'hsv')
+    # run_videoplayer_v2_1.1 scores with ShotScorer, the final player with ShotDetector, on the same video
+    scorer = shot_scores.proxy_scores(rgb_path, hsv, shot_scores.ShotScorer(size=size))
+    detector = shot_scores.proxy_scores(rgb_path, hsv, detect_shot.ShotDetector(size=size))
+    assert scorer.feature != detector.feature
+    assert detector.scoreList == scorer.scoreList and len(detector.timeList) == len(scorer.scoreList)
+    cached = shot_scores.proxy_scores(rgb_path, hsv, detect_shot.ShotDetector(size=size))
+    assert cached.timeList == detector.timeList and cached.lags == scorer.lags
+
+
+def test_parallel_chunks_of_mp4_match_serial(mp4_clip):
+    # chunks of a compressed video start by seeking with CAP_PROP_POS_FRAMES
+    cap = cv2.VideoCapture(mp4_clip)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if frame is None:
+            break
+        frames.append(frame)
+    cap.release()
+    serial = serial_scores(frames)
+    for workers, chunk_frames in ((3, 50), (2, 97)):
+        parallel = shot_scores.parallel_scores(mp4_clip, workers=workers, chunk_frames=chunk_frames)
+        assert parallel.frame_count == serial.frame_count == len(frames)
+        assert parallel.scoreList == serial.scoreList
+        assert parallel.firstScores == serial.firstScores
+        assert parallel.lags == serial.lags
+
+
+def test_scenes_split_on_processes_match_serial(clip):
+    _, frames, truth = clip
+    scores = serial_scores(frames)
+    scenes = [tuple(shot) for shot in truth["shots"]] + [(0, len(frames) - 1), (17, 301)]
+    serial = [shot_scores.split_scores(scores.sd, scores, start, end) for start, end in scenes]
+    assert shot_scores.split_scenes_parallel(scores.sd, scores, scenes, workers=2) == serial
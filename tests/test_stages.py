@@ -0,0 +1,115 @@
+import os
+
+import numpy
+import pytest
+
+from stages import StageGraph
+
+
+class Crash(Exception):
+    pass
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def pipeline(tmp_path, calls, threshold=1, crash_at=None):
+    # raw -> double -> total, double's output only depends on the input file,
+    # total's only on double's output and the threshold
+    raw = str(tmp_path / "raw.bin")
+
+    def double(outputs, journal):
+        calls.append("double")
+        return numpy.frombuffer(open(raw, "rb").read(), dtype=numpy.uint8).astype(numpy.int64) * 2
+
+    def total(outputs, journal):
+        calls.append("total")
+        values = []
+        for i, value in enumerate(outputs["double"].tolist()):
+            if (i,) in journal:
+                values.append(journal[(i,)])
+                continue
+            if i == crash_at:
+                raise Crash()
+            calls.append(i)
+            values.append(value * threshold)
+            journal.record((i,), values[-1])
+        return {"sum": sum(values)}
+
+    graph = StageGraph(str(tmp_path / "out"))
+    graph.add("double", double, inputs={"raw": raw})
+    graph.add("total", total, deps=("double",), params={"threshold": threshold})
+    return graph
+
+
+def test_up_to_date_stages_are_skipped(tmp_path):
+    write(tmp_path / "raw.bin", bytes([1, 2, 3]))
+    calls = []
+    first = pipeline(tmp_path, calls).run()
+    assert first["total"] == {"sum": 12} and calls.count("double") == 1 and calls.count("total") == 1
+    graph = pipeline(tmp_path, calls)
+    second = graph.run()
+    assert graph.executed == []
+    assert (second["double"] == first["double"]).all() and second["total"] == first["total"]
+    assert calls.count("double") == 1 and calls.count("total") == 1
+
+
+def test_param_change_reruns_the_stage(tmp_path):
+    write(tmp_path / "raw.bin", bytes([1, 2, 3]))
+    pipeline(tmp_path, []).run()
+    graph = pipeline(tmp_path, [], threshold=2)
+    assert graph.run()["total"] == {"sum": 24}
+    assert graph.executed == ["total"]
+
+
+def test_unchanged_output_does_not_rerun_downstream(tmp_path):
+    raw = write(tmp_path / "raw.bin", bytes([1, 2, 3]))
+    pipeline(tmp_path, []).run()
+    # a new input file the first stage gives the same output for
+    os.remove(raw)
+    write(tmp_path / "raw.bin", bytes([1, 2, 3]))
+    graph = pipeline(tmp_path, [])
+    graph.run()
+    assert graph.executed == []
+    write(tmp_path / "raw.bin", bytes([1, 2, 4]))
+    graph = pipeline(tmp_path, [])
+    assert graph.run()["total"] == {"sum": 14}
+    assert graph.executed == ["double", "total"]
+
+
+def test_force_and_modified_artifacts_rerun(tmp_path):
+    write(tmp_path / "raw.bin", bytes([1, 2, 3]))
+    pipeline(tmp_path, []).run()
+    graph = pipeline(tmp_path, [])
+    graph.run(force=["total"])
+    assert graph.executed == ["total"]
+    artifact = graph.manifest["double"]["artifact"]
+    numpy.save(artifact, numpy.array([7, 7, 7]))
+    graph = pipeline(tmp_path, [])
+    assert (graph.run()["double"] == [2, 4, 6]).all()
+    # the output came out the same as recorded, total is still up to date
+    assert graph.executed == ["double"]
+
+
+def test_journal_resumes_after_crash(tmp_path):
+    write(tmp_path / "raw.bin", bytes([1, 2, 3, 4]))
+    calls = []
+    with pytest.raises(Crash):
+        pipeline(tmp_path, calls, crash_at=2).run()
+    assert calls == ["double", "total", 0, 1]
+    calls = []
+    graph = pipeline(tmp_path, calls)
+    assert graph.run()["total"] == {"sum": 20}
+    # double was recorded before the crash, total only redoes the unfinished items
+    assert calls == ["total", 2, 3]
+    assert not os.path.exists(str(tmp_path / "out" / "stages" / "total.journal"))
+    # a journal of another key is not reused
+    calls = []
+    with pytest.raises(Crash):
+        pipeline(tmp_path, calls, threshold=3, crash_at=1).run()
+    calls = []
+    pipeline(tmp_path, calls, threshold=5).run()
+    assert calls == ["total", 0, 1, 2, 3]
@@ -0,0 +1,100 @@
+import os
+import shutil
+
+import numpy
+import pytest
+
+import proxy
+import transnetv2
+
+# the sub-shots read their 48x27 frames from the analysis proxy (an INTER_AREA resize of the .rgb),
+# the per-shot code read them from ffmpeg's scaling of the encoded .mp4. the two are not the same
+# frames: they differ by a few levels per pixel on average, and the sub-shots found on them may be
+# a frame or two apart
+PROXY_MEAN_LEVELS = 6
+SUBSHOT_FRAMES = 2
+
+
+class PixelBackend:
+    # stands in for the model in the window tests: the prediction of a frame only depends on that frame,
+    # so a window scattered back to the wrong shot or position changes the result
+    def predict(self, frames):
+        mean = frames.mean(axis=(2, 3, 4), dtype=numpy.float64)[..., None] / 255
+        return mean.astype(numpy.float32), (1 - mean).astype(numpy.float32)
+
+
+def pixel_model():
+    model = transnetv2.TransNetV2.__new__(transnetv2.TransNetV2)
+    model._input_size = (27, 48, 3)
+    model.backend = "pixel"
+    model._backend = PixelBackend()
+    return model
+
+
+def shots_of(truth, frame_count):
+    # the synthetic shots, shots spanning several of them and the whole clip
+    shots = [tuple(shot) for shot in truth["shots"]]
+    return shots + [(shots[0][0], shots[-1][1] - 40), (37, frame_count - 11), (0, frame_count)]
+
+
+def proxy_frames(rgb_path):
+    return proxy.get_proxy(rgb_path, [proxy.level_name((48, 27), 'rgb')]).level((48, 27), 'rgb')
+
+
+def ffmpeg_available():
+    try:
+        import ffmpeg
+    except ModuleNotFoundError:
+        return False
+    return shutil.which("ffmpeg") is not None
+
+
+def test_batched_windows_match_per_shot(clip, caches):
+    rgb_path, _, truth = clip
+    frames = proxy_frames(rgb_path)
+    shots = shots_of(truth, len(frames))
+    model = pixel_model()
+    for batch_size in (1, 3, 16):
+        batched = model.predict_frames_batched([frames[start:end] for start, end in shots], batch_size)
+        for (start, end), (single, all_) in zip(shots, batched):
+            ref_single, ref_all = model.predict_frames(frames[start:end])
+            assert len(single) == end - start
+            assert (single == ref_single).all() and (all_ == ref_all).all()
+
+
+def test_batched_subshots_match_per_shot(clip, caches):
+    pytest.importorskip("tensorflow")
+    rgb_path, _, truth = clip
+    frames = proxy_frames(rgb_path)
+    shots = shots_of(truth, len(frames))
+    subshots = transnetv2.shot_subshots(rgb_path, shots, frames, use_cache=False)
+    model = transnetv2.get_model()
+    for (start, end), scenes in zip(shots, subshots):
+        single, _ = model.predict_frames(numpy.asarray(frames[start:end]))
+        assert (scenes == model.predictions_to_scenes(single, start_frame=start)).all()
+
+
+@pytest.mark.skipif(not ffmpeg_available(), reason="needs ffmpeg and ffmpeg-python")
+def test_proxy_frames_close_to_mp4_frames(clip, caches):
+    from encode import encode_video
+    rgb_path, _, _ = clip
+    mp4_path = encode_video(rgb_path, os.path.splitext(rgb_path)[0] + ".wav",
+                            mp4_filepath=str(caches / "clip.mp4"))
+    decoded = transnetv2.TransNetV2.__new__(transnetv2.TransNetV2).read_video(mp4_path)
+    mapped = proxy_frames(rgb_path)
+    assert decoded.shape == mapped.shape
+    assert numpy.abs(decoded.astype(numpy.int64) - mapped.astype(numpy.int64)).mean() < PROXY_MEAN_LEVELS
+
+
+@pytest.mark.skipif(not ffmpeg_available(), reason="needs ffmpeg and ffmpeg-python")
+def test_subshots_of_proxy_close_to_mp4(clip, caches):
+    pytest.importorskip("tensorflow")
+    from encode import encode_video
+    rgb_path, _, _ = clip
+    mp4_path = encode_video(rgb_path, os.path.splitext(rgb_path)[0] + ".wav",
+                            mp4_filepath=str(caches / "clip.mp4"))
+    model = transnetv2.get_model()
+    from_mp4 = model.predictions_to_scenes(model.predict_frames(model.read_video(mp4_path))[0])
+    from_proxy = model.predictions_to_scenes(model.predict_frames(numpy.asarray(proxy_frames(rgb_path)))[0])
+    assert from_mp4.shape == from_proxy.shape
+    assert numpy.abs(from_mp4 - from_proxy).max() <= SUBSHOT_FRAMES